@@ -0,0 +1,78 @@
+# Check that propagating the parameter dependencies through the
+# DependencyGraph gives the same parameters as recomputing every dependent
+# parameter in configuration order, including for a depends_on function that
+# reads one of its inputs through **extras (flagged with depends_on_all), and
+# that the other functions are skipped when their inputs do not change.
+
+import numpy as np
+from prospect.models import priors, transforms
+from prospect.models.parameters import ProspectorParams
+
+
+def dust1_from_extras(dust2=0.0, **extras):
+    """dust1 from dust2 and dust_ratio, where dust_ratio is only available
+    through **extras.
+    """
+    return transforms.dustratio_to_dust1(dust2=dust2, **extras)
+
+
+def full_recompute(model, params):
+    """Evaluate every depends_on function in configuration order.
+    """
+    for p, info in list(model.config_dict.items()):
+        if 'depends_on' in info:
+            params[p] = np.atleast_1d(info['depends_on'](**params))
+    return params
+
+
+if __name__ == "__main__":
+
+    agebins = np.array([[0., 8.], [8., 9.], [9., 10.]])
+    config = {"zred": {"N": 1, "isfree": True, "init": 0.1,
+                       "prior": priors.TopHat(mini=0.0, maxi=2.0)},
+              "tage_tuniv": {"N": 1, "isfree": True, "init": 0.5,
+                             "prior": priors.TopHat(mini=0.1, maxi=1.0)},
+              "tage": {"N": 1, "isfree": False, "init": 1.0,
+                       "depends_on": transforms.tage_from_tuniv},
+              "dust2": {"N": 1, "isfree": True, "init": 0.3,
+                        "prior": priors.TopHat(mini=0.0, maxi=2.0)},
+              "dust_ratio": {"N": 1, "isfree": True, "init": 1.0,
+                             "prior": priors.TopHat(mini=0.0, maxi=2.0)},
+              "dust1": {"N": 1, "isfree": False, "init": 0.0,
+                        "depends_on": dust1_from_extras,
+                        "depends_on_all": True},
+              "total_mass": {"N": 1, "isfree": True, "init": 1e10,
+                             "prior": priors.LogUniform(mini=1e8, maxi=1e12)},
+              "z_fraction": {"N": 2, "isfree": True, "init": np.zeros(2) + 0.5,
+                             "prior": priors.Beta(mini=0, maxi=1,
+                                                  alpha=np.ones(2),
+                                                  beta=np.ones(2))},
+              "agebins": {"N": 3, "isfree": False, "init": agebins},
+              "mass": {"N": 3, "isfree": False, "init": np.ones(3),
+                       "depends_on": transforms.zfrac_to_masses}}
+    model = ProspectorParams(config)
+
+    rng = np.random.RandomState(42)
+    theta = model.theta.copy()
+    ncheck = 0
+    for i in range(500):
+        # change one free parameter at a time, so most functions can be skipped
+        k = rng.choice(model.free_params)
+        u = rng.uniform(size=model.ndim)
+        new = model.prior_transform(u)
+        theta[model.theta_index[k]] = new[model.theta_index[k]]
+        model.set_parameters(theta)
+        expected = full_recompute(model, dict(model.params))
+        for p in model.params:
+            assert np.allclose(model.params[p], expected[p]), (i, k, p)
+        ncheck += 1
+
+    graph = model.dependency_graph
+    print("checked {} parameter vectors".format(ncheck))
+    print("{:>12} {:>8} {:>8}".format("parameter", "ncalls", "nskip"))
+    for p in graph.order:
+        print("{:>12} {:>8} {:>8}".format(p, graph.timing[p][0],
+                                          graph.nskip[p]))
+    for p in ["tage", "mass"]:
+        assert graph.nskip[p] > 0, "{} was never skipped".format(p)
+    assert graph.nskip["dust1"] == 0
@@ -0,0 +1,92 @@
+# Check that FFT smoothing with a padded layout (fftpad="reflect",
+# nsigma_pad=5) agrees with the default unpadded layout away from the edges,
+# and that both agree with the direct (non-FFT) convolution, for a well
+# sampled spectrum with absorption lines.  The differences are from the
+# linear interpolation onto and off the regular FFT grids, which have
+# different lengths for the two layouts.  Then show that for a noisy
+# spectrum the layouts differ at the level of the pixel-scale noise, which
+# is resampled onto grids of different lengths, and that the direct
+# convolution differs from both by a similar amount.  Finally, for output
+# wavelengths reaching the ends of the input spectrum, check that near the
+# edges the padded layout is closer to the direct convolution than the
+# unpadded one, whose FFT wraps around.
+
+import numpy as np
+from prospect.utils.smoothing import smoothspec, Smoother, ckms
+
+
+def compare(wave, spec, sigma, outwave, label):
+    direct = smoothspec(wave, spec, sigma, outwave=outwave, smoothtype='vel',
+                        fftsmooth=False)
+    unpadded = smoothspec(wave, spec, sigma, outwave=outwave, smoothtype='vel')
+    padded = smoothspec(wave, spec, sigma, outwave=outwave, smoothtype='vel',
+                        fftpad='reflect', nsigma_pad=5.0)
+    smoother = Smoother(wave, outwave=outwave, smoothtype='vel', resolution=sigma,
+                        fftpad='reflect', nsigma_pad=5.0)
+    assert np.allclose(smoother(spec, sigma), padded, rtol=1e-12, atol=0)
+    # more than 10 kernel widths from the ends of outwave
+    x = np.log(outwave)
+    inner = (x > x[0] + 10 * sigma / ckms) & (x < x[-1] - 10 * sigma / ckms)
+    diffs = [np.abs(padded / unpadded - 1)[inner].max(),
+             np.abs(unpadded / direct - 1)[inner].max(),
+             np.abs(padded / direct - 1)[inner].max()]
+    print("{:>10s} sigma={:5.0f}: padded/unpadded {:.1e}, unpadded/direct {:.1e}, "
+          "padded/direct {:.1e}".format(label, sigma, *diffs))
+    return diffs
+
+
+def compare_edges(wave, spec, sigma, outwave, label):
+    direct = smoothspec(wave, spec, sigma, outwave=outwave, smoothtype='vel',
+                        fftsmooth=False)
+    unpadded = smoothspec(wave, spec, sigma, outwave=outwave, smoothtype='vel')
+    padded = smoothspec(wave, spec, sigma, outwave=outwave, smoothtype='vel',
+                        fftpad='reflect', nsigma_pad=5.0)
+    # within 3 kernel widths of the ends of outwave
+    x = np.log(outwave)
+    edge = (x < x[0] + 3 * sigma / ckms) | (x > x[-1] - 3 * sigma / ckms)
+    diffs = [np.abs(unpadded / direct - 1)[edge].max(),
+             np.abs(padded / direct - 1)[edge].max()]
+    print("{:>10s} sigma={:5.0f} edges: unpadded/direct {:.1e}, "
+          "padded/direct {:.1e}".format(label, sigma, *diffs))
+    return diffs
+
+
+if __name__ == "__main__":
+
+    lines = [4102., 4340., 4861., 5175., 5890., 6563.]
+    outwave = np.arange(4000., 7000., 1.0)
+
+    # Well sampled spectra, regular in wavelength and in ln(wavelength)
+    for label, wave in [("linear", np.arange(3500., 7500., 0.5)),
+                        ("ln-lambda", np.exp(np.arange(np.log(3500.), np.log(7500.), 1e-4)))]:
+        spec = (wave / 5000.)**-1.
+        for line in lines:
+            spec *= 1 - 0.5 * np.exp(-0.5 * ((wave - line) / 3.)**2)
+        for sigma in [100., 200., 400.]:
+            diffs = compare(wave, spec, sigma, outwave, label)
+            assert max(diffs) < 5e-3
+
+    # Output on the ln-lambda input grid, where the padded layout does no
+    # resampling; the remaining differences above are from interpolation
+    owave = wave[100:-100]
+    for sigma in [100., 200., 400.]:
+        diffs = compare(wave, spec, sigma, owave, "on-grid")
+        assert diffs[2] < 1e-8
+
+    # Noisy spectrum: differences are set by the resampling of the noise
+    rng = np.random.RandomState(0)
+    wave = np.arange(3500., 7500., 0.9)
+    spec = 1 + 0.3 * np.sin(wave / 50.) + 0.1 * rng.normal(size=len(wave))
+    for sigma in [150., 400.]:
+        compare(wave, spec, sigma, outwave, "noisy")
+
+    # Output reaching the ends of the sloped input spectra
+    outwave = np.arange(3510., 7490., 1.0)
+    for label, wave in [("linear", np.arange(3500., 7500., 0.5)),
+                        ("ln-lambda", np.exp(np.arange(np.log(3500.), np.log(7500.), 1e-4)))]:
+        spec = (wave / 5000.)**-1.
+        for line in lines:
+            spec *= 1 - 0.5 * np.exp(-0.5 * ((wave - line) / 3.)**2)
+        for sigma in [100., 200., 400.]:
+            unpadded, padded = compare_edges(wave, spec, sigma, outwave, label)
+            assert padded < unpadded
@@ -0,0 +1,62 @@
+# Check that the photometry computed on a regular ln-lambda grid with
+# LnGridProjector agrees with the exact projection of the redshifted spectrum
+# with project_filters, for a finely sampled continuum with narrow emission
+# lines, at several redshifts.
+
+import numpy as np
+from prospect.utils.photometry import project_filters, project_filters_lngrid
+from prospect.sources.constants import lightspeed
+
+
+class MockFilter(object):
+    """A Gaussian filter with the attributes used by the projectors.
+    """
+
+    def __init__(self, center, width, name=''):
+        self.name = name
+        self.wavelength = np.linspace(center - 5 * width, center + 5 * width, 500)
+        self.transmission = np.exp(-0.5 * ((self.wavelength - center) / width)**2)
+        # AB zeropoint in the same units as the projections
+        fab = 3631e-23 * lightspeed / self.wavelength**2
+        y = self.wavelength * self.transmission * fab
+        self.ab_zero_counts = np.sum(0.5 * (y[1:] + y[:-1]) * np.diff(self.wavelength))
+
+
+def lngrid(filters):
+    """The ln-lambda grid that ``fix_obs`` would build for these filters.
+    """
+    wmin = np.min([f.wavelength.min() for f in filters])
+    wmax = np.max([f.wavelength.max() for f in filters])
+    dlnlam = np.min([np.min(np.gradient(f.wavelength) / f.wavelength)
+                     for f in filters])
+    # fix_obs uses the filter sampling, which is never finer than ~1e-3
+    dlnlam = max(dlnlam, 1e-3)
+    return np.exp(np.arange(np.log(wmin), np.log(wmax) + dlnlam, dlnlam))
+
+
+if __name__ == "__main__":
+
+    # Restframe spectrum, sampled more finely than the ln-lambda grid
+    wave = np.arange(2000., 12000., 0.9)
+    flam = 1e-17 * (wave / 5000.)**-1.5
+    for line, flux in [(3727., 5e-15), (4861., 2e-15), (5007., 6e-15)]:
+        flam += flux / np.sqrt(2 * np.pi) / 1.5 * np.exp(-0.5 * ((wave - line) / 1.5)**2)
+
+    filters = [MockFilter(4500., 300., 'blue'), MockFilter(5800., 300., 'green'),
+               MockFilter(8000., 600., 'red')]
+    grid = lngrid(filters)
+
+    zreds = np.array([0.0, 0.05, 0.1, 0.15, 0.2, 0.3])
+    a = 1 + zreds
+    # all redshifts at once
+    batch = project_filters_lngrid(wave, flam, filters, grid, a=a)
+    worst = 0.0
+    for i, ai in enumerate(a):
+        exact = project_filters(wave * ai, flam / ai, filters)
+        single = project_filters_lngrid(wave, flam, filters, grid, a=ai)
+        assert np.allclose(single, batch[i], rtol=1e-12, atol=0)
+        err = single / exact - 1
+        worst = max(worst, np.abs(err).max())
+        print("z={:.2f}: fractional errors {}".format(zreds[i], err))
+    assert worst < 1e-3, "ln-lambda grid photometry differs by {}".format(worst)
+    print("Largest fractional error: {:.2e}".format(worst))
@@ -0,0 +1,62 @@
+# Compare the time to compute a NoiseModel likelihood for the dense,
+# banded (Wendland), and semiseparable (celerite) code paths, as a function
+# of the number of pixels.
+
+import time
+import numpy as np
+from prospect.likelihood import NoiseModel
+from prospect.likelihood.kernels import (Uncorrelated, Matern, Wendland,
+                                         CeleriteMatern)
+
+
+def make_model(kernel):
+    return NoiseModel(metric_name='wavelength', mask_name='mask',
+                      kernels=[Uncorrelated(['unc_factor']), kernel],
+                      weight_by=['unc', 'unc'])
+
+
+def time_model(nm, vectors, residual, ntry=3):
+    """Time compute + lnlikelihood, changing the kernel amplitude each time so
+    that the cached factorization is not reused.
+    """
+    dt = []
+    for i in range(ntry):
+        nm.update(unc_factor=1.0, gp_amplitude=0.1 * (1 + i), gp_length=20.0)
+        t = time.time()
+        nm.compute(**vectors)
+        lnp = nm.lnlikelihood(residual)
+        dt.append(time.time() - t)
+    return np.min(dt), lnp
+
+
+if __name__ == "__main__":
+
+    kernels = {'dense': Matern(['gp_amplitude', 'gp_length']),
+               'banded': Wendland(['gp_amplitude', 'gp_length']),
+               'semiseparable': CeleriteMatern(['gp_amplitude', 'gp_length'])}
+    dense_wendland = make_model(Wendland(['gp_amplitude', 'gp_length']))
+    dense_wendland.max_band_fraction = 0.0
+    # The celerite kernel, forced onto the dense path or the semiseparable
+    # path, to find the crossover used for NoiseModel.min_semiseparable_size
+    dense_celerite = make_model(CeleriteMatern(['gp_amplitude', 'gp_length']))
+    dense_celerite.min_semiseparable_size = np.inf
+    semiseparable = make_model(kernels['semiseparable'])
+    semiseparable.min_semiseparable_size = 0
+
+    print('{:>8} {:>12} {:>12} {:>12} {:>14} {:>12}'.format('npix', 'dense', 'banded',
+                                                          'dense(W)', 'semiseparable',
+                                                          'dense(C)'))
+    for npix in [250, 500, 1000, 2000, 4000]:
+        rng = np.random.RandomState(npix)
+        wave = np.linspace(3800, 9200, npix)
+        unc = np.zeros(npix) + 0.1
+        residual = rng.normal(0, 0.1, size=npix)
+        vectors = {'wavelength': wave, 'unc': unc, 'mask': slice(None)}
+        out = []
+        for name in ['dense', 'banded']:
+            out.append(time_model(make_model(kernels[name]), vectors, residual)[0])
+        # The same Wendland kernel, forced onto the dense path
+        out.append(time_model(dense_wendland, vectors, residual)[0])
+        out.append(time_model(semiseparable, vectors, residual)[0])
+        out.append(time_model(dense_celerite, vectors, residual)[0])
+        print('{:8d} {:12.5f} {:12.5f} {:12.5f} {:14.5f} {:12.5f}'.format(npix, *out))
@@ -0,0 +1,78 @@
+# Compare the time for ProspectorParams.prior_transform and prior_product
+# using the closed-form prior methods with the time using the scipy.stats
+# distributions of each prior.
+
+import time
+import numpy as np
+from prospect.models import priors
+from prospect.models.parameters import ProspectorParams
+
+
+def scipy_transform(model, unit_coords):
+    """prior_transform, calling the scipy.stats ppf of each prior.
+    """
+    theta = np.zeros(len(unit_coords))
+    for k, inds in list(model.theta_index.items()):
+        p = model.config_dict[k]['prior']
+        theta[inds] = p.distribution.ppf(unit_coords[inds], *p.args,
+                                         loc=p.loc, scale=p.scale)
+    return theta
+
+
+def scipy_product(model, theta):
+    """prior_product, calling the scipy.stats logpdf of each prior.
+    """
+    lnp = 0
+    for k, inds in list(model.theta_index.items()):
+        p = model.config_dict[k]['prior']
+        lnp += np.sum(p.distribution.logpdf(theta[inds], *p.args,
+                                            loc=p.loc, scale=p.scale))
+    return lnp
+
+
+def time_call(func, args, ntry=3):
+    dt = []
+    for i in range(ntry):
+        t = time.time()
+        for a in args:
+            func(a)
+        dt.append(time.time() - t)
+    return np.min(dt) / len(args)
+
+
+if __name__ == "__main__":
+
+    config = {"logmass": {"N": 1, "isfree": True, "init": 10,
+                          "prior": priors.TopHat(mini=8, maxi=12)},
+              "logzsol": {"N": 1, "isfree": True, "init": -0.5,
+                          "prior": priors.ClippedNormal(mean=-0.3, sigma=0.5,
+                                                        mini=-2, maxi=0.2)},
+              "dust2": {"N": 1, "isfree": True, "init": 0.3,
+                        "prior": priors.Beta(mini=0, maxi=2, alpha=1.5, beta=4)},
+              "dust_ratio": {"N": 1, "isfree": True, "init": 1.0,
+                             "prior": priors.LogNormal(mode=0, sigma=0.3)},
+              "tau": {"N": 1, "isfree": True, "init": 1.0,
+                      "prior": priors.LogUniform(mini=0.1, maxi=30)},
+              "logsfr_ratios": {"N": 5, "isfree": True, "init": np.zeros(5),
+                                "prior": priors.StudentT(mean=np.zeros(5),
+                                                         scale=0.3 * np.ones(5),
+                                                         df=2 * np.ones(5))},
+              "zred": {"N": 1, "isfree": True, "init": 0.1,
+                       "prior": priors.Normal(mean=0.1, sigma=0.01)}}
+    model = ProspectorParams(config)
+
+    rng = np.random.RandomState(42)
+    units = rng.uniform(size=(2000, model.ndim))
+    thetas = np.array([model.prior_transform(u) for u in units])
+    assert np.allclose(thetas, [scipy_transform(model, u) for u in units])
+
+    print("ndim = {}".format(model.ndim))
+    fmt = "{:>16} {:>12.1f} us {:>12.1f} us {:>8.1f}x"
+    print("{:>16} {:>15} {:>15} {:>9}".format("", "scipy", "closed form",
+                                              "speedup"))
+    ts = time_call(lambda u: scipy_transform(model, u), units)
+    tf = time_call(model.prior_transform, units)
+    print(fmt.format("prior_transform", ts * 1e6, tf * 1e6, ts / tf))
+    ts = time_call(lambda x: scipy_product(model, x), thetas)
+    tf = time_call(model.prior_product, thetas)
+    print(fmt.format("prior_product", ts * 1e6, tf * 1e6, ts / tf))
@@ -26,7 +26,7 @@ def run_nestle_sampler(lnprobfn, model, verbose=True,
                        nestle_maxcall=int(1e6), nestle_update_interval=None,
                        **kwargs):
 
-    result = nestle.sample(lnprobfn, model.prior_transform, model.ndim,
+    result = nestle.sample(lnprobfn, model.prior_transformer, model.ndim,
                            method=nestle_method, npoints=nestle_npoints,
                            callback=callback, maxcall=nestle_maxcall,
                            update_interval=nestle_update_interval)
@@ -1,5 +1,6 @@
 from .likelihood import *
 from .noise_model import *
 
-__all__ = ["lnlike_spec", "lnlike_phot", "NoiseModel"]
+__all__ = ["lnlike_spec", "lnlike_phot", "lnlike_spec_batch", "lnlike_phot_batch",
+           "NoiseModel"]
 
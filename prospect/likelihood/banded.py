@@ -0,0 +1,71 @@
+# Banded linear algebra for covariance matrices built from compactly
+# supported kernels on a sorted metric.  The cost of the factorization is
+# O(N b^2) for bandwidth b, instead of O(N^3).
+
+import numpy as np
+from scipy.linalg import cholesky_banded, cho_solve_banded
+
+__all__ = ["BandedFactor", "bandwidth"]
+
+
+def bandwidth(metric, support):
+    """The number of off-diagonal elements of the covariance matrix that can
+    be nonzero in each row, for a sorted metric and a kernel that is zero for
+    separations of ``support`` or more.
+    """
+    metric = np.asarray(metric)
+    last = np.searchsorted(metric, metric + support, side='left') - 1
+    return int(np.max(last - np.arange(len(metric))))
+
+
+class BandedFactor(object):
+    """The Cholesky factorization of a banded covariance matrix, stored in
+    the upper banded form used by ``scipy.linalg.cholesky_banded``.
+
+    :param metric:
+        The (sorted) metric, ndarray of shape ``(N,)``.
+
+    :param diag:
+        The diagonal of the covariance matrix that is *not* included in the
+        terms (e.g. the uncorrelated noise variance), ndarray of shape
+        ``(N,)``.
+
+    :param terms:
+        A list of ``(kernel_function, support, weights)`` tuples, where
+        ``kernel_function(tau)`` gives the covariance at separation ``tau``,
+        which is zero for ``tau >= support``, and ``weights`` is ``None`` or an
+        ndarray of shape ``(N,)`` multiplying the term on both sides.
+    """
+
+    def __init__(self, metric, diag, terms, check_finite=False):
+        t = np.asarray(metric, dtype=np.float64)
+        if np.any(np.diff(t) < 0):
+            raise ValueError("The metric must be sorted for a banded "
+                             "covariance matrix.")
+        self.n = len(t)
+        self.u = max([bandwidth(t, support) for (_, support, _) in terms] + [0])
+        u = self.u
+        # ab[u + i - j, j] = K[i, j] for i <= j
+        ab = np.zeros([u + 1, self.n])
+        ab[u] += diag
+        for (kernel_function, support, weights) in terms:
+            w = np.ones(self.n) if weights is None else np.asarray(weights)
+            for k in range(u + 1):
+                tau = t[k:] - t[:self.n - k]
+                ab[u - k, k:] += kernel_function(tau) * w[k:] * w[:self.n - k]
+        self.cb = cholesky_banded(ab, lower=False, check_finite=check_finite)
+        self.log_det = 2 * np.sum(np.log(self.cb[u]))
+
+    def solve(self, y, check_finite=False):
+        """Solve :math:`K x = y` for ``x``.
+
+        :param y:
+            ndarray of shape ``(N,)`` or ``(N, K)``
+        """
+        return cho_solve_banded((self.cb, False), y, check_finite=check_finite)
+
+    def quad(self, y):
+        """Compute :math:`y^T K^{-1} y`, for each column of ``y`` if it is
+        2-d.
+        """
+        return np.sum(y * self.solve(y), axis=0)
@@ -1,6 +1,7 @@
 import numpy as np
 
-__all__ = ["Kernel", "Uncorrelated", "ExpSquared", "Matern"]
+__all__ = ["Kernel", "Uncorrelated", "ExpSquared", "Matern",
+           "SemiseparableKernel", "CeleriteMatern", "CeleriteSHO", "Wendland"]
 
 
 class Kernel(object):
@@ -94,6 +95,133 @@ class Matern(Kernel):
         return Sigma
 
 
+class SemiseparableKernel(Kernel):
+    """Base class for kernels that are sums of terms of the form
+
+    .. math::
+
+        k(\tau) = e^{-c \tau} [a \cos(d \tau) + b \sin(d \tau)]
+
+    for :math:`\tau = |x_n - x_m|`.  For a sorted 1-d metric the covariance
+    matrix can then be factorized in O(N) operations, see
+    :py:class:`prospect.likelihood.semiseparable.SemiseparableFactor`, which
+    :py:class:`prospect.likelihood.NoiseModel` does automatically.
+    Subclasses must implement :py:meth:`coefficients`.
+    """
+
+    ndim = 2
+    semiseparable = True
+
+    def coefficients(self):
+        """Return a list of ``(a, b, c, d)`` tuples, one for each term.
+        """
+        raise(NotImplementedError)
+
+    def construct_kernel(self, metric):
+        """Construct the dense covariance matrix.
+        """
+        tau = np.abs(metric[:, None] - metric[None, :])
+        Sigma = np.zeros_like(tau)
+        for (a, b, c, d) in self.coefficients():
+            Sigma += np.exp(-c * tau) * (a * np.cos(d * tau) + b * np.sin(d * tau))
+        return Sigma
+
+
+class CeleriteMatern(SemiseparableKernel):
+    """An approximation to the Matern kernel for :math:`\nu=3/2`, as a
+    semiseparable kernel.  The approximation is
+
+    .. math::
+
+        k(\tau) = a^2 e^{-c \tau} [\cos(\epsilon \tau) + \frac{c}{\epsilon} \sin(\epsilon \tau)]
+
+    with :math:`c = \sqrt{3}/l`, which tends to the Matern kernel
+    :math:`a^2 (1 + c \tau) e^{-c \tau}` for :math:`\epsilon \ll c`.
+
+    :param eps: (optional, default: 0.01)
+        The value of :math:`\epsilon`, in units of :math:`c`
+    """
+
+    npars = 2
+    kernel_params = ['amplitude', 'length']
+
+    def __init__(self, parnames=[], name='', eps=0.01):
+        super(CeleriteMatern, self).__init__(parnames=parnames, name=name)
+        self.eps = eps
+
+    def coefficients(self):
+        a, l = self.params['amplitude'], self.params['length']
+        c = np.sqrt(3) / np.squeeze(l)
+        eps = self.eps * c
+        amp2 = np.squeeze(a)**2
+        return [(amp2, amp2 * c / eps, c, eps)]
+
+
+class CeleriteSHO(SemiseparableKernel):
+    """The kernel of a stochastically driven, damped simple harmonic
+    oscillator, as a semiseparable kernel.  The parameters are the
+    ``amplitude`` (so that :math:`k(0)` is the square of the amplitude), the
+    undamped ``period`` :math:`2\pi/\omega_0` in units of the metric, and
+    the ``quality`` factor :math:`Q`.  Small :math:`Q` gives smooth,
+    overdamped correlations, large :math:`Q` gives quasi-periodic ones.
+    """
+
+    npars = 3
+    kernel_params = ['amplitude', 'period', 'quality']
+
+    def coefficients(self):
+        amp2 = np.squeeze(self.params['amplitude'])**2
+        w0 = 2 * np.pi / np.squeeze(self.params['period'])
+        Q = np.squeeze(self.params['quality'])
+        if Q > 0.5:
+            f = np.sqrt(4 * Q**2 - 1)
+            return [(amp2, amp2 / f, w0 / (2 * Q), w0 * f / (2 * Q))]
+        elif Q < 0.5:
+            f = np.sqrt(1 - 4 * Q**2)
+            return [(0.5 * amp2 * (1 + 1 / f), 0., 0.5 * w0 / Q * (1 - f), 0.),
+                    (0.5 * amp2 * (1 - 1 / f), 0., 0.5 * w0 / Q * (1 + f), 0.)]
+        else:
+            # critically damped: amp2 * (1 + w0 tau) exp(-w0 tau)
+            eps = 0.01 * w0
+            return [(amp2, amp2 * w0 / eps, w0, eps)]
+
+
+class Wendland(Kernel):
+    """A compactly supported Wendland kernel (:math:`\phi_{3,1}`),
+
+    .. math::
+
+        k(\tau) = a^2 (1 - r)_+^4 (4 r + 1), \quad r = \tau / l
+
+    which is zero for separations larger than the ``length`` parameter
+    :math:`l`.  For a sorted 1-d metric the covariance matrix is banded, and
+    :py:class:`prospect.likelihood.NoiseModel` factorizes it in O(N b^2)
+    operations for bandwidth b.
+    """
+
+    ndim = 2
+    npars = 2
+    compact = True
+    kernel_params = ['amplitude', 'length']
+
+    def support(self):
+        """The separation beyond which the kernel is zero.
+        """
+        return float(np.squeeze(self.params['length']))
+
+    def kernel_function(self, tau):
+        """The covariance as a function of separation.
+        """
+        a, l = self.params['amplitude'], self.params['length']
+        r = np.clip(np.abs(tau) / l, 0, 1)
+        return a**2 * (1 - r)**4 * (4 * r + 1)
+
+    def construct_kernel(self, metric):
+        """Construct the dense covariance matrix.
+        """
+        return self.kernel_function(metric[:, None] - metric[None, :])
+
+
 class Outliers(Kernel):
     kernel_params = ['amplitude', 'location']
 
@@ -2,7 +2,54 @@ import time, sys, os
 import numpy as np
 from scipy.linalg import LinAlgError
 
-__all__ = ["lnlike_spec", "lnlike_phot", "chi_spec", "chi_phot", "write_log"]
+from ..utils.caching import LRUCache
+
+__all__ = ["lnlike_spec", "lnlike_phot", "lnlike_spec_batch", "lnlike_phot_batch",
+           "chi_spec", "chi_phot", "write_log"]
+
+
+# Masked inverse variances and normalizations for recently used obs
+# dictionaries, keyed on the id of the obs dictionary.  Entries keep
+# references to the obs dictionary and to the uncertainty and mask arrays, so
+# ids are not reused while an entry exists and an entry is only used for the
+# same array objects.
+_simple_noise = LRUCache(maxsize=8)
+
+
+def simple_noise(obs, unc_name='unc', mask_name='mask'):
+    """Get the masked inverse variances and the normalization of the simple
+    (uncorrelated) gaussian likelihood for an obs dictionary, computing them
+    only once for each uncertainty and mask array.  If the uncertainties or
+    the mask are modified in place rather than replaced, the cache must be
+    emptied with ``_simple_noise.clear()``.
+
+    :param obs:
+        A dictionary of the observational data.
+
+    :param unc_name: (optional, default: "unc")
+        The key of the uncertainty vector in ``obs``, e.g. ``"maggies_unc"``
+
+    :param mask_name: (optional, default: "mask")
+        The key of the (optional) mask in ``obs``, e.g. ``"phot_mask"``
+
+    :returns ivar:
+        The inverse variances of the unmasked pixels.
+
+    :returns lnnorm:
+        The normalization :math:`-\frac{1}{2}\sum \ln(2\pi\sigma^2)`
+    """
+    unc, mask = obs[unc_name], obs.get(mask_name)
+    key = (id(obs), unc_name, mask_name)
+    entry = _simple_noise.get(key)
+    if (entry is not None) and (entry[1] is unc) and (entry[2] is mask):
+        return entry[3:]
+    if mask is None:
+        var = unc**2
+    else:
+        var = unc[mask]**2
+    ivar, lnnorm = 1.0 / var, -0.5 * np.log(2 * np.pi * var).sum()
+    _simple_noise[key] = obs, unc, mask, ivar, lnnorm
+    return ivar, lnnorm
 
 
 def lnlike_spec(spec_mu, obs=None, spec_noise=None, **vectors):
@@ -54,8 +101,8 @@ def lnlike_spec(spec_mu, obs=None, spec_noise=None, **vectors):
                 return np.nan_to_num(-np.inf)
         else:
             # simple noise model
-            var = (obs['unc'][mask])**2
-            lnp = -0.5*( (delta**2/var).sum() + np.log(2*np.pi*var).sum() )
+            ivar, lnnorm = simple_noise(obs, 'unc', 'mask')
+            lnp = -0.5 * (delta**2 * ivar).sum() + lnnorm
             return lnp
 
 
@@ -110,11 +157,145 @@ def lnlike_phot(phot_mu, obs=None, phot_noise=None, **vectors):
             return np.nan_to_num(-np.inf)
     else:
         # simple noise model
-        var = (obs['maggies_unc'][mask])**2
-        lnp = -0.5*( (delta**2/var).sum() + np.log(2*np.pi*var).sum() )
+        ivar, lnnorm = simple_noise(obs, 'maggies_unc', 'phot_mask')
+        lnp = -0.5 * (delta**2 * ivar).sum() + lnnorm
         return lnp
 
 
+def lnlike_spec_batch(spec_mu, obs=None, spec_noise=None, noise_params=None,
+                      **vectors):
+    """Calculate the likelihoods of the spectroscopic data given a batch of
+    model spectra, as :py:func:`lnlike_spec`.
+
+    :param spec_mu:
+        The mean model spectra, ndarray of shape ``(N, nwave)``.
+
+    :param obs:
+        A dictionary of the observational data, as for :py:func:`lnlike_spec`.
+
+    :param spec_noise: (optional)
+        A NoiseModel object.  If ``noise_params`` is given, or any of the
+        ``vectors`` are 2-d with one row per model, the noise model is
+        computed for each model separately, otherwise it is computed once
+        for the whole batch with the current kernel parameters.
+
+    :param noise_params: (optional)
+        A sequence of ``N`` parameter dictionaries, one per model, passed to
+        ``spec_noise.update()`` before computing the likelihood of that
+        model.  If not given, all the models share the current kernel
+        parameters of ``spec_noise``, so this must be supplied when the
+        kernel parameters vary across the batch.
+
+    :param vectors: (optional)
+        A dictionary of vectors of shape ``(nwave,)`` or ``(N, nwave)`` giving
+        possible weighting functions for the kernels.
+
+    :returns lnlikelihood:
+        ndarray of shape ``(N,)``
+    """
+    spec_mu = np.atleast_2d(spec_mu)
+    if obs['spectrum'] is None:
+        return np.zeros(len(spec_mu))
+
+    mask = obs.get('mask', slice(None))
+    vectors['mask'] = mask
+    vectors['wavelength'] = obs['wavelength']
+    delta = (obs['spectrum'] - spec_mu)[:, mask]
+
+    if spec_noise is not None:
+        return noise_lnlike_batch(spec_noise, delta, noise_params=noise_params,
+                                  **vectors)
+    else:
+        # simple noise model
+        ivar, lnnorm = simple_noise(obs, 'unc', 'mask')
+        return -0.5 * np.dot(delta**2, ivar) + lnnorm
+
+
+def lnlike_phot_batch(phot_mu, obs=None, phot_noise=None, noise_params=None,
+                      **vectors):
+    """Calculate the likelihoods of the photometric data given a batch of
+    model SEDs, as :py:func:`lnlike_phot`.
+
+    :param phot_mu:
+        The mean model seds, in linear flux units (i.e. maggies).  ndarray of
+        shape ``(N, nfilters)``
+
+    :param obs:
+        A dictionary of the observational data, as for :py:func:`lnlike_phot`.
+
+    :param phot_noise: (optional)
+        A ``prospect.likelihood.NoiseModel`` object.  See
+        :py:func:`lnlike_spec_batch`.
+
+    :param noise_params: (optional)
+        A sequence of ``N`` parameter dictionaries, one per model, for
+        ``phot_noise``.  See :py:func:`lnlike_spec_batch`.
+
+    :param vectors:
+        A dictionary of vectors of shape ``(nfilters,)`` or ``(N, nfilters)``
+        for constructing weighted covariance matrices.
+
+    :returns lnlikelihood:
+        ndarray of shape ``(N,)``
+    """
+    phot_mu = np.atleast_2d(phot_mu)
+    if obs['maggies'] is None:
+        return np.zeros(len(phot_mu))
+
+    mask = obs.get('phot_mask', slice(None))
+    delta = (obs['maggies'] - phot_mu)[:, mask]
+
+    if phot_noise is not None:
+        filternames = [f.name for f in obs['filters']]
+        vectors['mask'] = mask
+        vectors['filternames'] = np.array(filternames)
+        return noise_lnlike_batch(phot_noise, delta, noise_params=noise_params,
+                                  **vectors)
+    else:
+        # simple noise model
+        ivar, lnnorm = simple_noise(obs, 'maggies_unc', 'phot_mask')
+        return -0.5 * np.dot(delta**2, ivar) + lnnorm
+
+
+def noise_lnlike_batch(noise, delta, noise_params=None, **vectors):
+    """Likelihoods of a batch of residuals under a NoiseModel.  Vectors that
+    are 2-d with one row per residual vector are used row by row.  A row
+    whose covariance matrix cannot be factorized gets a very small
+    likelihood, without affecting the other rows.
+
+    :param delta:
+        Masked residuals, ndarray of shape ``(N, npix)``
+
+    :param noise_params: (optional)
+        A sequence of ``N`` parameter dictionaries used to update the noise
+        model before computing the likelihood of each row.
+    """
+    nbatch = len(delta)
+    perrow = [k for k, v in vectors.items()
+              if (k != 'mask') and (np.ndim(v) == 2) and (len(v) == nbatch)]
+    if (len(perrow) == 0) and (noise_params is None):
+        try:
+            noise.compute(**vectors)
+            return noise.lnlikelihood(delta)
+        except(LinAlgError):
+            return np.zeros(nbatch) + np.nan_to_num(-np.inf)
+
+    if noise_params is not None:
+        assert len(noise_params) == nbatch
+    lnp = np.zeros(nbatch)
+    for i in range(nbatch):
+        if noise_params is not None:
+            noise.update(**noise_params[i])
+        vecs = dict(vectors)
+        vecs.update({k: vectors[k][i] for k in perrow})
+        try:
+            noise.compute(**vecs)
+            lnp[i] = noise.lnlikelihood(delta[i])
+        except(LinAlgError):
+            lnp[i] = np.nan_to_num(-np.inf)
+    return lnp
+
+
 def chi_phot(phot_mu, obs, **extras):
     """Return a vector of chi values, for use in non-linear least-squares
     algorithms.
@@ -1,38 +1,91 @@
 import numpy as np
 from scipy.linalg import cho_factor, cho_solve
 
+from ..utils.caching import LRUCache, hashable
+from .semiseparable import SemiseparableFactor
+from .banded import BandedFactor, bandwidth
+
 __all__ = ["NoiseModel"]
 
 
 class NoiseModel(object):
 
+    # Use banded factorizations if the bandwidth is less than this fraction
+    # of the number of points.
+    max_band_fraction = 0.25
+    # Use semiseparable factorizations only for at least this many points.
+    # The O(N) recursions are python loops, so for small N a dense Cholesky
+    # factorization can be faster; the crossover depends on the machine (see
+    # misc/timing_noise_model.py).
+    min_semiseparable_size = 500
+
     def __init__(self, metric_name='', mask_name='mask', kernels=[],
-                 weight_by=[]):
+                 weight_by=[], cache_size=4):
+        """
+        :param cache_size: (optional, default: 4)
+            The number of factorized covariance matrices to keep.  These are
+            keyed on the kernel parameters, the metric, and the weight
+            vectors, so that :py:meth:`compute` is cheap when none of these
+            has changed since a previous call.
+        """
         assert len(kernels) == len(weight_by)
         self.kernels = kernels
         self.weight_names = weight_by
         self.metric_name = metric_name
         self.mask_name = mask_name
+        self._factorizations = LRUCache(maxsize=cache_size)
 
     def update(self, **params):
         [k.update(**params) for k in self.kernels]
 
+    def active_kernels(self):
+        """Indices of the kernels that contribute to the covariance, i.e. that
+        do not have an ``amplitude`` parameter equal to zero.  If no kernel
+        contributes all of them are returned.
+        """
+        active = [i for i, k in enumerate(self.kernels)
+                  if np.any(k.params.get('amplitude', 1.0) != 0)]
+        if len(active) == 0:
+            active = list(range(len(self.kernels)))
+        return active
+
     def construct_covariance(self, **vectors):
         """Construct a covariance matrix from a metric, a list of kernel
-        objects, and a list of weight vectors (of same length as the metric)
+        objects, and a list of weight vectors (of same length as the metric).
+        Kernels with zero amplitude are skipped, so if only uncorrelated
+        kernels contribute the result is the 1-d vector of variances and no
+        N x N matrix is formed.
         """
         metric = vectors[self.metric_name]
         mask = vectors.get('mask', slice(None))
+        active = self.active_kernels()
 
         # 1 = uncorrelated errors, 2 = covariance matrix, >2 undefined
-        ndmax = np.array([k.ndim for k in self.kernels]).max()
+        ndmax = np.array([self.kernels[i].ndim for i in active]).max()
         Sigma = np.zeros(ndmax * [metric[mask].shape[0]])
 
         weight_vectors = self.get_weights(**vectors)
-        for i, (kernel, wght) in enumerate(zip(self.kernels, weight_vectors)):
-            Sigma += kernel(metric[mask], weights=wght, ndim=ndmax)
+        for i in active:
+            Sigma += self.kernels[i](metric[mask], weights=weight_vectors[i],
+                                     ndim=ndmax)
         return Sigma
 
+    def cache_key(self, **vectors):
+        """A key identifying the covariance matrix that would be constructed
+        from the current kernel parameters and the given vectors.
+        """
+        metric = vectors[self.metric_name]
+        mask = vectors.get('mask', slice(None))
+        weight_vectors = self.get_weights(**vectors)
+        key = [hashable(metric[mask])]
+        for i in self.active_kernels():
+            kernel = self.kernels[i]
+            key.append((i, kernel.__class__.__name__,
+                        tuple((p, hashable(kernel.params[p]))
+                              for p in kernel.kernel_params),
+                        hashable(weight_vectors[i])))
+        return tuple(key)
+
     def get_weights(self, **vectors):
         """From a dictionary of vectors that give weights, pull the vectors
         that correspond to each kernel, as stored in the `weight_names`
@@ -49,29 +102,133 @@ class NoiseModel(object):
 
     def compute(self, check_finite=False, **vectors):
         """Build and cache the covariance matrix, and if it is 2-d factorize it
-        and cache that.  Also cache ``log_det``.
+        and cache that.  Also cache ``log_det``.  If the kernel parameters,
+        metric, and weight vectors are the same as for a recent call, the
+        stored factorization is reused.
         """
-        self.Sigma = self.construct_covariance(**vectors)
-        if self.Sigma.ndim > 1:
-            self.factorized_Sigma = cho_factor(self.Sigma, overwrite_a=True,
-                                               check_finite=check_finite)
-            self.log_det = 2 * np.sum(np.log(np.diag(self.factorized_Sigma[0])))
-            assert np.isfinite(self.log_det)
+        key = self.cache_key(**vectors)
+        try:
+            self.Sigma, self.factorized_Sigma, self.log_det = self._factorizations[key]
+            return
+        except(KeyError):
+            pass
+
+        if self.use_semiseparable(**vectors):
+            # O(N) factorization
+            self.factorized_Sigma = self.semiseparable_factor(**vectors)
+            self.Sigma = self.factorized_Sigma.D
+            self.log_det = self.factorized_Sigma.log_det
+        elif self.use_banded(**vectors):
+            # O(N b^2) factorization
+            self.factorized_Sigma = self.banded_factor(check_finite=check_finite,
+                                                       **vectors)
+            self.Sigma = self.factorized_Sigma.cb[-1]
+            self.log_det = self.factorized_Sigma.log_det
         else:
-            self.log_det = np.sum(np.log(self.Sigma))
+            self.Sigma = self.construct_covariance(**vectors)
+            self.factorized_Sigma = None
+            if self.Sigma.ndim > 1:
+                self.factorized_Sigma = cho_factor(self.Sigma, overwrite_a=True,
+                                                   check_finite=check_finite)
+                self.log_det = 2 * np.sum(np.log(np.diag(self.factorized_Sigma[0])))
+                assert np.isfinite(self.log_det)
+            else:
+                self.log_det = np.sum(np.log(self.Sigma))
+        self._factorizations[key] = self.Sigma, self.factorized_Sigma, self.log_det
+
+    def use_semiseparable(self, **vectors):
+        """Whether the covariance can be factorized in O(N) operations, which
+        is the case when every contributing 2-d kernel is a
+        :py:class:`prospect.likelihood.kernels.SemiseparableKernel`, the
+        (masked) metric is sorted, and there are at least
+        ``min_semiseparable_size`` points.
+        """
+        kernels = [self.kernels[i] for i in self.active_kernels()]
+        twod = [k for k in kernels if k.ndim > 1]
+        if (len(twod) == 0) or not all([getattr(k, 'semiseparable', False)
+                                        for k in twod]):
+            return False
+        mask = vectors.get('mask', slice(None))
+        metric = vectors[self.metric_name][mask]
+        return ((metric.ndim == 1) and (len(metric) >= self.min_semiseparable_size)
+                and np.all(np.diff(metric) >= 0))
+
+    def semiseparable_factor(self, **vectors):
+        """Factorize the covariance matrix in O(N) operations.  The 1-d
+        kernels give the diagonal, and each semiseparable kernel gives
+        one or more terms.
+
+        :returns factor:
+            A :py:class:`prospect.likelihood.semiseparable.SemiseparableFactor`
+        """
+        mask = vectors.get('mask', slice(None))
+        metric = vectors[self.metric_name][mask]
+        weight_vectors = self.get_weights(**vectors)
+        diag, terms = np.zeros(len(metric)), []
+        for i in self.active_kernels():
+            kernel, wght = self.kernels[i], weight_vectors[i]
+            if kernel.ndim > 1:
+                terms += [coeffs + (wght,) for coeffs in kernel.coefficients()]
+            else:
+                diag += kernel(metric, weights=wght, ndim=1)
+        return SemiseparableFactor(metric, diag, terms)
+
+    def use_banded(self, **vectors):
+        """Whether the covariance matrix is banded, and narrow enough that a
+        banded factorization is faster.  This is the case when every
+        contributing 2-d kernel has compact support (e.g.
+        :py:class:`prospect.likelihood.kernels.Wendland`), the (masked) metric
+        is sorted, and the bandwidth is less than ``max_band_fraction`` of the
+        number of points.
+        """
+        kernels = [self.kernels[i] for i in self.active_kernels()]
+        twod = [k for k in kernels if k.ndim > 1]
+        if (len(twod) == 0) or not all([getattr(k, 'compact', False)
+                                        for k in twod]):
+            return False
+        mask = vectors.get('mask', slice(None))
+        metric = vectors[self.metric_name][mask]
+        if (metric.ndim != 1) or np.any(np.diff(metric) < 0):
+            return False
+        band = max([bandwidth(metric, k.support()) for k in twod])
+        return band < self.max_band_fraction * len(metric)
+
+    def banded_factor(self, check_finite=False, **vectors):
+        """Factorize the banded covariance matrix in O(N b^2) operations.
+
+        :returns factor:
+            A :py:class:`prospect.likelihood.banded.BandedFactor`
+        """
+        mask = vectors.get('mask', slice(None))
+        metric = vectors[self.metric_name][mask]
+        weight_vectors = self.get_weights(**vectors)
+        diag, terms = np.zeros(len(metric)), []
+        for i in self.active_kernels():
+            kernel, wght = self.kernels[i], weight_vectors[i]
+            if kernel.ndim > 1:
+                terms.append((kernel.kernel_function, kernel.support(), wght))
+            else:
+                diag += kernel(metric, weights=wght, ndim=1)
+        return BandedFactor(metric, diag, terms, check_finite=check_finite)
 
     def lnlikelihood(self, residual, check_finite=False, **extras):
         """Compute the ln of the likelihood, using the current factorized
         covariance matrix.
 
-        :param residual: ndarray, shape (nwave,)
-            Vector of residuals (y_data - mean_model).
+        :param residual: ndarray, shape (nwave,) or (N, nwave)
+            Vector of residuals (y_data - mean_model), or N such vectors.
+
+        :returns lnlike:
+            Scalar, or ndarray of shape (N,) for 2-d ``residual``
         """
-        n = len(residual)
+        n = residual.shape[-1]
         assert n == self.Sigma.shape[0]
-        if self.Sigma.ndim > 1:
-            first_term = np.dot(residual, cho_solve(self.factorized_Sigma,
-                                residual, check_finite=check_finite))
+        r = residual.T
+        if isinstance(self.factorized_Sigma, (SemiseparableFactor, BandedFactor)):
+            first_term = self.factorized_Sigma.quad(r)
+        elif self.Sigma.ndim > 1:
+            first_term = np.sum(r * cho_solve(self.factorized_Sigma, r,
+                                              check_finite=check_finite), axis=0)
         else:
             first_term = np.dot(residual**2, 1.0/self.Sigma)
 
@@ -0,0 +1,112 @@
+# O(N) linear algebra for covariance matrices of the form
+#
+#   K = diag(A) + tril(U V^T) + triu(V U^T)
+#
+# where the off-diagonal elements are sums of terms
+#
+#   K_nm = w_n w_m exp(-c |t_n - t_m|) [a cos(d (t_n - t_m)) + b sin(d |t_n - t_m|)]
+#
+# on a sorted metric t.  This follows the celerite algorithm of
+# Foreman-Mackey et al. 2017 (AJ, 154, 220), with the exponential factors
+# applied as a preconditioner between neighboring points for stability.
+
+import numpy as np
+from scipy.linalg import LinAlgError
+
+__all__ = ["SemiseparableFactor"]
+
+
+class SemiseparableFactor(object):
+    """The Cholesky-like factorization :math:`K = L D L^T` of a semiseparable
+    covariance matrix, computed in O(N J^2) time for N points and J terms.
+
+    :param metric:
+        The (sorted) metric, ndarray of shape ``(N,)``.
+
+    :param diag:
+        The diagonal of the covariance matrix that is *not* included in the
+        terms (e.g. the uncorrelated noise variance), ndarray of shape
+        ``(N,)``.
+
+    :param terms:
+        A list of ``(a, b, c, d, weights)`` tuples, where ``a``, ``b``, ``c``,
+        and ``d`` are the coefficients of each term and ``weights`` is
+        ``None`` or an ndarray of shape ``(N,)`` multiplying the term on both
+        sides.
+    """
+
+    def __init__(self, metric, diag, terms):
+        t = np.asarray(metric, dtype=np.float64)
+        if np.any(np.diff(t) < 0):
+            raise ValueError("The metric must be sorted for a semiseparable "
+                             "covariance matrix.")
+        self.n = len(t)
+        A = np.array(diag, dtype=np.float64) * np.ones(self.n)
+        U, V, phi = [], [], []
+        dt = np.concatenate([[0.], np.diff(t)])
+        for (a, b, c, d, weights) in terms:
+            w = np.ones(self.n) if weights is None else np.asarray(weights)
+            cos, sin = np.cos(d * t), np.sin(d * t)
+            A += a * w**2
+            U += [w * (a * cos + b * sin), w * (a * sin - b * cos)]
+            V += [w * cos, w * sin]
+            phi += 2 * [np.exp(-c * dt)]
+        self.U = np.array(U).T
+        self.V = np.array(V).T
+        self.phi = np.array(phi).T
+        self.D, self.W = self.factor(A, self.U, self.V, self.phi)
+        self.log_det = np.sum(np.log(self.D))
+
+    @staticmethod
+    def factor(A, U, V, phi):
+        """Compute the diagonal ``D`` and the matrix ``W`` of the
+        factorization.  Raises ``LinAlgError`` if the matrix is not positive
+        definite.
+        """
+        n, nterm = U.shape
+        D, W = np.zeros(n), np.zeros([n, nterm])
+        # The preconditioning factors for the update of S, for all points
+        phi2 = phi[:, :, None] * phi[:, None, :]
+        S = np.zeros([nterm, nterm])
+        d = A[0]
+        if d <= 0:
+            raise LinAlgError("Matrix is not positive definite")
+        w = V[0] / d
+        D[0], W[0] = d, w
+        dot, outer = np.dot, np.outer
+        for i in range(1, n):
+            S = (S + d * outer(w, w)) * phi2[i]
+            u = U[i]
+            Su = dot(S, u)
+            d = A[i] - dot(u, Su)
+            if d <= 0:
+                raise LinAlgError("Matrix is not positive definite")
+            w = (V[i] - Su) / d
+            D[i], W[i] = d, w
+        return D, W
+
+    def solve_lower(self, y):
+        """Solve :math:`L z = y` for ``z``.
+
+        :param y:
+            ndarray of shape ``(N,)`` or ``(N, K)``
+        """
+        y = np.asarray(y, dtype=np.float64)
+        y2 = y.reshape(self.n, -1)
+        z = np.zeros_like(y2)
+        f = np.zeros((self.U.shape[1], y2.shape[1]))
+        phi, W, U = self.phi[:, :, None], self.W[:, :, None], self.U
+        dot = np.dot
+        z[0] = y2[0]
+        for i in range(1, self.n):
+            f = phi[i] * (f + W[i-1] * z[i-1])
+            z[i] = y2[i] - dot(U[i], f)
+        return z.reshape(y.shape)
+
+    def quad(self, y):
+        """Compute :math:`y^T K^{-1} y`, for each column of ``y`` if it is
+        2-d.
+        """
+        z = self.solve_lower(y)
+        return np.sum(z**2 / np.reshape(self.D, (-1,) + (z.ndim - 1) * (1,)),
+                      axis=0)
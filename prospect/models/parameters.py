@@ -3,13 +3,22 @@ from __future__ import print_function
 import json
 import pickle
 from copy import deepcopy
+from timeit import default_timer
 
 import numpy as np
 
+try:
+    from inspect import signature
+except(ImportError):
+    # python 2
+    from inspect import getargspec
+    signature = None
+
 from . import priors
 
 
-__all__ = ["ProspectorParams"] #, "plist_to_pdict", "pdict_to_plist"]
+__all__ = ["ProspectorParams", "PriorEvaluator", "PriorTransform",
+           "DependencyGraph"] #, "plist_to_pdict", "pdict_to_plist"]
 
 
 # A template for what parameter configuration list element should look like
@@ -91,6 +100,8 @@ class ProspectorParams(object):
             :py:attr:`config_dict`
         """
         self._has_parameter_dependencies = False
+        # Count the configurations, so that the compiled priors are rebuilt
+        self._config_version = getattr(self, '_config_version', 0) + 1
         if (not hasattr(self, 'params')) or reset:
             self.params = {}
 
@@ -114,6 +125,10 @@ class ProspectorParams(object):
             self.params[k] = np.atleast_1d(v)
         # store these initial values
         self.initial_theta = self.theta.copy()
+        # compile the parameter dependencies
+        self.dependency_graph = None
+        if self._has_parameter_dependencies:
+            self.dependency_graph = DependencyGraph(self.config_dict)
 
     def map_theta(self):
         """Construct the mapping from parameter name to the index in the theta
@@ -153,80 +168,90 @@ class ProspectorParams(object):
             (e.g. something that is difficult to transform from the unit cube.)
 
         :returns lnp_prior:
-            The natural log of the prior probability at ``theta``
+            The natural log of the prior probability at ``theta``, scalar or
+            ndarray of shape ``(...)``
         """
         lpp = self._prior_product(theta)
-        if nested & np.any(np.isfinite(lpp)):
-            return 0.0
+        if nested:
+            lpp = np.where(np.isfinite(lpp), 0.0, lpp)
+            if np.ndim(lpp) == 0:
+                lpp = float(lpp)
         return lpp
 
     def _prior_product(self, theta, **extras):
-        """Return a scalar which is the ln of the product of the prior
-        probabilities for each element of theta.  Requires that the prior
-        functions are defined in the theta descriptor.
+        """Return the ln of the product of the prior probabilities for each
+        element of theta.  Requires that the prior functions are defined in
+        the theta descriptor.  The priors are evaluated by a
+        :py:class:`PriorEvaluator`, which is rebuilt whenever the model is
+        configured or a prior is changed with ``Prior.update()``.
 
         :param theta:
             Iterable containing the free model parameter values. ndarray of
-            shape ``(ndim,)``
+            shape ``(ndim,)`` or ``(N, ndim)``
 
         :returns lnp_prior:
             The natural log of the product of the prior probabilities for these
-            parameter values.
+            parameter values, scalar or ndarray of shape ``(N,)``.
         """
-        lnp_prior = 0
-        # print('_prior_product: {}\n\n{}'.format(
-        #     self.theta_index, self._config_dict))
-        for k, inds in list(self.theta_index.items()):
-            func = self._config_dict[k]['prior']
-            prior_deps = {
-                parname: theta[self.theta_index[parname]]
-                for parname in self._config_dict[k].get(
-                    'prior_dependencies', [])
-            }
-            kwargs = self._config_dict[k].get('prior_args', {})
-            kwargs.update(prior_deps)
-            # print('kwargs => {}'.format(kwargs))
-            this_prior = np.sum(func(theta[..., inds], **kwargs), axis=-1)
-            if (not np.isfinite(this_prior)):
-                if verbose:
-                    print('WARNING: Prior for ' + k +
-                          ' is not finite: {}'.format(this_prior))
-                # self.infinitePriorValCount[k] += 1
-                return this_prior
-
-            lnp_prior += this_prior
-
+        lnp_prior = self.prior_evaluator(theta)
+        if np.ndim(lnp_prior) == 0:
+            return float(lnp_prior)
         return lnp_prior
 
+    @property
+    def prior_evaluator(self):
+        """The :py:class:`PriorEvaluator` for the current free parameters and
+        priors, compiling it if necessary.
+        """
+        signature = prior_signature(self)
+        if getattr(self, '_prior_signature', None) != signature:
+            self._prior_evaluator = PriorEvaluator(self)
+            self._prior_signature = signature
+        return self._prior_evaluator
+
     def prior_transform(self, unit_coords):
-        """Go from unit cube to parameter space, for nested sampling.
+        """Go from unit cube to parameter space, for nested sampling.  This
+        uses :py:attr:`prior_transformer`.
 
         :param unit_coords:
-            Coordinates in the unit hyper-cube. ndarray of shape ``(ndim,)``.
-            
+            Coordinates in the unit hyper-cube. ndarray of shape ``(ndim,)``
+            or ``(N, ndim)``.
+
         :returns theta:
             The parameter vector corresponding to the location in prior CDF
-            corresponding to ``unit_coords``. ndarray of shape ``(ndim,)``
+            corresponding to ``unit_coords``. ndarray of shape ``(ndim,)`` or
+            ``(N, ndim)``
         """
-        theta = np.zeros(len(unit_coords))
-        for k, inds in list(self.theta_index.items()):
-            func = self.config_dict[k]['prior'].unit_transform
-            kwargs = self.config_dict[k].get('prior_args', {})
-            theta[inds] = func(unit_coords[inds], **kwargs)
-        return theta
+        return self.prior_transformer(unit_coords)
 
-    def propagate_parameter_dependencies(self):
+    @property
+    def prior_transformer(self):
+        """The :py:class:`PriorTransform` for the current free parameters and
+        priors, compiling it if necessary.  This is a lightweight, picklable
+        callable that can be given to nested samplers in place of
+        :py:meth:`prior_transform`.
+        """
+        signature = prior_signature(self)
+        if getattr(self, '_transform_signature', None) != signature:
+            self._prior_transformer = PriorTransform(self)
+            self._transform_signature = signature
+        return self._prior_transformer
+
+    def propagate_parameter_dependencies(self, force=False):
         """Propogate any parameter dependecies. That is, for parameters whose
         value depends on another parameter, calculate those values and store
-        them in the :py:attr:`self.params` dictionary.
+        them in the :py:attr:`self.params` dictionary.  This uses the
+        :py:class:`DependencyGraph` compiled by :py:meth:`configure`, so only
+        the dependent parameters whose inputs have changed are recalculated.
+
+        :param force: (default: False)
+            If True, recalculate every dependent parameter.
         """
         if self._has_parameter_dependencies is False:
             return
-        for p, info in list(self.config_dict.items()):
-            if 'depends_on' in info:
-                # print('propagating dependencies on {} for {} using {}'.format(info['depends_on'], p, self.params))
-                value = info['depends_on'](**self.params)
-                self.params[p] = np.atleast_1d(value)
+        if getattr(self, 'dependency_graph', None) is None:
+            self.dependency_graph = DependencyGraph(self.config_dict)
+        self.dependency_graph.propagate(self.params, force=force)
 
     def rectify_theta(self, theta, epsilon=1e-10):
         """Replace zeros in a given theta vector with a small number epsilon.
@@ -372,6 +397,308 @@ class ProspectorParams(object):
         return self.config_dict
 
 
+class PriorEvaluator(object):
+    """Evaluate the ln of the prior probability of many parameter vectors at
+    once.  The free parameters of a model are grouped by the class of their
+    prior, and each group is evaluated with a single call to the closed-form
+    ``logpdf`` of that class, with the prior parameters of all the members
+    concatenated into arrays.  Parameters whose priors have no closed form,
+    are old-style functions, or have ``prior_args`` or
+    ``prior_dependencies``, are evaluated one at a time as before.
+
+    .. code-block:: python
+
+        evaluator = PriorEvaluator(model)
+        lnp = evaluator(thetas)  # thetas.shape == (N, model.ndim)
+
+    The prior parameters are read when the evaluator is built, so it should
+    be rebuilt if the priors are changed; :py:attr:`ProspectorParams.prior_evaluator`
+    does this automatically after :py:meth:`ProspectorParams.configure` or
+    ``Prior.update()``.  Prior parameters that are modified in any other way
+    (e.g. by assigning to ``Prior.params``) are not noticed.
+
+    :param model:
+        A :py:class:`ProspectorParams` instance.
+    """
+
+    def __init__(self, model):
+        self.ndim = model.ndim
+        self.groups, others = group_priors(model, 'logpdf')
+        self.others = []
+        for k, inds, info in others:
+            deps = [(d, model.theta_index[d])
+                    for d in info.get('prior_dependencies', [])]
+            self.others.append((k, inds, info['prior'],
+                                info.get('prior_args', {}), deps))
+
+    def __call__(self, theta):
+        """Compute the ln of the prior probability.
+
+        :param theta:
+            The parameter vector(s), ndarray of shape ``(ndim,)`` or ``(N,
+            ndim)``
+
+        :returns lnp_prior:
+            The ln of the product of the prior probabilities of each element,
+            scalar or ndarray of shape ``(N,)``.
+        """
+        theta = np.asarray(theta, dtype=np.float64)
+        assert theta.shape[-1] == self.ndim
+        lnp = np.zeros(theta.shape[:-1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for logpdf, index, params in self.groups:
+                lnp += np.sum(logpdf(theta[..., index], **params), axis=-1)
+            for k, inds, func, prior_args, deps in self.others:
+                kwargs = dict(prior_args)
+                kwargs.update({d: theta[..., dinds] for d, dinds in deps})
+                lnp += np.sum(func(theta[..., inds], **kwargs), axis=-1)
+        return lnp
+
+
+class PriorTransform(object):
+    """A callable that transforms points in the unit hypercube to parameter
+    vectors, for nested sampling.  Like :py:class:`PriorEvaluator`, the free
+    parameters are grouped by prior class and each group is transformed with
+    a single call to the closed-form ``ppf`` of the class, so an ``(N,
+    ndim)`` batch of unit-cube points is transformed in one vectorized pass
+    per group.
+
+    The transform keeps only index arrays, prior parameter arrays, and (for
+    parameters without a closed-form ``ppf``) the prior objects, not the
+    model, so it is cheap to pickle and can be given to samplers that send
+    the prior transform to a pool of processes:
+
+    .. code-block:: python
+
+        prior_transform = model.prior_transformer
+        dsampler = dynesty.DynamicNestedSampler(lnprobfn, prior_transform,
+                                                model.ndim, pool=pool)
+
+    :param model:
+        A :py:class:`ProspectorParams` instance.
+    """
+
+    def __init__(self, model):
+        self.ndim = model.ndim
+        self.groups, others = group_priors(model, 'ppf')
+        self.others = [(inds, info['prior'].unit_transform,
+                        info.get('prior_args', {}))
+                       for k, inds, info in others]
+
+    def __call__(self, unit_coords):
+        """Go from unit cube to parameter space.
+
+        :param unit_coords:
+            Coordinates in the unit hyper-cube. ndarray of shape ``(ndim,)``
+            or ``(N, ndim)``.
+
+        :returns theta:
+            The parameter vector(s) corresponding to the location in prior CDF
+            given by ``unit_coords``, ndarray of the same shape.
+        """
+        unit_coords = np.asarray(unit_coords, dtype=np.float64)
+        assert unit_coords.shape[-1] == self.ndim
+        theta = np.zeros(unit_coords.shape)
+        for ppf, index, params in self.groups:
+            theta[..., index] = ppf(unit_coords[..., index], **params)
+        for inds, func, prior_args in self.others:
+            theta[..., inds] = func(unit_coords[..., inds], **prior_args)
+        return theta
+
+
+# The method of the Prior class that wraps each closed-form method.
+_prior_wrappers = {'logpdf': '__call__', 'ppf': 'unit_transform'}
+
+
+def compiled_prior(info, method='logpdf'):
+    """Whether the prior of a parameter can be handled in a group by the
+    closed-form ``method`` (``"logpdf"`` or ``"ppf"``), i.e. whether it is a
+    :py:class:`priors.Prior` instance with that method, does not override
+    the standard method that wraps it, and has no ``prior_args`` or
+    ``prior_dependencies``.
+    """
+    prior = info['prior']
+    wrapper = _prior_wrappers[method]
+    return (isinstance(prior, priors.Prior) and
+            (getattr(prior, method, None) is not None) and
+            (getattr(type(prior), wrapper) is getattr(priors.Prior, wrapper)) and
+            (len(info.get('prior_args', {})) == 0) and
+            (len(info.get('prior_dependencies', [])) == 0))
+
+
+def group_priors(model, method='logpdf'):
+    """Group the free parameters of a model by prior class, for evaluation
+    with the closed-form ``method`` of each class.
+
+    :returns groups:
+        A list of ``(function, index, params)`` tuples, where ``function`` is
+        the closed-form method of the class, ``index`` is an integer array of
+        the elements of theta in the group, and ``params`` is a dictionary of
+        prior parameter arrays of the same length as ``index``.
+
+    :returns others:
+        A list of ``(name, slice, info)`` tuples for the parameters that are
+        not in a group.
+    """
+    members, others = {}, []
+    for k, inds in list(model.theta_index.items()):
+        info = model.config_dict[k]
+        prior = info['prior']
+        if compiled_prior(info, method):
+            n = inds.stop - inds.start
+            try:
+                params = {p: np.broadcast_to(np.asarray(v, dtype=np.float64), (n,))
+                          for p, v in list(prior.params.items())}
+            except(ValueError):
+                pass
+            else:
+                key = (type(prior), tuple(sorted(params.keys())))
+                members.setdefault(key, []).append((inds, params))
+                continue
+        others.append((k, inds, info))
+
+    groups = []
+    for (kind, names), group in list(members.items()):
+        index = np.concatenate([np.arange(inds.start, inds.stop)
+                                for inds, _ in group])
+        params = {p: np.concatenate([pars[p] for _, pars in group])
+                  for p in names}
+        groups.append((getattr(kind, method), index, params))
+    return groups, others
+
+
+def prior_signature(model):
+    """A tuple identifying the configuration of a model, the prior of each
+    free parameter, and the number of ``Prior.update()`` calls for each
+    prior.  Used to decide when to rebuild the :py:class:`PriorEvaluator` and
+    :py:class:`PriorTransform`, without looking at the prior parameter values.
+    """
+    config = model.config_dict
+    return (getattr(model, '_config_version', 0),
+            tuple((id(config[k]['prior']), getattr(config[k]['prior'], '_version', 0))
+                  for k in model.theta_index))
+
+
+class DependencyGraph(object):
+    """The ``depends_on`` functions of a model, sorted so that each function
+    is evaluated after the functions that compute its inputs.  The inputs of
+    each function are taken to be the model parameters named by its
+    arguments, e.g. ``zred`` and ``tage_tuniv`` for
+    :py:func:`transforms.tage_from_tuniv`.  When propagating, a function is
+    only evaluated if the value of one of its inputs has changed since the
+    last evaluation (or the parameter it computes has been replaced).
+
+    Arguments collected by ``**extras`` are not treated as inputs, since in
+    :py:mod:`transforms` they only swallow the rest of the parameter
+    dictionary.  A function that does read parameters through ``**extras``
+    must be flagged with ``"depends_on_all": True`` in its parameter
+    specification; it is then evaluated on every call, and its named
+    arguments are still used to sort it.  Functions whose inputs cannot be
+    determined from their arguments, or that are part of a cycle of
+    dependencies, are also evaluated on every call, in the order of the
+    configuration.  A function argument with the same name as the
+    parameter it computes (e.g. ``agebins`` for
+    :py:func:`transforms.zred_to_agebins`) is not treated as an input.
+
+    The number of evaluations and the total time spent in each function are
+    recorded in :py:attr:`timing`, and the number of skipped evaluations in
+    :py:attr:`nskip`.
+
+    :param config_dict:
+        Dictionary of parameter specifications, keyed by parameter name.
+    """
+
+    def __init__(self, config_dict):
+        funcs, inputs, extras = {}, {}, []
+        for p, info in list(config_dict.items()):
+            func = info.get('depends_on', None)
+            if callable(func):
+                funcs[p] = func
+                inputs[p] = argument_names(func)
+                if info.get('depends_on_all', False):
+                    extras.append(p)
+        names = list(funcs.keys())
+        # Only other dependent parameters define the order
+        for p in names:
+            if inputs[p] is not None:
+                inputs[p] = [a for a in inputs[p]
+                             if (a != p) and (a in config_dict)]
+        upstream = {p: set(a for a in (inputs[p] or []) if a in funcs)
+                    for p in names}
+
+        # Kahn's algorithm, taking ready parameters in configuration order
+        self.order = []
+        while len(self.order) < len(names):
+            ready = [p for p in names if (p not in self.order) and
+                     upstream[p].issubset(self.order)]
+            if len(ready) == 0:
+                break
+            self.order.append(ready[0])
+        cyclic = [p for p in names if p not in self.order]
+        for p in cyclic + extras:
+            inputs[p] = None
+        self.order += cyclic
+
+        self.nodes = [(p, funcs[p], inputs[p]) for p in self.order]
+        self.reset()
+
+    def reset(self):
+        """Forget the stored inputs and outputs, and the timing."""
+        self._inputs = {}
+        self._outputs = {}
+        self.timing = {p: [0, 0.0] for p in self.order}
+        self.nskip = {p: 0 for p in self.order}
+
+    def propagate(self, params, force=False):
+        """Compute the dependent parameters and store them in ``params``.
+
+        :param params:
+            The model parameter state dictionary, modified in place.
+
+        :param force: (default: False)
+            If True, evaluate every function.
+        """
+        for p, func, inputs in self.nodes:
+            if (not force) and (inputs is not None) and (p in self._outputs):
+                unchanged = (params.get(p) is self._outputs[p])
+                stored = self._inputs[p]
+                for a in inputs:
+                    if not unchanged:
+                        break
+                    unchanged = np.array_equal(params.get(a), stored[a])
+                if unchanged:
+                    self.nskip[p] += 1
+                    continue
+            t = default_timer()
+            value = np.atleast_1d(func(**params))
+            timing = self.timing[p]
+            timing[0] += 1
+            timing[1] += default_timer() - t
+            params[p] = value
+            if inputs is not None:
+                self._outputs[p] = value
+                self._inputs[p] = {a: np.array(params.get(a), copy=True)
+                                   for a in inputs}
+
+
+def argument_names(func):
+    """The names of the named arguments of a function, or None if it has none
+    or they cannot be determined.
+    """
+    try:
+        if signature is not None:
+            pars = signature(func).parameters.values()
+            names = [par.name for par in pars
+                     if par.kind in (par.POSITIONAL_OR_KEYWORD, par.KEYWORD_ONLY)]
+        else:
+            names = getargspec(func).args
+    except(TypeError, ValueError):
+        return None
+    if len(names) == 0:
+        return None
+    return names
+
+
 def plist_to_pdict(inplist):
     """Convert from a parameter list to a parameter dictionary, where the keys
     of the cdictionary are the parameter names.
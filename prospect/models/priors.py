@@ -2,6 +2,10 @@
 # These return the ln-prior-probability
 import numpy as np
 import scipy.stats
+from scipy.special import (betaln, betaincinv, gammaln, log_ndtr, ndtr, ndtri,
+                           stdtrit, xlogy, xlog1py)
+
+_ln2pi = np.log(2 * np.pi)
 
 __all__ = ["plotting_range",
            "Prior", "TopHat", "Normal", "ClippedNormal",
@@ -73,6 +77,16 @@ def plotting_range(prior_args):
         return mini.tolist(), maxi.tolist()
 
 
+def _lognormal_logpdf(x, mu, sigma):
+    """ln of the probability density of a variable whose natural log is
+    normally distributed with mean ``mu`` and dispersion ``sigma``.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lnx = np.log(x)
+    lnp = -0.5 * (((lnx - mu) / sigma)**2 + _ln2pi) - np.log(sigma) - lnx
+    return np.where(x > 0, lnp, -np.inf)
+
+
 class Prior(object):
     """Encapsulate the priors in an object.  Each prior should have a
     distribution name and optional parameters specifying scale and location
@@ -115,6 +129,16 @@ class Prior(object):
         argstring = ['{}={}'.format(k, v) for k, v in list(self.params.items())] 
         return '{}({})'.format(self.__class__, ",".join(argstring))
 
+    # Closed-form ln-probability density, percent point function (inverse
+    # CDF) and random variates, as functions of the (intrinsic) prior
+    # parameters.  Subclasses that have them should override these with
+    # staticmethods that broadcast over their arguments; otherwise the
+    # scipy.stats ``distribution`` is used.  Without ``rvs``, samples are
+    # drawn by applying ``ppf`` to uniform variates.
+    logpdf = None
+    ppf = None
+    rvs = None
+
     def update(self, **kwargs):
         """Update `params` values using alias.
         """
@@ -123,6 +147,9 @@ class Prior(object):
                 self.params[k] = kwargs[self.alias[k]]
             except(KeyError):
                 pass
+        # Count the updates, so that compiled prior evaluators can be
+        # invalidated.
+        self._version = getattr(self, '_version', 0) + 1
         # FIXME: Should add a check for unexpected kwargs.
 
     def __len__(self):
@@ -149,6 +176,10 @@ class Prior(object):
         """
         if len(kwargs) > 0:
             self.update(**kwargs)
+        if self.logpdf is not None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return self.logpdf(np.asarray(x, dtype=np.float64),
+                                   **self.param_arrays)[()]
         p = self.distribution.pdf(x, *self.args,
                                   loc=self.loc, scale=self.scale)
         with np.errstate(invalid='ignore'):
@@ -163,6 +194,11 @@ class Prior(object):
         """
         if len(kwargs) > 0:
             self.update(**kwargs)
+        if self.rvs is not None:
+            return self.rvs(size=len(self), **self.param_arrays)
+        if self.ppf is not None:
+            u = np.random.uniform(size=len(self))
+            return self.ppf(u, **self.param_arrays)
         return self.distribution.rvs(*self.args, size=len(self),
                                      loc=self.loc, scale=self.scale)
 
@@ -180,6 +216,9 @@ class Prior(object):
         """
         if len(kwargs) > 0:
             self.update(**kwargs)
+        if self.ppf is not None:
+            return self.ppf(np.asarray(x, dtype=np.float64),
+                            **self.param_arrays)[()]
         return self.distribution.ppf(x, *self.args,
                                      loc=self.loc, scale=self.scale)
 
@@ -194,6 +233,14 @@ class Prior(object):
     def gradient(self, theta):
         raise(NotImplementedError)
 
+    @property
+    def param_arrays(self):
+        """The prior parameters as float arrays, keyed by their intrinsic
+        names, for the closed-form methods.
+        """
+        return {k: np.asarray(v, dtype=np.float64)
+                for k, v in list(self.params.items())}
+
     @property
     def loc(self):
         """This should be overridden.
@@ -234,6 +281,19 @@ class TopHat(Prior):
     prior_params = ['mini', 'maxi']
     distribution = scipy.stats.uniform
 
+    @staticmethod
+    def logpdf(x, mini=0.0, maxi=1.0):
+        inside = (x >= mini) & (x <= maxi)
+        return np.where(inside, -np.log(maxi - mini), -np.inf)
+
+    @staticmethod
+    def ppf(u, mini=0.0, maxi=1.0):
+        return mini + u * (maxi - mini)
+
+    @staticmethod
+    def rvs(size=None, mini=0.0, maxi=1.0):
+        return np.random.uniform(mini, maxi, size=size)
+
     @property
     def scale(self):
         return self.params['maxi'] - self.params['mini']
@@ -265,6 +325,19 @@ class Normal(Prior):
     prior_params = ['mean', 'sigma']
     distribution = scipy.stats.norm
 
+    @staticmethod
+    def logpdf(x, mean=0.0, sigma=1.0):
+        z = (x - mean) / sigma
+        return -0.5 * (z**2 + _ln2pi) - np.log(sigma)
+
+    @staticmethod
+    def ppf(u, mean=0.0, sigma=1.0):
+        return mean + sigma * ndtri(u)
+
+    @staticmethod
+    def rvs(size=None, mean=0.0, sigma=1.0):
+        return np.random.normal(mean, sigma, size=size)
+
     @property
     def scale(self):
         return self.params['sigma']
@@ -303,6 +376,30 @@ class ClippedNormal(Prior):
     prior_params = ['mean', 'sigma', 'mini', 'maxi']
     distribution = scipy.stats.truncnorm
 
+    @staticmethod
+    def logpdf(x, mean=0.0, sigma=1.0, mini=0.0, maxi=1.0):
+        z = (x - mean) / sigma
+        a, b = (mini - mean) / sigma, (maxi - mean) / sigma
+        # Normalization, using the upper tail when the range is above the
+        # mean to avoid cancellation.
+        flip = a > 0
+        norm = np.where(flip, ndtr(-a) - ndtr(-b), ndtr(b) - ndtr(a))
+        lnp = -0.5 * (z**2 + _ln2pi) - np.log(sigma) - np.log(norm)
+        inside = (x >= mini) & (x <= maxi)
+        return np.where(inside, lnp, -np.inf)
+
+    @staticmethod
+    def ppf(u, mean=0.0, sigma=1.0, mini=0.0, maxi=1.0):
+        a, b = (mini - mean) / sigma, (maxi - mean) / sigma
+        # Invert the upper tail when the range is above the mean.
+        flip = a > 0
+        pa = np.where(flip, ndtr(-b), ndtr(a))
+        pb = np.where(flip, ndtr(-a), ndtr(b))
+        q = np.where(flip, 1 - u, u)
+        z = ndtri(pa + q * (pb - pa))
+        x = mean + sigma * np.where(flip, -z, z)
+        return np.clip(x, mini, maxi)
+
     @property
     def scale(self):
         return self.params['sigma']
@@ -340,6 +437,17 @@ class LogUniform(Prior):
     prior_params = ['mini', 'maxi']
     distribution = scipy.stats.reciprocal
 
+    @staticmethod
+    def logpdf(x, mini=1.0, maxi=np.e):
+        inside = (x >= mini) & (x <= maxi)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lnp = -np.log(x) - np.log(np.log(maxi / mini))
+        return np.where(inside, lnp, -np.inf)
+
+    @staticmethod
+    def ppf(u, mini=1.0, maxi=np.e):
+        return mini * np.exp(u * np.log(maxi / mini))
+
     @property
     def args(self):
         a = self.params['mini']
@@ -372,6 +480,24 @@ class Beta(Prior):
     prior_params = ['mini', 'maxi', 'alpha', 'beta']
     distribution = scipy.stats.beta
 
+    @staticmethod
+    def logpdf(x, mini=0.0, maxi=1.0, alpha=1.0, beta=1.0):
+        scale = maxi - mini
+        y = (x - mini) / scale
+        inside = (y >= 0) & (y <= 1)
+        y = np.clip(y, 0, 1)
+        lnp = (xlogy(alpha - 1, y) + xlog1py(beta - 1, -y) -
+               betaln(alpha, beta) - np.log(scale))
+        return np.where(inside, lnp, -np.inf)
+
+    @staticmethod
+    def ppf(u, mini=0.0, maxi=1.0, alpha=1.0, beta=1.0):
+        return mini + (maxi - mini) * betaincinv(alpha, beta, u)
+
+    @staticmethod
+    def rvs(size=None, mini=0.0, maxi=1.0, alpha=1.0, beta=1.0):
+        return mini + (maxi - mini) * np.random.beta(alpha, beta, size=size)
+
     @property
     def scale(self):
         return self.params.get('maxi', 1) - self.params.get('mini', 0)
@@ -414,6 +540,18 @@ class LogNormal(Prior):
     prior_params = ['mode', 'sigma']
     distribution = scipy.stats.lognorm
 
+    @staticmethod
+    def logpdf(x, mode=0.0, sigma=1.0):
+        return _lognormal_logpdf(x, mode + sigma**2, sigma)
+
+    @staticmethod
+    def ppf(u, mode=0.0, sigma=1.0):
+        return np.exp(mode + sigma**2 + sigma * ndtri(u))
+
+    @staticmethod
+    def rvs(size=None, mode=0.0, sigma=1.0):
+        return np.random.lognormal(mode + sigma**2, sigma, size=size)
+
     @property
     def args(self):
         return [self.params["sigma"]]
@@ -454,6 +592,21 @@ class LogNormalLinpar(Prior):
     prior_params = ['mode', 'sigma_factor']
     distribution = scipy.stats.lognorm
 
+    @staticmethod
+    def logpdf(x, mode=1.0, sigma_factor=np.e):
+        sigma = np.log(sigma_factor)
+        return _lognormal_logpdf(x, np.log(mode) + sigma**2, sigma)
+
+    @staticmethod
+    def ppf(u, mode=1.0, sigma_factor=np.e):
+        sigma = np.log(sigma_factor)
+        return mode * np.exp(sigma**2 + sigma * ndtri(u))
+
+    @staticmethod
+    def rvs(size=None, mode=1.0, sigma_factor=np.e):
+        sigma = np.log(sigma_factor)
+        return mode * np.random.lognormal(sigma**2, sigma, size=size)
+
     @property
     def args(self):
         return [np.log(self.params["sigma_factor"])]
@@ -492,6 +645,22 @@ class SkewNormal(Prior):
     prior_params = ['location', 'sigma', 'skew']
     distribution = scipy.stats.skewnorm
 
+    @staticmethod
+    def logpdf(x, location=0.0, sigma=1.0, skew=0.0):
+        z = (x - location) / sigma
+        return (np.log(2) - 0.5 * (z**2 + _ln2pi) - np.log(sigma) +
+                log_ndtr(skew * z))
+
+    # The skew-normal CDF involves Owen's T function, so there is no simple
+    # closed-form ppf and ``unit_transform`` uses scipy.stats.
+    @staticmethod
+    def rvs(size=None, location=0.0, sigma=1.0, skew=0.0):
+        delta = skew / np.sqrt(1 + skew**2)
+        u0 = np.random.normal(size=size)
+        v = np.random.normal(size=size)
+        u1 = delta * u0 + np.sqrt(1 - delta**2) * v
+        return location + sigma * np.where(u0 >= 0, u1, -u1)
+
     @property
     def args(self):
         return [self.params['skew']]
@@ -529,6 +698,21 @@ class StudentT(Prior):
     prior_params = ['mean', 'scale', 'df']
     distribution = scipy.stats.t
 
+    @staticmethod
+    def logpdf(x, mean=0.0, scale=1.0, df=1.0):
+        z = (x - mean) / scale
+        return (gammaln((df + 1) / 2.) - gammaln(df / 2.) -
+                0.5 * np.log(df * np.pi) - np.log(scale) -
+                (df + 1) / 2. * np.log1p(z**2 / df))
+
+    @staticmethod
+    def ppf(u, mean=0.0, scale=1.0, df=1.0):
+        return mean + scale * stdtrit(df, u)
+
+    @staticmethod
+    def rvs(size=None, mean=0.0, scale=1.0, df=1.0):
+        return mean + scale * np.random.standard_t(df, size=size)
+
     @property
     def args(self):
         return [self.params['df']]
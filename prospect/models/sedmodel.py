@@ -1,6 +1,8 @@
 import numpy as np
 from numpy.polynomial.chebyshev import chebval, chebvander
+from scipy.linalg import cho_factor, cho_solve
 from .parameters import ProspectorParams
+from ..utils.caching import LRUCache, hashable
 
 __all__ = ["SedModel", "PolySedModel"]
 
@@ -11,6 +13,12 @@ class SedModel(ProspectorParams):
     optional spectroscopic calibration and sky emission.
     """
 
+    # The ln of the factor by which marginalizing over the spectroscopic
+    # calibration changes the spectroscopic likelihood of the most recent
+    # model, to be added to the ln-likelihood.  Zero unless the calibration
+    # is marginalized (see :py:class:`PolySedModel`).
+    speccal_lnmarg = 0.0
+
     def mean_model(self, theta, obs, sps=None, **extras):
         """Given a ``theta`` vector, generate a spectrum, photometry, and any
         extras (e.g. stellar mass), including any calibration effects.
@@ -50,6 +58,88 @@ class SedModel(ProspectorParams):
             s *= self._speccal
         return s, p, x
 
+    def mean_model_batch(self, thetas, obs, sps=None, **extras):
+        """Given an array of ``theta`` vectors, generate spectra, photometry,
+        and any extras, including any calibration effects.  If the ``sps``
+        object has a ``get_spectrum_batch`` method then the observed frame
+        calculations are done for all the parameter vectors at once, otherwise
+        this is equivalent to calling :py:meth:`mean_model` for each vector.
+
+        :param thetas:
+            ndarray of parameter values, of shape ``(N, ndim)``
+
+        :param obs:
+            An observation dictionary, as for :py:meth:`mean_model`.
+
+        :param sps:
+            An `sps` object to be used in the model generation.
+
+        :returns spec:
+            The model spectra, including multiplication by the calibration
+            vector. ndarray of shape ``(N, nwave)``
+
+        :returns phot:
+            The model photometry, ndarray of shape ``(N, nfilters)``.  Units of
+            maggies.
+
+        :returns extras:
+            The extras for each parameter vector, typically ``mfrac``.
+            ndarray of shape ``(N,)``
+
+        After this call :py:attr:`speccal_lnmarg` is an ndarray of shape
+        ``(N,)`` with the value for each parameter vector.
+        """
+        thetas = np.atleast_2d(thetas)
+        if not hasattr(sps, 'get_spectrum_batch'):
+            out, lnmarg = [], []
+            for theta in thetas:
+                out.append(self.mean_model(theta, obs, sps=sps, **extras))
+                lnmarg.append(self.speccal_lnmarg)
+            self.speccal_lnmarg = np.array(lnmarg)
+            s, p, x = zip(*out)
+            return np.array(s), np.array(p), np.array(x)
+
+        # Set the parameters (and propagate dependencies) once per row.
+        param_list, skies = [], []
+        for theta in thetas:
+            self.set_parameters(theta)
+            param_list.append(dict(self.params))
+            skies.append(self.sky())
+        spec, phot, x = sps.get_spectrum_batch(param_list, outwave=obs['wavelength'],
+                                               filters=obs['filters'],
+                                               component=obs.get('component', -1),
+                                               lnwavegrid=obs.get('lnwavegrid', None))
+        spec *= obs.get('normalization_guess', 1.0)
+        # Remove negative fluxes, for each row with any positive flux, as in
+        # :py:meth:`sed`.  Rows may be single spectra or (for multiple
+        # components) 2-d arrays.
+        axes = tuple(range(1, spec.ndim))
+        with np.errstate(invalid='ignore'):
+            tiny = np.where(spec > 0, spec, np.inf).min(axis=axes) / spec.shape[1]
+        tiny[~np.isfinite(tiny)] = -np.inf
+        spec = np.maximum(spec, tiny.reshape((-1,) + len(axes) * (1,)))
+
+        # Calibration, which depends on the individual parameter sets.  The
+        # stored parameter dictionaries are swapped in rather than calling
+        # set_parameters again.
+        seds, cals, lnmarg = [], [], []
+        for i, params in enumerate(param_list):
+            self.params = params
+            self._spec = spec[i] + skies[i]
+            seds.append(self._spec.copy())
+            cals.append(self.spec_calibration(obs=obs, **extras))
+            lnmarg.append(self.speccal_lnmarg)
+        spec, cal = np.array(seds), np.array(cals)
+        self.speccal_lnmarg = np.array(lnmarg)
+        # Make scalar calibrations broadcast against the spectra.
+        self._speccal = cal.reshape(cal.shape + (spec.ndim - cal.ndim) * (1,))
+        self._spec = spec.copy()
+        if obs.get('logify_spectrum', False):
+            spec = np.log(spec) + np.log(self._speccal)
+        else:
+            spec = spec * self._speccal
+        return spec, phot, x
+
     def sed(self, theta, obs, sps=None, **kwargs):
         """Given a ``theta vector``, generate a spectrum, photometry, and any
         extras (e.g. stellar mass), ***not** including any instrument
@@ -160,8 +250,54 @@ class PolySedModel(SedModel):
     """This is a subclass of SedModel that replaces the calibration vector with
     the maximum likelihood chebyshev polynomial describing the difference
     between the observed and the model spectrum.
+
+    If the ``marginalize_speccal`` parameter is True, the polynomial
+    coefficients are integrated out of the likelihood rather than optimized:
+    :py:meth:`spec_calibration` sets :py:attr:`speccal_lnmarg`, which should
+    be added to the spectroscopic ln-likelihood of the calibrated model (as
+    ``lnprobfn`` in the prospector scripts does).  This assumes the
+    uncorrelated noise given by ``obs["unc"]``, so the scripts skip it (with
+    a warning) when there is a spectroscopic noise model.
     """
 
+    def __init__(self, configuration, **kwargs):
+        super(PolySedModel, self).__init__(configuration, **kwargs)
+        self._designs = LRUCache(maxsize=4)
+
+    def calibration_design(self, obs, order):
+        """Get the Chebyshev design matrices for the calibration polynomial,
+        which depend only on the wavelength vector, the mask, and the
+        polynomial order, from the cache if possible.
+
+        :param obs:
+            A dictionary of observational data, must contain the key
+            ``"wavelength"``, and optionally ``"mask"``.
+
+        :param order:
+            The order of the polynomial.
+
+        :returns Afull:
+            The design matrix (without the constant term) for all wavelengths,
+            ndarray of shape ``(nwave, order)``
+
+        :returns A:
+            The design matrix for the unmasked wavelengths, ndarray of shape
+            ``(nmask, order)``
+        """
+        mask = obs.get('mask', slice(None))
+        key = (hashable(obs['wavelength']), hashable(mask), int(order))
+        try:
+            return self._designs[key]
+        except(KeyError):
+            pass
+        # map unmasked wavelengths to the interval -1, 1
+        # masked wavelengths may have x>1, x<-1
+        x = obs['wavelength'] - (obs['wavelength'][mask]).min()
+        x = 2.0 * (x / (x[mask]).max()) - 1.0
+        Afull = chebvander(x, int(order))[:, 1:]
+        self._designs[key] = Afull, Afull[mask]
+        return self._designs[key]
+
     def spec_calibration(self, theta=None, obs=None, **kwargs):
         """Implements a Chebyshev polynomial calibration model. This uses
         least-squres to find the **optimal** Chebyshev polynomial of a certain
@@ -170,6 +306,19 @@ class PolySedModel(SedModel):
         The first coefficient is always set to 1, as the overall normalization
         is controlled by ``spec_norm``.
 
+        The design matrices are cached (see :py:meth:`calibration_design`) and
+        the normal equations are solved by Cholesky factorization.  If the
+        ``marginalize_speccal`` parameter is True, the ln of the factor by
+        which marginalizing over the polynomial coefficients changes the
+        likelihood, relative to the likelihood at the optimal coefficients,
+        is stored in :py:attr:`speccal_lnmarg` (otherwise this is zero).
+        This uses a gaussian prior on the coefficients with dispersion
+        ``1/poly_regularization``, which may be a vector with one element per
+        coefficient, and a flat prior with unit density for coefficients with
+        zero regularization.  Adding it to the spectroscopic
+        ln-likelihood of the calibrated model gives the likelihood with the
+        polynomial integrated out.
+
         :returns cal:
            A polynomial given by 'spec_norm' * (1 + \Sum_{m=1}^M
            'poly_coeffs'[m-1] T_n(x)).  Otherwise, the exponential of a
@@ -178,28 +327,36 @@ class PolySedModel(SedModel):
         if theta is not None:
             self.set_parameters(theta)
 
+        self.speccal_lnmarg = 0.0
         polyopt = ((self.params.get('polyorder', 0) > 0) &
                    (obs.get('spectrum', None) is not None))
         if polyopt:
-            order = self.params['polyorder']
+            order = int(np.squeeze(self.params['polyorder']))
             mask = obs.get('mask', slice(None))
-            # map unmasked wavelengths to the interval -1, 1
-            # masked wavelengths may have x>1, x<-1
-            x = obs['wavelength'] - (obs['wavelength'][mask]).min()
-            x = 2.0 * (x / (x[mask]).max()) - 1.0
+            Afull, A = self.calibration_design(obs, order)
             y = (obs['spectrum'] / self._spec)[mask] - 1.0
             yerr = (obs['unc'] / self._spec)[mask]
-            yvar = yerr**2
-            A = chebvander(x[mask], order)[:, 1:]
-            ATA = np.dot(A.T, A / yvar[:, None])
-            reg = self.params.get('poly_regularization', 0.)
-            if np.any(reg > 0):
-                ATA += reg**2 * np.eye(order)
-            ATAinv = np.linalg.inv(ATA)
-            c = np.dot(ATAinv, np.dot(A.T, y / yvar))
-            Afull = chebvander(x, order)[:, 1:]
+            ivar = 1.0 / yerr**2
+            ATA = np.dot(A.T, A * ivar[:, None])
+            # regularization for each coefficient, scalar or vector
+            reg = np.squeeze(self.params.get('poly_regularization', 0.)) * np.ones(order)
+            regularized = reg > 0
+            if np.any(regularized):
+                ATA += np.diag(reg**2)
+            factor = cho_factor(ATA, check_finite=False)
+            c = cho_solve(factor, np.dot(A.T, y * ivar), check_finite=False)
             poly = np.dot(Afull, c)
 
+            # Marginalization over the coefficients
+            if np.all(self.params.get('marginalize_speccal', False)):
+                log_det = 2 * np.sum(np.log(np.diag(factor[0])))
+                lnmarg = 0.5 * order * np.log(2 * np.pi) - 0.5 * log_det
+                # gaussian prior for regularized coefficients, flat otherwise
+                r, cr = reg[regularized], c[regularized]
+                lnmarg += (-0.5 * np.sum(r**2 * cr**2) + np.sum(np.log(r)) -
+                           0.5 * regularized.sum() * np.log(2 * np.pi))
+                self.speccal_lnmarg = float(lnmarg)
+
             return (1.0 + poly) * self.params.get('spec_norm', 1.0)
         else:
             return 1.0
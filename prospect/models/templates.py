@@ -291,6 +291,8 @@ spec_norm = {'N': 10, 'isfree': False,
 npoly = 12
 porder = {'N': 1, 'isfree': False, 'init': npoly}
 preg = {'N': 1, 'isfree': False, 'init': 0.}
+# Integrate the polynomial out of the likelihood instead of optimizing it?
+pmarg = {'N': 1, 'isfree': False, 'init': False}
 polymax = 0.1 / (np.arange(npoly) + 1)
 pcoeffs = {'N': npoly, 'isfree': True,
            'init': np.zeros(npoly),
@@ -299,6 +301,7 @@ pcoeffs = {'N': npoly, 'isfree': True,
 
 _polyopt_ = {"polyorder": porder,         # order of polynomial to optimize
              "poly_regularization": preg, # Regularization of polynomial coeffs (can be a vector).
+             "marginalize_speccal": pmarg,  # Marginalize over the polynomial coeffs.
              "spec_norm": spec_norm       # Overall normalization of the spectrum.
              }
 _polyfit_ = {"spec_norm": spec_norm, # Overall normalization of the spectrum.
@@ -2,11 +2,12 @@ from .galaxy_basis import *
 from .ssp_basis import *
 from .star_basis import *
 from .dust_basis import *
-from .boneyard import StepSFHBasis
+from .sfh_basis import *
 
 __all__ = ["to_cgs",
            "CSPSpecBasis", "MultiComponentCSPBasis",
-           "FastSSPBasis", "SSPBasis",
-           "FastStepBasis", "StepSFHBasis",
+           "FastSSPBasis", "SSPBasis", "SSPGridBasis",
+           "FastStepBasis", "CachedStepBasis",
+           "StepSFHBasis", "CompositeSFH",
            "StarBasis", "BigStarBasis",
            "BlackBodyDustBasis"]
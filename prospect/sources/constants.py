@@ -9,7 +9,7 @@ __all__ = ['lsun', 'pc', 'lightspeed', 'ckms',
            'jansky_mks', 'jansky_cgs',
            'to_cgs_at_10pc', 'loge',
            'kboltz', 'hplanck',
-           'cosmo']
+           'cosmo', 'DistanceTable', 'luminosity_distance']
 
 # Useful constants
 lsun = 3.846e33  # erg/s
@@ -27,3 +27,101 @@ hplanck = 6.62606957e-27
 
 # change base
 loge = np.log10(np.e)
+
+
+class DistanceTable(object):
+    """A precomputed table of luminosity distance as a function of redshift,
+    for fast lookups.  ln(D_L) is linearly interpolated on a grid that is
+    regular in ln(z).  With the default grid (3000 points from z=1e-6 to
+    z=20) the relative error in D_L is less than 1e-6 (i.e. 2e-6 mag in the
+    distance modulus).  Below ``zmin`` the distance is taken to be
+    proportional to ``z``, and above ``zmax`` the cosmology object is used
+    directly.  The last scalar redshift and distance are remembered, so
+    repeated calls with the same redshift (e.g. fits with fixed redshift) do
+    no interpolation at all.
+
+    :param cosmology: (default: ``cosmo``)
+        An astropy cosmology object.
+
+    :param zmin: (default: 1e-6)
+        The smallest redshift in the table.
+
+    :param zmax: (default: 20)
+        The largest redshift in the table.
+
+    :param nz: (default: 3000)
+        The number of redshifts in the table.
+    """
+
+    def __init__(self, cosmology=None, zmin=1e-6, zmax=20., nz=3000):
+        if cosmology is None:
+            cosmology = cosmo
+        self.cosmology = cosmology
+        self.zmin, self.zmax = zmin, zmax
+        self.lnz = np.linspace(np.log(zmin), np.log(zmax), nz)
+        self.dlnz = self.lnz[1] - self.lnz[0]
+        zgrid = np.exp(self.lnz)
+        self.lndl = np.log(cosmology.luminosity_distance(zgrid).value)
+        self._last = (None, None)
+
+    def __call__(self, zred):
+        """Get the luminosity distance in Mpc.
+
+        :param zred:
+            Redshift(s), scalar or ndarray.  Should be greater than 0.
+
+        :returns lumdist:
+            Luminosity distance(s) in Mpc, same shape as ``zred``
+        """
+        if np.ndim(zred) == 0:
+            return self.scalar(float(zred))
+        return self.array(zred)
+
+    def scalar(self, zred):
+        """Scalar path, using the memo of the last value.
+        """
+        if zred == self._last[0]:
+            return self._last[1]
+        if zred > self.zmax:
+            dl = self.cosmology.luminosity_distance(zred).value
+        elif zred < self.zmin:
+            dl = np.exp(self.lndl[0]) * zred / self.zmin
+        else:
+            x = (np.log(zred) - self.lnz[0]) / self.dlnz
+            i = min(int(x), len(self.lnz) - 2)
+            f = x - i
+            dl = np.exp((1 - f) * self.lndl[i] + f * self.lndl[i + 1])
+        self._last = (zred, dl)
+        return dl
+
+    def array(self, zred):
+        """Vectorized path for arrays of redshifts.
+        """
+        zred = np.asarray(zred, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            lnz = np.log(zred)
+        dl = np.exp(np.interp(lnz, self.lnz, self.lndl))
+        low = zred < self.zmin
+        dl[low] = np.exp(self.lndl[0]) * zred[low] / self.zmin
+        high = zred > self.zmax
+        if np.any(high):
+            dl[high] = self.cosmology.luminosity_distance(zred[high]).value
+        return dl
+
+
+_distance_table = []
+
+
+def luminosity_distance(zred):
+    """Luminosity distance in Mpc for the default cosmology ``cosmo``, using
+    a :py:class:`DistanceTable` that is built on the first call.
+
+    :param zred:
+        Redshift(s), scalar or ndarray.
+
+    :returns lumdist:
+        Luminosity distance(s) in Mpc.
+    """
+    if len(_distance_table) == 0:
+        _distance_table.append(DistanceTable(cosmo))
+    return _distance_table[0](zred)
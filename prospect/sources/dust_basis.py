@@ -1,9 +1,6 @@
 import numpy as np
 
-try:
-    from sedpy.observate import getSED
-except(ImportError):
-    pass
+from ..utils.photometry import project_filters
 
 __all__ = ["BlackBodyDustBasis"]
 
@@ -72,7 +69,7 @@ class BlackBodyDustBasis(object):
                 cpars[k] = np.squeeze(self.params[k])
 
         spec = cpars['mass'] * modified_BB(wave, **cpars)
-        phot = 10**(-0.4 * getSED(wave*1e4, spec, filters))
+        phot = project_filters(wave*1e4, spec, filters)
         return spec, phot, None
 
     def normalization(self):
@@ -1,14 +1,18 @@
 from itertools import chain
 import numpy as np
+from numpy.polynomial.chebyshev import chebval
 from copy import deepcopy
 
-from .ssp_basis import SSPBasis
+from .ssp_basis import SSPBasis, new_push_counts
 from ..utils.smoothing import smoothspec
-from .constants import cosmo, lightspeed, jansky_cgs, to_cgs_at_10pc
+from ..utils.caching import LRUCache, hashable
+from ..utils.photometry import project_filters, project_filters_lngrid
+from .constants import lightspeed, jansky_cgs, to_cgs_at_10pc
+from .constants import luminosity_distance
 
 try:
     import fsps
-    from sedpy.observate import getSED, vac2air, air2vac
+    from sedpy.observate import vac2air, air2vac
 except(ImportError):
     pass
 
@@ -29,13 +33,32 @@ class CSPSpecBasis(SSPBasis):
     """
 
     def __init__(self, zcontinuous=1, reserved_params=['zred', 'sigma_smooth'],
-                 vactoair_flag=False, compute_vega_mags=False, **kwargs):
-
+                 vactoair_flag=False, compute_vega_mags=False,
+                 component_cache_size=16, pool=None, **kwargs):
+        """
+        :param component_cache_size: (default: 16)
+            The maximum number of component spectra to keep in memory, keyed
+            by the values of the FSPS parameters for that component.  A
+            component is only recomputed if its own parameters have changed.
+
+        :param pool: (optional)
+            An object with a ``map`` method, e.g. a ``multiprocessing.Pool``.
+            If given, the components that are not in the cache are computed
+            concurrently by the workers of this pool, each of which holds its
+            own ``fsps.StellarPopulation`` object.  Note that FSPS keeps the
+            SSPs in global state, so concurrent evaluation requires separate
+            processes rather than threads.
+        """
+        self._ssp_kwargs = dict(compute_vega_mags=compute_vega_mags,
+                                zcontinuous=zcontinuous,
+                                vactoair_flag=vactoair_flag)
         # This is a StellarPopulation object from fsps
-        self.ssp = fsps.StellarPopulation(compute_vega_mags=compute_vega_mags,
-                                          zcontinuous=zcontinuous,
-                                          vactoair_flag=vactoair_flag)
+        self.ssp = fsps.StellarPopulation(**self._ssp_kwargs)
         self.reserved_params = reserved_params
+        self._component_cache = LRUCache(maxsize=component_cache_size)
+        self._smoothers = LRUCache(maxsize=4)
+        self.push_counts = new_push_counts()
+        self.pool = pool
         self.params = {}
         self.update(**kwargs)
 
@@ -52,14 +75,18 @@ class CSPSpecBasis(SSPBasis):
             except:
                 self.params[k] = v
 
-    def update_component(self, component_index):
-        """Pass params that correspond to a single component through to the
-        fsps.StellarPopulation object.
+    def component_params(self, component_index):
+        """Get the parameters that correspond to a single component and that
+        are passed through to the fsps.StellarPopulation object.
 
         :param component_index:
             The index of the component for which to pull out individual
-            parameters that are passed to the fsps.StellarPopulation object.
+            parameters.
+
+        :returns pars:
+            A dictionary of FSPS parameter values for this component.
         """
+        pars = {}
         for k, v in list(self.params.items()):
             # Parameters named like FSPS params but that we reserve for use
             # here.  Do not pass them to FSPS.
@@ -78,8 +105,59 @@ class CSPSpecBasis(SSPBasis):
                 except(TypeError):
                     # It was scalar, use that value for all components
                     this_v = v
+                pars[k] = this_v
+        return pars
+
+    def update_component(self, component_index):
+        """Pass params that correspond to a single component through to the
+        fsps.StellarPopulation object.
+
+        :param component_index:
+            The index of the component for which to pull out individual
+            parameters that are passed to the fsps.StellarPopulation object.
+        """
+        self.push_params(self.component_params(component_index))
+
+    def get_component_spectra(self):
+        """Get the spectrum and surviving mass fraction of each component,
+        for the current parameters.  Components whose parameters are in the
+        cache are not recomputed.  The others are computed in turn, or
+        concurrently if ``pool`` was given.
+
+        :returns wave:
+            Wavelength in angstroms.
 
-                self.ssp.params[k] = deepcopy(this_v)
+        :returns spectra:
+            Component spectra in units of Lsun/Hz/solar masses formed.
+            ndarray of shape ``(ncomponent, nwave)``
+
+        :returns mfrac:
+            Fraction of the formed stellar mass that still exists for each
+            component, ndarray of shape ``(ncomponent,)``
+        """
+        ncomp = len(np.atleast_1d(self.params['mass']))
+        pars = [self.component_params(i) for i in range(ncomp)]
+        keys = [tuple(sorted((k, hashable(v)) for k, v in p.items()))
+                for p in pars]
+        out = [self._component_cache.get(key) for key in keys]
+        todo = [i for i, o in enumerate(out) if o is None]
+        if (self.pool is not None) and (len(todo) > 1):
+            args = [(self._ssp_kwargs, pars[i]) for i in todo]
+            for i, o in zip(todo, self.pool.map(component_spectrum, args)):
+                out[i] = o
+        else:
+            for i in todo:
+                self.update_component(i)
+                wave, spec = self.ssp.get_spectrum(tage=self.ssp.params['tage'],
+                                                   peraa=False)
+                out[i] = wave, spec, self.ssp.stellar_mass
+        for i in todo:
+            self._component_cache[keys[i]] = out[i]
+
+        wave = out[0][0]
+        spectra = np.array([o[1] for o in out])
+        mfrac = np.array([o[2] for o in out], dtype=np.float64)
+        return wave, spectra, mfrac
 
     def get_galaxy_spectrum(self, **params):
         """Update parameters, then loop over each component getting a spectrum
@@ -100,21 +178,13 @@ class CSPSpecBasis(SSPBasis):
             Fraction of the formed stellar mass that still exists.
         """
         self.update(**params)
-        spectra = []
-        mass = np.atleast_1d(self.params['mass']).copy()
-        mfrac = np.zeros_like(mass)
-        # Loop over mass components
-        for i, m in enumerate(mass):
-            self.update_component(i)
-            wave, spec = self.ssp.get_spectrum(tage=self.ssp.params['tage'],
-                                               peraa=False)
-            spectra.append(spec)
-            mfrac[i] = (self.ssp.stellar_mass)
+        mass = np.atleast_1d(self.params['mass']).astype(np.float64)
+        wave, spectra, mfrac = self.get_component_spectra()
 
         # Convert normalization units from per stellar mass to per mass formed
         if np.all(self.params.get('mass_units', 'mformed') == 'mstar'):
             mass /= mfrac
-        spectrum = np.dot(mass, np.array(spectra)) / mass.sum()
+        spectrum = np.dot(mass, spectra) / mass.sum()
         mfrac_sum = np.dot(mass, mfrac) / mass.sum()
 
         return wave, spectrum, mfrac_sum
@@ -154,26 +224,19 @@ class MultiComponentCSPBasis(CSPSpecBasis):
             shape (ncomponent+1,)
         """
         self.update(**params)
-        spectra = []
-        mass = np.atleast_1d(self.params['mass']).copy()
-        mfrac = np.zeros_like(mass)
-        # Loop over mass components
-        for i, m in enumerate(mass):
-            self.update_component(i)
-            wave, spec = self.ssp.get_spectrum(tage=self.ssp.params['tage'],
-                                               peraa=False)
-            spectra.append(spec)
-            mfrac[i] = (self.ssp.stellar_mass)
+        mass = np.atleast_1d(self.params['mass']).astype(np.float64)
+        wave, spectra, mfrac = self.get_component_spectra()
 
         # Convert normalization units from per stellar mass to per mass formed
         if np.all(self.params.get('mass_units', 'mformed') == 'mstar'):
             mass /= mfrac
-        spectrum = np.dot(mass, np.array(spectra)) / mass.sum()
+        spectrum = np.dot(mass, spectra) / mass.sum()
         mfrac_sum = np.dot(mass, mfrac) / mass.sum()
 
-        return wave, np.squeeze(spectra + [spectrum]), np.squeeze(mfrac.tolist() + [mfrac_sum])
+        return wave, np.squeeze(np.vstack([spectra, spectrum])), np.append(mfrac, mfrac_sum)
 
-    def get_spectrum(self, outwave=None, filters=None, component=-1, **params):
+    def get_spectrum(self, outwave=None, filters=None, component=-1,
+                     lnwavegrid=None, **params):
         """Get a spectrum and SED for the given params, choosing from different
         possible components.
 
@@ -194,6 +257,13 @@ class MultiComponentCSPBasis(CSPSpecBasis):
             component from which to choose the magnitude.  scalar or iterable
             of same length as `filters`
 
+        :param lnwavegrid: (optional)
+            An observed frame wavelength grid with constant spacing in
+            ln(wavelength) that covers all the filters.  If given, the
+            ``lngrid_photometry`` parameter is ``True``, and there is no
+            wavelength calibration, the photometry is computed on this grid.
+            See :py:meth:`SSPBasis.get_spectrum`.
+
         :param **params:
             Optional keywords giving parameter values that will be used to
             generate the predicted spectrum.
@@ -236,9 +306,17 @@ class MultiComponentCSPBasis(CSPSpecBasis):
             # note that this may scramble order of unique_filters
             fnames = [f.name for f in filters]
             unique_names, uinds, filter_ind = np.unique(fnames, return_index=True, return_inverse=True)
-            unique_filters = np.array(filters)[uinds]
-            mags = getSED(wa, lightspeed/wa**2 * sa * to_cgs, unique_filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            unique_filters = [filters[i] for i in uinds]
+            use_lngrid = (np.all(self.params.get('lngrid_photometry', False)) and
+                          (lnwavegrid is not None) and (np.ndim(b) == 0))
+            if use_lngrid:
+                flam = lightspeed/wave**2 * spectrum * to_cgs
+                phot = project_filters_lngrid(wave, flam, unique_filters,
+                                              lnwavegrid, a=a + b)
+            else:
+                phot = project_filters(wa, lightspeed/wa**2 * sa * to_cgs,
+                                       unique_filters)
+            phot = np.atleast_1d(phot)
         else:
             phot = 0.0
             filter_ind = 0
@@ -250,7 +328,7 @@ class MultiComponentCSPBasis(CSPSpecBasis):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = cosmo.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
 
         # Spectrum will be in maggies
@@ -268,6 +346,64 @@ class MultiComponentCSPBasis(CSPSpecBasis):
 
         return sa, phot, mfrac
 
+    def get_spectrum_batch(self, param_list, **kwargs):
+        """Call :py:meth:`get_spectrum` for each parameter dictionary in
+        ``param_list`` and stack the results.  The component spectra are not
+        amenable to the batched observed frame calculations of
+        :py:meth:`SSPBasis.get_spectrum_batch`.
+
+        :returns spec:
+            ndarray of shape ``(N, ncomp+1, nwave)``
+
+        :returns phot:
+            ndarray of shape ``(N, nfilters)``
+
+        :returns mass_frac:
+            ndarray of shape ``(N, ncomp+1)``
+        """
+        out = []
+        for params in param_list:
+            pars = dict(kwargs)
+            pars.update(params)
+            out.append(self.get_spectrum(**pars))
+        spec, phot, mfrac = zip(*out)
+        return np.array(spec), np.array(phot), np.array(mfrac)
+
+
+# FSPS objects for use by the workers of a pool, keyed by the keyword arguments
+# used to create them.
+_worker_ssps = {}
+
+
+def component_spectrum(args):
+    """Compute the spectrum of one component in a (possibly separate) process,
+    using a ``fsps.StellarPopulation`` object that is created on the first
+    call and reused thereafter.
+
+    :param args:
+        A tuple of ``(ssp_kwargs, pars)`` giving the keyword arguments used to
+        create the ``fsps.StellarPopulation`` object and a dictionary of the
+        FSPS parameter values for the component.
+
+    :returns wave:
+        Wavelength in angstroms.
+
+    :returns spec:
+        Spectrum in units of Lsun/Hz/solar masses formed.
+
+    :returns mfrac:
+        Fraction of the formed stellar mass that still exists.
+    """
+    ssp_kwargs, pars = args
+    key = tuple(sorted(ssp_kwargs.items()))
+    if key not in _worker_ssps:
+        _worker_ssps[key] = fsps.StellarPopulation(**ssp_kwargs)
+    ssp = _worker_ssps[key]
+    for k, v in pars.items():
+        ssp.params[k] = deepcopy(v)
+    wave, spec = ssp.get_spectrum(tage=ssp.params['tage'], peraa=False)
+    return wave, spec, ssp.stellar_mass
+
 
 def gauss(x, mu, A, sigma):
     """Lay down mutiple gaussians on the x-axis.
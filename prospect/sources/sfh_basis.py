@@ -0,0 +1,519 @@
+import numpy as np
+from scipy.special import expi, gammainc
+
+from .ssp_basis import SSPBasis
+from ..utils.caching import LRUCache, hashable
+from .constants import loge
+
+__all__ = ["SFHWeightBasis", "StepSFHBasis", "CompositeSFH"]
+
+
+class SFHWeightBasis(SSPBasis):
+    """Base class for subclasses of :py:class:`SSPBasis` that compute the SSP
+    weights of a composite SFH analytically, in NumPy.  Subclasses implement
+    ``all_ssp_weights`` for the current parameters and
+    :py:meth:`ssp_weights_batch` for a list of parameter dictionaries.
+    """
+
+    def ssp_weights_batch(self, param_list):
+        """Get the SSP weights for each of a list of parameter dictionaries.
+        This base implementation updates the parameters and computes
+        ``all_ssp_weights`` for each dictionary in turn.
+
+        :param param_list:
+            A list of N parameter dictionaries.
+
+        :returns weights:
+            ndarray of shape ``(N, nage+1)``
+        """
+        weights = []
+        for params in param_list:
+            self.update(**params)
+            weights.append(self.all_ssp_weights)
+        return np.array(weights)
+
+    def get_galaxy_spectrum_batch(self, param_list):
+        """Get the restframe spectra and surviving mass fractions for a list of
+        parameter dictionaries.  If the SSP spectra are the same for all the
+        dictionaries (i.e. only the SFH parameters vary) the weights are
+        computed with :py:meth:`ssp_weights_batch` and the spectra are given
+        by a single matrix product.  Otherwise this is equivalent to calling
+        ``get_galaxy_spectrum`` for each dictionary.
+
+        :param param_list:
+            A list of N parameter dictionaries.
+
+        :returns wave:
+            Wavelength in angstroms, ndarray of shape ``(nwave,)``
+
+        :returns spectrum:
+            Spectra in units of Lsun/Hz/solar masses formed, ndarray of shape
+            ``(N, nwave)``
+
+        :returns mass_fraction:
+            Fraction of the formed stellar mass that still exists, ndarray of
+            shape ``(N,)``
+        """
+        keys = []
+        for params in param_list:
+            self.update(**params)
+            keys.append(self.ssp_key())
+        # Only do the matrix product if the SSP spectra come from
+        # get_ssp_spectra, and they are the same for every parameter set.
+        standard = (self.__class__.get_galaxy_spectrum ==
+                    SSPBasis.get_galaxy_spectrum)
+        if (not standard) or (len(set(keys)) > 1):
+            out = [self.get_galaxy_spectrum(**params) for params in param_list]
+            wave, spectrum, mfrac = zip(*out)
+            return wave[0], np.array(spectrum), np.array(mfrac)
+
+        wave, ssp_spectra, self.ssp_stellar_masses = self.get_ssp_spectra()
+        weights = self.ssp_weights_batch(param_list)
+        wsum = weights.sum(axis=-1)
+        spectrum = np.dot(weights, ssp_spectra) / wsum[:, None]
+        if self.flux_interp == 'logarithmic':
+            spectrum = np.exp(spectrum)
+        mass_frac = np.dot(weights, self.ssp_stellar_masses) / wsum
+        return wave, spectrum, mass_frac
+
+
+class StepSFHBasis(SFHWeightBasis):
+    """Subclass of SSPBasis that computes SSP weights for piecewise constant
+    SFHs (i.e. a binned SFH).  The parameters for this SFH are:
+
+      * `agebins` - array of shape (nbin, 2) giving the younger and older (in
+        lookback time) edges of each bin.  If `interp_type` is `"linear"',
+        these are assumed to be in years.  Otherwise they are in log10(years)
+
+      * `mass` - array of shape (nbin,) giving the total surviving stellar mass
+        (in solar masses) in each bin, unless the `mass_units` parameter is set
+        to something different `"mstar"`, in which case the units are assumed
+        to be total stellar mass *formed* in each bin.
+
+    The SSP weights for one solar mass formed in each bin are cached, keyed on
+    the values of `agebins`, `interp_type`, and `mint_log`.
+    """
+
+    def __init__(self, weight_cache_size=8, **kwargs):
+        """
+        :param weight_cache_size: (default: 8)
+            The maximum number of sets of bin weights to keep in memory.
+
+        Other keywords are as for :py:class:`SSPBasis`.
+        """
+        self._weight_cache = LRUCache(maxsize=weight_cache_size)
+        super(StepSFHBasis, self).__init__(**kwargs)
+
+    @property
+    def all_ssp_weights(self):
+        # Now normalize the weights in each bin by the mass parameter, and sum
+        # over bins.
+        self._bin_weights = self.all_bin_weights(self.params['agebins'])
+        bin_masses = np.atleast_1d(self.params['mass']).astype(np.float64)
+        if np.all(self.params.get('mass_units', 'mformed') == 'mstar'):
+            # Convert from mstar to mformed for each bin.  We have to do this
+            # here as well as in get_spectrum because the *relative*
+            # normalization in each bin depends on the units, as well as the
+            # overall normalization.
+            bin_masses = bin_masses / self.bin_mass_fraction
+        return np.dot(bin_masses, self._bin_weights)
+
+    def ssp_weights_batch(self, param_list):
+        """Get the SSP weights for each of a list of parameter dictionaries.
+        If ``agebins`` is the same for all of them, this is a single matrix
+        product of the bin masses with the cached bin weights.
+
+        :param param_list:
+            A list of N parameter dictionaries.
+
+        :returns weights:
+            ndarray of shape ``(N, nage+1)``
+        """
+        pars = [dict(self.params, **p) for p in param_list]
+        agebins = [hashable(np.atleast_2d(p['agebins'])) for p in pars]
+        if len(set(agebins)) > 1:
+            return super(StepSFHBasis, self).ssp_weights_batch(param_list)
+        self._bin_weights = self.all_bin_weights(pars[0]['agebins'])
+        masses = np.array([np.atleast_1d(p['mass']) for p in pars], dtype=np.float64)
+        mstar = np.array([np.all(p.get('mass_units', 'mformed') == 'mstar')
+                          for p in pars])
+        if mstar.any():
+            masses[mstar] = masses[mstar] / self.bin_mass_fraction
+        return np.dot(masses, self._bin_weights)
+
+    @property
+    def bin_mass_fraction(self):
+        """Return the ratio m_star(surviving) / m_formed for each bin.
+        """
+        try:
+            mstar = self.ssp_stellar_masses
+            w = self._bin_weights
+        except(AttributeError):
+            raise ValueError("The bin weights and SSP masses have not been "
+                             "computed; call get_galaxy_spectrum first.")
+        bin_mfrac = (mstar[None, :] * w).sum(axis=-1) / w.sum(axis=-1)
+        return bin_mfrac
+
+    @property
+    def sspages(self):
+        """The edges of the sub-bins between SSP ages (in log10(years) or years
+        depending on ``interp_type``), including the youngest age given by
+        ``mint_log``.
+        """
+        if self.interp_type == 'linear':
+            return np.insert(10**self.logage, 0, 0)
+        elif self.interp_type == 'logarithmic':
+            return np.insert(self.logage, 0, self.mint_log)
+
+    def all_bin_weights(self, agebins):
+        """Get the SSP weights for one solar mass formed in each of the given
+        age bins, from the cache if possible.
+
+        :param agebins:
+            Array of shape (nbin, 2) giving the younger and older edges of each
+            bin.
+
+        :returns weights:
+            ndarray of shape ``(nbin, nage+1)``.  This should not be modified in
+            place.
+        """
+        agebins = np.atleast_2d(agebins)
+        key = (self.interp_type, self.mint_log, hashable(agebins))
+        try:
+            return self._weight_cache[key]
+        except(KeyError):
+            pass
+        self._weight_cache[key] = self.bin_weights(agebins[:, 0], agebins[:, 1])
+        return self._weight_cache[key]
+
+    def bin_weights(self, amin, amax):
+        """Compute normalizations required to get a piecewise constant SFH
+        within an age bin.  This is super complicated and obscured.  The output
+        weights are such that one solar mass will have formed during the bin
+        (i.e. SFR = 1/(amax-amin))
+
+        This computes weights using \int_tmin^tmax dt (\log t_i - \log t) /
+        (\log t_{i+1} - \log t_i) but see sfh.tex for the detailed calculation
+        and the linear time interpolation case.
+
+        :param amin:
+            The younger edge(s) of the bin(s), scalar or ndarray of shape (nbin,)
+
+        :param amax:
+            The older edge(s) of the bin(s), same shape as ``amin``
+
+        :returns ww:
+            The SSP weights, ndarray of shape ``(nage+1,)`` or ``(nbin, nage+1)``
+        """
+        sspages = self.sspages
+        if self.interp_type == 'linear':
+            func = constant_linear
+            mass = amax - amin
+        elif self.interp_type == 'logarithmic':
+            func = constant_logarithmic
+            mass = 10**np.asarray(amax) - 10**np.asarray(amin)
+
+        assert np.all(amin >= sspages[0])
+        assert np.all(amax <= sspages.max())
+
+        # below could be done by using two separate dt vectors instead of two
+        # age vectors.  Extra leading axis is for the bins.
+        ages = np.array([sspages[:-1], sspages[1:]])
+        dt = np.diff(ages, axis=0)
+        lo = np.reshape(amin, (-1, 1, 1))
+        hi = np.reshape(amax, (-1, 1, 1))
+        tlim = np.clip(ages, lo, hi)
+        tmin, tmax = tlim[:, :1], tlim[:, 1:]
+
+        # get contributions from SSP sub-bin to the left and from SSP sub-bin
+        # to the right
+        lr = (func(ages, tmax) - func(ages, tmin)) / dt
+        left, right = lr[:, 0], lr[:, 1]
+        # put into full array
+        ww = np.zeros([len(lo), len(sspages)])
+        ww[:, :-1] += right  # last element has no sub-bin to the right
+        ww[:, 1:] += -left  # need to flip sign
+
+        # normalize to 1 solar mass formed and return
+        ww /= np.reshape(mass, (-1, 1))
+        if np.ndim(amin) == 0:
+            return ww[0]
+        return ww
+
+
+class CompositeSFH(SFHWeightBasis):
+    """Subclass of SSPBasis that computes SSP weights for a parameterized SF.
+    The parameters for this SFH are:
+
+      * `sfh_type` - String of "delaytau", "tau", "simha"
+
+      * `tage`, `sf_trunc`,  `sf_slope`, `tau`
+
+      * `mass` -
+
+    Constant and burst components are not implemented, so a ValueError is
+    raised if `const` or `fburst` is nonzero.
+
+    The SFH parameters can also be given as arrays of shape (N,) to
+    :py:meth:`all_ssp_weights_batch` to compute the weights for N SFHs at once.
+    """
+
+    # SFH parameters that are broadcast in the batch weight calculations
+    batch_params = ['tage', 'tau', 'sf_trunc', 'sf_slope', 'const',
+                    'fburst', 'tburst']
+
+    def configure(self):
+        """This reproduces FSPS-like combinations of SFHs.  Note that the
+        *same* parameter set is passed to each component in the combination
+        """
+        sfhs = [self.sfh_type]
+        limits = len(sfhs) * ['regular']
+        if 'simha' in self.sfh_type:
+            sfhs = ['delaytau', 'linear']
+            limits = ['regular', 'simha']
+
+        fnames = ['{0}_{1}'.format(f, self.interp_type) for f in sfhs]
+        lnames = ['{}_limits'.format(f) for f in limits]
+        self.funcs = [globals()[f] for f in fnames]
+        self.limits = [globals()[f] for f in lnames]
+
+        if self.interp_type == 'linear':
+            sspages = np.insert(10**self.logage, 0, 0)
+        elif self.interp_type == 'logarithmic':
+            sspages = np.insert(self.logage, 0, self.mint_log)
+        self.ages = np.array([sspages[:-1], sspages[1:]])
+        self.dt = np.diff(self.ages, axis=0)
+        self._configuration = (self.sfh_type, self.interp_type, self.mint_log)
+
+    @property
+    def all_ssp_weights(self):
+        return self.all_ssp_weights_batch(**self.params)[0]
+
+    def ssp_weights_batch(self, param_list):
+        """Get the SSP weights for each of a list of parameter dictionaries,
+        with a single call to :py:meth:`all_ssp_weights_batch`.
+
+        :param param_list:
+            A list of N parameter dictionaries.
+
+        :returns weights:
+            ndarray of shape ``(N, nage+1)``
+        """
+        pars = [dict(self.params, **p) for p in param_list]
+        batch = {}
+        for k in self.batch_params:
+            if k in pars[0]:
+                batch[k] = np.array([np.squeeze(p[k]) for p in pars], dtype=np.float64)
+        return self.all_ssp_weights_batch(**batch)
+
+    def all_ssp_weights_batch(self, **params):
+        """Compute the SSP weights for N sets of SFH parameters at once.
+
+        :param params:
+            The SFH parameters, each scalar or ndarray of shape (N,)
+
+        :returns weights:
+            ndarray of shape ``(N, nage+1)``, each row normalized to sum to one.
+        """
+        if getattr(self, '_configuration', None) != (self.sfh_type, self.interp_type,
+                                                     self.mint_log):
+            self.configure()
+        # Full output weight array.  We keep separate vectors for each
+        # component so we can renormalize after the loop, but for many
+        # components it would be better to renormalize and sum within the loop
+        ww = np.array([self.ssp_weights(func, limit, params)
+                       for limit, func in zip(self.limits, self.funcs)])
+
+        # renormalize each component to 1 Msun
+        assert np.all(ww >= 0)
+        wsum = ww.sum(axis=-1)
+        # unless truly no SF in the component
+        wsum[wsum == 0] = 1.0
+        ww /= wsum[..., None]
+        # apply relative normalizations
+        ww *= self.normalizations(**params)[..., None]
+        # And finally add all components together and renormalize again to
+        # 1Msun and return
+        ww = ww.sum(axis=0)
+        return ww / ww.sum(axis=-1)[:, None]
+
+    def ssp_weights(self, integral, limit_function, params, **extras):
+        """Compute the SSP weights of a single SFH component.
+
+        :param params:
+            Dictionary of SFH parameters, each scalar or ndarray of shape (N,)
+
+        :returns ww:
+            ndarray of shape ``(N, nage+1)``
+        """
+        # Make the SFH parameters broadcast against the (2, nage) ages
+        pars = dict(params)
+        for k in self.batch_params:
+            if k in pars:
+                pars[k] = np.reshape(np.asarray(pars[k], dtype=np.float64), (-1, 1, 1))
+        tlim = limit_function(self.ages, mint_log=self.mint_log,
+                              interp_type=self.interp_type, **pars)
+        tlim = np.reshape(tlim, (-1,) + self.ages.shape)
+        tmin, tmax = tlim[:, :1], tlim[:, 1:]
+        lr = (integral(self.ages, tmax, **pars) -
+              integral(self.ages, tmin, **pars)) / self.dt
+        left, right = lr[:, 0], lr[:, 1]
+        # build full output weight vector
+        ww = np.zeros([len(lr), self.ages.shape[-1] + 1])
+        # Put into full array, shifting the `right` terms by 1 element
+        ww[:, :-1] += right  # last SSP has no sub-bin to the right
+        ww[:, 1:] += -left   # need to flip sign
+
+        # Note that now ww[i,1] = right[1] - left[0], where
+        # left[0] is the integral from tmin,0 to tmax,0 of
+        # SFR(t) * (sspages[0] - t)/(sspages[1] - sspages[0]) and
+        # right[1] is the integral from tmin,1 to tmax,1 of
+        # SFR(t) * (sspages[2] - t)/(sspages[2] - sspages[1])
+        return ww
+
+    def normalizations(self, tage=0., sf_trunc=0, sf_slope=0, const=0,
+                       fburst=0, tau=0., **extras):
+        """Relative normalizations of the SFH components.
+
+        :returns norms:
+            ndarray of shape ``(ncomp, N)``
+        """
+        tage, sf_trunc, sf_slope, const, fburst, tau = [
+            np.atleast_1d(np.asarray(v, dtype=np.float64))
+            for v in (tage, sf_trunc, sf_slope, const, fburst, tau)]
+        if np.any(const != 0) or np.any(fburst != 0):
+            raise ValueError("Constant and burst components are not "
+                             "implemented in CompositeSFH; `const` and "
+                             "`fburst` must be zero.")
+        notrunc = (sf_trunc <= 0) | (sf_trunc > tage)
+        Tmax = np.where(notrunc, tage, sf_trunc)
+        # Tau models.  SFH=1 -> power=1; SFH=4,5 -> power=2
+        if ('delay' in self.sfh_type) or ('simha' in self.sfh_type):
+            power = 2.
+        else:
+            power = 1.
+        mass_tau = tau * gammainc(power, Tmax/tau)
+
+        if 'simha' not in self.sfh_type:
+            return np.array([mass_tau])
+        # SFR at Tmax
+        sfr_q = (Tmax/tau)**(power-1) * np.exp(-Tmax/tau)
+
+        # linear.  integral of (1 - m * (T - Tmax)) from Tmax to Tzero
+        with np.errstate(divide='ignore'):
+            Tz = np.where(sf_slope == 0, tage, Tmax + 1 / sf_slope)
+        bad = (Tz < Tmax) | (Tz > tage) | (~np.isfinite(Tz))
+        Tz = np.where(bad, tage, Tz)
+        m = sf_slope
+        mass_linear = (Tz - Tmax) - m/2.*(Tz**2 + Tmax**2) + m*Tz*Tmax
+
+        # normalize the linear portion relative to the tau portion
+        norms = np.array([np.ones_like(mass_tau), mass_linear * sfr_q / mass_tau])
+        norms /= norms.sum(axis=0)
+        return norms
+
+
+def regular_limits(ages, tage=0., sf_trunc=0., mint_log=-3,
+                   interp_type='logarithmic', **extras):
+        # get the truncation time in units of lookback time
+        notrunc = (sf_trunc <= 0) | (sf_trunc > tage)
+        tq = np.where(notrunc, 0, tage - sf_trunc)
+        if interp_type == 'logarithmic':
+            tq = np.log10(np.maximum(tq, 10**mint_log))
+            tage = np.log10(np.maximum(tage, 10**mint_log))
+        return np.clip(ages, tq, tage)
+
+
+def simha_limits(ages, tage=0., sf_trunc=0, sf_slope=0., mint_log=-3,
+                 interp_type='logarithmic', **extras):
+        # get the truncation time in units of lookback time
+        notrunc = (sf_trunc <= 0) | (sf_trunc > tage)
+        tq = np.where(notrunc, 0, tage - sf_trunc)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0 = tq - 1. / np.float64(sf_slope)
+        bad = (t0 > tq) | (t0 <= 0) | (~np.isfinite(t0))
+        t0 = np.where(bad, 0., t0)
+        if interp_type == 'logarithmic':
+            tq = np.log10(np.maximum(tq, 10**mint_log))
+            t0 = np.log10(np.maximum(t0, 10**mint_log))
+        return np.clip(ages, t0, tq)
+
+
+def constant_linear(ages, t, **extras):
+    """Indefinite integral for SFR = 1
+
+    :param ages:
+        Linear age(s) of the SSPs.
+
+    :param t:
+        Linear time at which to evaluate the indefinite integral
+    """
+    return ages * t - t**2 / 2
+
+
+def constant_logarithmic(logages, logt, **extras):
+    """SFR = 1
+    """
+    t = 10**logt
+    return t * (logages - logt + loge)
+
+
+def tau_linear(ages, t, tau=None, **extras):
+    """SFR = e^{(tage-t)/\tau}
+    """
+    return (ages - t + tau) * np.exp(t / tau)
+
+
+def tau_logarithmic(logages, logt, tau=None, **extras):
+    """SFR = e^{(tage-t)/\tau}
+    """
+    tprime = 10**logt / tau
+    return (logages - logt) * np.exp(tprime) + loge * expi(tprime)
+
+
+def delaytau_linear(ages, t, tau=None, tage=None, **extras):
+    """SFR = (tage-t) * e^{(tage-t)/\tau}
+    """
+    bracket = tage * ages - (tage + ages)*(t - tau) + t**2 - 2*t*tau + 2*tau**2
+    return bracket * np.exp(t / tau)
+
+
+def delaytau_logarithmic(logages, logt, tau=None, tage=None, **extras):
+    """SFR = (tage-t) * e^{(tage-t)/\tau}
+    """
+    t = 10**logt
+    tprime = t / tau
+    a = (t - tage - tau) * (logt - logages) - tau * loge
+    b = (tage + tau) * loge
+    return a * np.exp(tprime) + b * expi(tprime)
+
+
+def linear_linear(ages, t, tage=None, sf_trunc=0, sf_slope=0., **extras):
+    """SFR = [1 - sf_slope * (tage-t)]
+    """
+    tq = np.maximum(0, tage-sf_trunc)
+    k = 1 - sf_slope * tq
+    return k * ages * t + (sf_slope*ages - k) * t**2 / 2 - sf_slope * t**3 / 3
+
+
+def linear_logarithmic(logages, logt, tage=None, sf_trunc=0, sf_slope=0., **extras):
+    """SFR = [1 - sf_slope * (tage-t)]
+    """
+    tq = np.maximum(0, tage-sf_trunc)
+    t = 10**logt
+    k = 1 - sf_slope * tq
+    term1 = k * t * (logages - logt + loge)
+    term2 = sf_slope * t**2 / 2 * (logages - logt + loge / 2)
+    return term1 + term2
+
+
+def burst_linear(ages, t, tburst=None, **extras):
+    """Burst.  SFR = \delta(t-t_burst)
+    """
+    return ages - tburst
+
+
+def burst_logarithmic(logages, logt, tburst=None, **extras):
+    """Burst.  SFR = \delta(t-t_burst)
+    """
+    return logages - np.log10(tburst)
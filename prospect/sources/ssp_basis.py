@@ -1,18 +1,23 @@
+import os
+import hashlib
+import warnings
 from copy import deepcopy
 import numpy as np
-from numpy.polynomial.chebyshev import chebval
+from numpy.polynomial.chebyshev import chebval, chebvander
 
-from ..utils.smoothing import smoothspec
-from .constants import cosmo, lightspeed, jansky_cgs, to_cgs_at_10pc
+from ..utils.smoothing import smoothspec, Smoother, RedshiftSmoother
+from ..utils.caching import LRUCache, hashable
+from ..utils.photometry import project_filters, project_filters_lngrid
+from .constants import lightspeed, jansky_cgs, to_cgs_at_10pc
+from .constants import luminosity_distance
 
 try:
     import fsps
-    from sedpy.observate import getSED
 except(ImportError):
     pass
 
-__all__ = ["SSPBasis", "FastSSPBasis", "FastStepBasis",
-           "MultiSSPBasis"]
+__all__ = ["SSPBasis", "FastSSPBasis", "FastStepBasis", "CachedStepBasis",
+           "SSPGridBasis", "MultiSSPBasis"]
 
 
 to_cgs = to_cgs_at_10pc
@@ -45,9 +50,19 @@ class SSPBasis(object):
         their functionality using (hopefully more efficient) custom algorithms.
     """
 
+    # Extra range, in ln(wavelength), of the cached restframe smoothers
+    # beyond the range of the output wavelengths, so that they are reused for
+    # small changes of the redshift.  See get_smoother.
+    smoother_zmargin = 0.01
+
+    # FSPS parameters that only affect the FSPS composite SFH, and so do not
+    # change the SSP spectra.
+    sfh_params = ['tage', 'sfh', 'tau', 'const', 'sf_start', 'sf_trunc',
+                  'sf_slope', 'tburst', 'fburst']
+
     def __init__(self, zcontinuous=1, reserved_params=['tage', 'sigma_smooth'],
                  interp_type='logarithmic', flux_interp='linear', sfh_type='ssp',
-                 mint_log=-3, compute_vega_mags=False,
+                 mint_log=-3, compute_vega_mags=False, ssp_cache_size=8,
                  **kwargs):
         """
         :param interp_type: (default: "logarithmic")
@@ -71,6 +86,11 @@ class SSPBasis(object):
             will not be passed to the StellarPopulation object because we are
             overriding their functionality using (hopefully more efficient)
             custom algorithms.
+
+        :param ssp_cache_size: (default: 8)
+            The maximum number of sets of SSP spectra to keep in memory, keyed
+            by the values of the FSPS parameters that affect them.  See
+            :py:meth:`get_ssp_spectra`.
         """
 
         self.interp_type = interp_type
@@ -81,6 +101,9 @@ class SSPBasis(object):
                                           zcontinuous=zcontinuous)
         self.ssp.params['sfh'] = 0
         self.reserved_params = reserved_params
+        self._ssp_cache = LRUCache(maxsize=ssp_cache_size)
+        self._smoothers = LRUCache(maxsize=4)
+        self.push_counts = new_push_counts()
         self.params = {}
         self.update(**kwargs)
 
@@ -91,6 +114,7 @@ class SSPBasis(object):
         :param params:
             A parameter dictionary.
         """
+        fsps_params = {}
         for k, v in params.items():
             # try to make parameters scalar
             try:
@@ -107,12 +131,39 @@ class SSPBasis(object):
             # Otherwise if a parameter exists in the FSPS parameter set, pass a
             # copy of it in.
             if k in self.ssp.params.all_params:
-                self.ssp.params[k] = deepcopy(v)
+                fsps_params[k] = v
+        self.push_params(fsps_params)
 
         # We use FSPS for SSPs !!ONLY!!
         # except for FastStepBasis.  And CSPSpecBasis. and...
         # assert self.ssp.params['sfh'] == 0
 
+    def push_params(self, params):
+        """Pass parameter values through to the ``fsps.StellarPopulation``
+        object, skipping any that are equal to the value FSPS already has.
+        Assigning some parameters marks the SSPs as dirty in python-fsps even
+        if the value is unchanged, so this avoids needless regeneration of
+        the SSPs.  The number of parameters pushed and skipped, and the number
+        of calls in which SSP parameters were given but none had changed, are
+        accumulated in the ``push_counts`` dictionary.
+
+        :param params:
+            A dictionary of FSPS parameter values.
+        """
+        counts = self.push_counts
+        ssp_params = getattr(self.ssp.params, 'ssp_params', [])
+        ssp_pushed, ssp_skipped = False, False
+        for k, v in params.items():
+            if values_equal(self.ssp.params[k], v):
+                counts['skipped'] += 1
+                ssp_skipped = ssp_skipped or (k in ssp_params)
+                continue
+            self.ssp.params[k] = deepcopy(v)
+            counts['pushed'] += 1
+            ssp_pushed = ssp_pushed or (k in ssp_params)
+        if ssp_skipped and not ssp_pushed:
+            counts['ssp_regenerations_avoided'] += 1
+
     def get_galaxy_spectrum(self, **params):
         """Update parameters, then multiply SSP weights by SSP spectra and
         stellar masses, and sum.
@@ -128,13 +179,9 @@ class SSPBasis(object):
         """
         self.update(**params)
 
-        # Get the SSP spectra and masses (caching the latter), adding an extra
-        # mass and spectrum for t=0, using the first SSP spectrum.
-        wave, ssp_spectra = self.ssp.get_spectrum(tage=0, peraa=False)
-        ssp_spectra = np.vstack([ssp_spectra[0, :], ssp_spectra])
-        self.ssp_stellar_masses = np.insert(self.ssp.stellar_mass, 0, 1.0)
-        if self.flux_interp == 'logarithmic':
-            ssp_spectra = np.log(ssp_spectra)
+        # Get the SSP spectra and masses (caching the latter), including an
+        # extra mass and spectrum for t=0.
+        wave, ssp_spectra, self.ssp_stellar_masses = self.get_ssp_spectra()
 
         # Get weighted sum of spectra, adding the t=0 spectrum using the first SSP.
         weights = self.all_ssp_weights
@@ -146,7 +193,8 @@ class SSPBasis(object):
         mass_frac = (self.ssp_stellar_masses * weights).sum() / weights.sum()
         return wave, spectrum, mass_frac
 
-    def get_spectrum(self, outwave=None, filters=None, peraa=False, **params):
+    def get_spectrum(self, outwave=None, filters=None, peraa=False,
+                     lnwavegrid=None, **params):
         """Get a spectrum and SED for the given params.
 
         :param outwave: (default: None)
@@ -160,6 +208,14 @@ class SSPBasis(object):
         :param filters: (default: None)
             A list of filter objects for which you'd like photometry to be calculated.
 
+        :param lnwavegrid: (optional)
+            An observed frame wavelength grid with constant spacing in
+            ln(wavelength) that covers all the filters (e.g.
+            ``obs["lnwavegrid"]``).  If given, the ``lngrid_photometry``
+            parameter is ``True``, and there is no wavelength calibration, the
+            photometry is computed by flux conserving resampling onto this
+            grid.  See :py:class:`prospect.utils.photometry.LnGridProjector`.
+
         :param **params:
             Optional keywords giving parameter values that will be used to
             generate the predicted spectrum.
@@ -195,16 +251,28 @@ class SSPBasis(object):
             outwave = wa
 
         # Observed frame photometry, as absolute maggies
-        if filters is not None:
-            mags = getSED(wa, lightspeed/wa**2 * sa * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+        if (filters is not None) and self.use_lngrid_photometry(lnwavegrid, b):
+            flam = lightspeed/wave**2 * spectrum * to_cgs
+            phot = np.atleast_1d(project_filters_lngrid(wave, flam, filters,
+                                                        lnwavegrid, a=a + b))
+        elif filters is not None:
+            phot = np.atleast_1d(project_filters(wa, lightspeed/wa**2 * sa * to_cgs,
+                                                 filters))
         else:
             phot = 0.0
 
         # Spectral smoothing.
         do_smooth = (('sigma_smooth' in self.params) and
                      ('sigma_smooth' in self.reserved_params))
-        if do_smooth:
+        if do_smooth and self.use_fused_smoothing(b):
+            # Redshift, smooth, and resample in one step.
+            smspec = self.smooth_redshifted(wave, spectrum, self.params['sigma_smooth'],
+                                            a, outwave=outwave, **self.params)
+        elif do_smooth and (np.ndim(b) == 0):
+            # Smooth in the restframe.
+            smspec = self.smoothspec(wave, sa, self.params['sigma_smooth'],
+                                     outwave=outwave, a=a + b, **self.params)
+        elif do_smooth:
             # We do it ourselves.
             smspec = self.smoothspec(wa, sa, self.params['sigma_smooth'],
                                      outwave=outwave, **self.params)
@@ -222,7 +290,7 @@ class SSPBasis(object):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = cosmo.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
         if peraa:
             # spectrum will be in erg/s/cm^2/AA
@@ -242,6 +310,215 @@ class SSPBasis(object):
 
         return smspec * mass, phot * mass, mfrac
 
+    def get_spectrum_batch(self, param_list, outwave=None, filters=None,
+                           peraa=False, lnwavegrid=None, **extras):
+        """Get spectra and SEDs for a sequence of parameter dictionaries.  The
+        restframe galaxy spectra are computed with
+        ``get_galaxy_spectrum_batch`` if the basis provides it (e.g.
+        :py:class:`SFHWeightBasis` subclasses), and otherwise one parameter
+        set at a time.  Redshifting, distance dimming, unit conversion, mass
+        normalization, and filter projections are done for all parameter sets
+        at once.  Filter projections are done once for each unique observed
+        frame wavelength grid (i.e. once in total for fixed redshift).
+
+        :param param_list:
+            A sequence of length ``N`` of parameter dictionaries, each of
+            which would be a valid set of keywords for :py:meth:`get_spectrum`.
+
+        :param outwave: (default: None)
+            Desired *vacuum* wavelengths.  Defaults to the values in
+            `sps.wavelength`, which is only allowed if every parameter set has
+            the same redshift.
+
+        :param filters: (default: None)
+            A list of filter objects for which you'd like photometry to be
+            calculated.
+
+        :param peraa: (default: False)
+            If `True`, return the spectra in erg/s/cm^2/AA instead of AB
+            maggies.
+
+        :param lnwavegrid: (optional)
+            An observed frame wavelength grid with constant spacing in
+            ln(wavelength) that covers all the filters.  If given, the
+            ``lngrid_photometry`` parameter is ``True``, and there is no
+            wavelength calibration, the photometry for all parameter sets is
+            computed at once on this grid, whatever their redshifts.
+
+        :param extras:
+            Extra keywords that are added to every parameter dictionary.
+
+        :returns spec:
+            Observed frame spectra in AB maggies, unless `peraa=True` in which
+            case the units are erg/s/cm^2/AA.  ndarray of shape ``(N, nwave)``
+
+        :returns phot:
+            Observed frame photometry in AB maggies, ndarray of shape ``(N,
+            nfilters)``, or zeros of shape ``(N,)`` if `filters` is None.
+
+        :returns mass_frac:
+            The ratio of the surviving stellar mass to the total mass formed,
+            ndarray of shape ``(N,)``.
+        """
+        nbatch = len(param_list)
+        plist = []
+        for params in param_list:
+            pars = dict(extras)
+            pars.update(params)
+            plist.append(pars)
+        # Restframe spectra in Lsun/Hz per solar mass formed
+        if hasattr(self, 'get_galaxy_spectrum_batch'):
+            row_params = []
+            for pars in plist:
+                self.update(**pars)
+                row_params.append(dict(self.params))
+            wave, spectra, mfrac = self.get_galaxy_spectrum_batch(plist)
+        else:
+            spectra, mfrac, row_params = [], np.zeros(nbatch), []
+            for i, pars in enumerate(plist):
+                wave, spec, mfrac[i] = self.get_galaxy_spectrum(**pars)
+                spectra.append(spec)
+                row_params.append(dict(self.params))
+            spectra = np.array(spectra)
+
+        # Redshifting + Wavelength solution
+        zred = np.array([np.squeeze(p.get('zred', 0.0)) for p in row_params],
+                        dtype=float)
+        a = 1 + zred
+        b = 0.0
+        if 'wavecal_coeffs' in self.params:
+            x = wave - wave.min()
+            x = 2.0 * (x / x.max()) - 1.0
+            c = np.array([np.insert(p['wavecal_coeffs'], 0, 0) for p in row_params])
+            # assume coeeficients give shifts in km/s
+            b = np.dot(c, chebvander(x, c.shape[-1] - 1).T) / (lightspeed*1e-13)
+        wa = wave[None, :] * (a[:, None] + b)
+        sa = spectra * a[:, None]  # Observed Frame
+
+        # Rows sharing an observed frame wavelength grid
+        if np.ndim(b) == 0:
+            _, first, grid_ind = np.unique(a, return_index=True,
+                                           return_inverse=True)
+        else:
+            first, grid_ind = np.arange(nbatch), np.arange(nbatch)
+        if outwave is None:
+            assert len(first) == 1, "`outwave` must be given for varying redshift"
+            outwave = wa[0]
+
+        # Observed frame photometry, as absolute maggies
+        if (filters is not None) and self.use_lngrid_photometry(lnwavegrid, b):
+            flam = lightspeed/wave**2 * spectra * to_cgs
+            phot = project_filters_lngrid(wave, flam, filters, lnwavegrid, a=a)
+        elif filters is not None:
+            phot = np.zeros([nbatch, len(filters)])
+            for g, row in enumerate(first):
+                sel = grid_ind == g
+                w = wa[row]
+                phot[sel] = project_filters(w, lightspeed/w**2 * sa[sel] * to_cgs,
+                                            filters)
+        else:
+            phot = np.zeros(nbatch)
+
+        # Spectral smoothing, or interpolation onto the output grid.  Spectra
+        # sharing an observed frame grid are smoothed together.
+        smspec = np.zeros([nbatch, len(outwave)])
+        do_smooth = (('sigma_smooth' in self.params) and
+                     ('sigma_smooth' in self.reserved_params))
+        if do_smooth:
+            sigma = np.array([np.squeeze(p['sigma_smooth']) for p in row_params])
+            fused = self.use_fused_smoothing(b)
+            for g, row in enumerate(first):
+                sel = grid_ind == g
+                if fused:
+                    smspec[sel] = self.smooth_redshifted(wave, spectra[sel], sigma[sel],
+                                                         a[row], outwave=outwave,
+                                                         **row_params[row])
+                elif np.ndim(b) == 0:
+                    smspec[sel] = self.smoothspec(wave, sa[sel], sigma[sel],
+                                                  outwave=outwave, a=a[row],
+                                                  **row_params[row])
+                else:
+                    smspec[sel] = self.smoothspec(wa[row], sa[sel], sigma[sel],
+                                                  outwave=outwave, **row_params[row])
+        else:
+            for i in range(nbatch):
+                smspec[i] = np.interp(outwave, wa[i], sa[i], left=0, right=0)
+
+        # Distance dimming and unit conversion
+        lumdist = np.array([np.squeeze(p.get('lumdist', 1e-5)) for p in row_params],
+                           dtype=float)
+        use_cosmo = (zred != 0) & np.array(['lumdist' not in p for p in row_params])
+        if np.any(use_cosmo):
+            lumdist[use_cosmo] = luminosity_distance(zred[use_cosmo])
+        dfactor = (lumdist * 1e5)**2
+        if peraa:
+            # spectrum will be in erg/s/cm^2/AA
+            smspec *= to_cgs / dfactor[:, None] * lightspeed / outwave**2
+        else:
+            # Spectrum will be in maggies
+            smspec *= to_cgs / dfactor[:, None] / (3631*jansky_cgs)
+
+        # Mass normalization
+        mass = np.array([np.sum(p.get('mass', 1.0)) for p in row_params])
+        mstar = np.array([np.all(p.get('mass_units', 'mformed') == 'mstar')
+                          for p in row_params])
+        mass[mstar] /= mfrac[mstar]
+
+        # Convert from absolute maggies to apparent maggies and normalize
+        norm = mass / dfactor
+        if phot.ndim > 1:
+            norm = norm[:, None]
+
+        return smspec * mass[:, None], phot * norm, mfrac
+
+    def ssp_key(self):
+        """A hashable key describing the current values of all the FSPS
+        parameters that have been passed to the ``ssp`` object and that affect
+        the SSP spectra.  Parameters set directly on ``self.ssp.params``
+        (rather than through :py:meth:`update`) are not tracked.
+        """
+        fsps_params = self.ssp.params.all_params
+        ignore = self.reserved_params + self.sfh_params
+        if not np.any(self.params.get('add_igm_absorption', False)):
+            # redshift only affects the FSPS spectra via IGM absorption
+            ignore = ignore + ['zred']
+        key = [(k, hashable(v)) for k, v in self.params.items()
+               if (k in fsps_params) and (k not in ignore)]
+        return tuple(sorted(key, key=lambda kv: kv[0])) + (self.flux_interp,)
+
+    def get_ssp_spectra(self):
+        """Get the SSP spectra and surviving stellar mass fractions for the
+        current FSPS parameters, adding an extra mass and spectrum for t=0
+        using the first SSP spectrum.  These are cached (with least-recently
+        used eviction) using :py:meth:`ssp_key`, so that changes to parameters
+        that do not affect the SSPs (e.g. ``tage``, ``mass``, ``zred``) do not
+        require the SSPs to be recomputed or copied.
+
+        :returns wave:
+            Wavelength in angstroms.
+
+        :returns ssp_spectra:
+            The SSP spectra in Lsun/Hz/solar mass formed (or the natural log
+            thereof if ``flux_interp`` is ``"logarithmic"``), ndarray of shape
+            ``(nage+1, nwave)``.  This should not be modified in place.
+
+        :returns ssp_stellar_masses:
+            The surviving mass fraction of each SSP, ndarray of shape
+            ``(nage+1,)``.
+        """
+        key = self.ssp_key()
+        try:
+            return self._ssp_cache[key]
+        except(KeyError):
+            pass
+        wave, ssp_spectra = self.ssp.get_spectrum(tage=0, peraa=False)
+        ssp_spectra = np.vstack([ssp_spectra[0, :], ssp_spectra])
+        ssp_masses = np.insert(self.ssp.stellar_mass, 0, 1.0)
+        if self.flux_interp == 'logarithmic':
+            ssp_spectra = np.log(ssp_spectra)
+        self._ssp_cache[key] = wave, ssp_spectra, ssp_masses
+        return wave, ssp_spectra, ssp_masses
+
     @property
     def all_ssp_weights(self):
         """Weights for a single age population.  This is a slow way to do this!
@@ -261,9 +538,207 @@ class SSPBasis(object):
         ww[ind] = (tb - sspages[ind-1]) / dt
         return ww
 
-    def smoothspec(self, wave, spec, sigma, outwave=None, **kwargs):
-        outspec = smoothspec(wave, spec, sigma, outwave=outwave, **kwargs)
-        return outspec
+    def smoothspec(self, wave, spec, sigma, outwave=None, a=1.0, **kwargs):
+        """Smooth the spectrum.  For FFT smoothing of type ``"vel"``, ``"R"``
+        or ``"lambda"`` this uses a cached :py:class:`Smoother` (see
+        :py:meth:`get_smoother`), otherwise :py:func:`smoothspec`.
+
+        :param wave:
+            The restframe wavelengths of the spectrum.  The spectrum is
+            observed at ``wave * a``.
+
+        :param spec:
+            The spectrum, ndarray of shape ``(nwave,)``, or of shape ``(N,
+            nwave)`` for N spectra on the same wavelength grid.
+
+        :param sigma:
+            The smoothing parameter, scalar or (for 2-d ``spec``) ndarray of
+            shape ``(N,)``.
+
+        :param a: (optional, default: 1.0)
+            The redshift factor.  The result is the same as for
+            ``smoothspec(wave * a, spec, sigma, outwave=outwave)``, but the
+            cached smoother is in the restframe so it can be reused for
+            different redshifts.
+        """
+        smoothtype = str(kwargs.get('smoothtype', 'vel'))
+        use_smoother = (np.all(kwargs.get('fftsmooth', True)) and
+                        (smoothtype in ['vel', 'R', 'lambda']))
+        if outwave is None:
+            outwave = wave * a
+        if not use_smoother:
+            if np.ndim(spec) == 1:
+                return smoothspec(wave * a, spec, sigma, outwave=outwave, **kwargs)
+            sigma = np.zeros(len(spec)) + np.squeeze(sigma)
+            return np.array([smoothspec(wave * a, s, sig, outwave=outwave, **kwargs)
+                             for s, sig in zip(spec, sigma)])
+
+        # Smooth in the restframe, where wavelength dispersions are smaller
+        # by the factor ``a``.
+        inres = kwargs.get('inres', 0.0)
+        restout = outwave / a
+        if smoothtype == 'lambda':
+            sigma, inres = np.asarray(sigma) / a, inres / a
+        if np.ndim(spec) == 1:
+            smoother = self.get_smoother(wave, restout, sigma, **kwargs)
+            return smoother(spec, sigma, inres=inres, outwave=restout)
+
+        # Smooth all the spectra that share a padding at once, so that the
+        # result for each spectrum is the same as smoothing it alone.
+        sigma = np.zeros(len(spec)) + np.squeeze(sigma)
+        padres = self.smoother_padding(sigma, **kwargs)
+        smspec = np.zeros([len(spec), len(outwave)])
+        for pad in np.unique(padres):
+            sel = padres == pad
+            smoother = self.get_smoother(wave, restout, sigma[sel], **kwargs)
+            smspec[sel] = smoother(spec[sel], sigma[sel], inres=inres,
+                                   outwave=restout)
+        return smspec
+
+    def smoother_padding(self, resolution, smoothtype='vel', **kwargs):
+        """The smoothing parameter(s) used to pad the input range of the
+        smoothers, from the ``max_sigma_smooth`` and ``round_padding``
+        keywords.  See :py:func:`smoother_padding`.  For ``"lambda"``
+        smoothing in the restframe ``max_sigma_smooth`` is not divided by the
+        redshift factor, so the padding is a little larger than needed but
+        does not depend on the redshift.
+        """
+        maxres = kwargs.get('max_sigma_smooth', None)
+        if maxres is not None:
+            maxres = np.squeeze(maxres)
+        return smoother_padding(resolution, str(np.squeeze(smoothtype)),
+                                np.all(kwargs.get('round_padding', False)),
+                                max_resolution=maxres)
+
+    def get_smoother(self, wave, outwave, resolution, smoothtype='vel',
+                     min_wave_smooth=0, max_wave_smooth=np.inf, **kwargs):
+        """Get a restframe :py:class:`Smoother` for the given restframe
+        wavelength grids, reusing the cached smoother if possible.
+
+        The input wavelength range is padded for the broadest kernel, which
+        is given by the ``max_sigma_smooth`` keyword (usually a fixed model
+        parameter) if present, or else by the broadest kernel in
+        ``resolution``.  If the ``round_padding`` keyword is True the kernel
+        width used for the padding is rounded to a power of two (see
+        :py:func:`smoother_padding`).  Set ``max_sigma_smooth`` when
+        ``sigma_smooth`` is free, so that the same smoother (and its cached
+        tapers) is used for every value.
+
+        The range of the smoother also extends ``smoother_zmargin`` (in
+        ln(wavelength)) beyond the range of ``outwave``, so that it is reused
+        for small changes of the redshift.  A new smoother is only built if
+        ``outwave`` is outside this range, or the input grid or smoothing
+        options change.  Because of the extra range the regular grid used for
+        the FFT differs slightly from that of :py:func:`smoothspec`.
+        """
+        smoothtype = str(smoothtype)
+        padres = self.smoother_padding(resolution, smoothtype=smoothtype, **kwargs)
+        padres = float(np.min(padres) if smoothtype == 'R' else np.max(padres))
+        fftpad = kwargs.get('fftpad', None)
+        fftpad = None if fftpad is None else str(np.squeeze(fftpad))
+        nsigma_pad = float(np.squeeze(kwargs.get('nsigma_pad', 20.0)))
+        nsigma_fft = float(np.squeeze(kwargs.get('nsigma_fft', 5.0)))
+        key = (smoothtype, padres, float(np.squeeze(min_wave_smooth)),
+               float(np.squeeze(max_wave_smooth)), fftpad, nsigma_pad, nsigma_fft)
+        lo, hi = outwave.min(), outwave.max()
+        cached = self._smoothers.get(key, None)
+        if cached is not None:
+            rwave, rlo, rhi, smoother = cached
+            same = (rwave is wave) or ((len(rwave) == len(wave)) and
+                                       np.array_equal(rwave, wave))
+            if same and (lo >= rlo) and (hi <= rhi):
+                return smoother
+        margin = np.exp(self.smoother_zmargin)
+        rlo, rhi = lo / margin, hi * margin
+        smoother = Smoother(wave, outwave=np.array([rlo, rhi]), smoothtype=smoothtype,
+                            resolution=padres,
+                            min_wave_smooth=min_wave_smooth,
+                            max_wave_smooth=max_wave_smooth,
+                            nsigma_pad=nsigma_pad, fftpad=fftpad,
+                            nsigma_fft=nsigma_fft)
+        self._smoothers[key] = wave.copy(), rlo, rhi, smoother
+        return smoother
+
+    def use_lngrid_photometry(self, lnwavegrid=None, b=0.0):
+        """Whether to compute the photometry on the ln-lambda grid
+        ``lnwavegrid``, using a
+        :py:class:`prospect.utils.photometry.LnGridProjector`.  This is done
+        if the grid is given, the ``lngrid_photometry`` parameter is ``True``,
+        and there is no wavelength calibration (i.e. ``b`` is scalar).
+        """
+        return ((lnwavegrid is not None) and
+                np.all(self.params.get('lngrid_photometry', False)) and
+                (np.ndim(b) == 0))
+
+    def use_fused_smoothing(self, b=0.0):
+        """Whether to redshift and smooth the spectrum with a
+        :py:class:`RedshiftSmoother`.  This is done if the ``fused_smoothing``
+        parameter is ``True``, the smoothing is FFT smoothing of type ``"vel"``
+        or ``"R"``, and there is no wavelength calibration (i.e. ``b`` is
+        scalar).
+        """
+        smoothtype = str(np.squeeze(self.params.get('smoothtype', 'vel')))
+        return (np.all(self.params.get('fused_smoothing', False)) and
+                np.all(self.params.get('fftsmooth', True)) and
+                (smoothtype in ['vel', 'R']) and (np.ndim(b) == 0))
+
+    def smooth_redshifted(self, wave, spec, sigma, a, outwave=None, **kwargs):
+        """Redshift restframe spectra by the factor ``a``, smooth them, and
+        resample them onto ``outwave``, using a cached
+        :py:class:`RedshiftSmoother`.  This is the same as
+        ``self.smoothspec(wave * a, spec * a, sigma, outwave, **kwargs)`` up to
+        the choice of the intermediate ln(wavelength) grid.
+
+        :param spec:
+            The restframe spectrum, ndarray of shape ``(nwave,)``, or of shape
+            ``(N, nwave)`` for N spectra.
+
+        :param sigma:
+            The smoothing parameter, scalar or (for 2-d ``spec``) ndarray of
+            shape ``(N,)``.
+        """
+        if outwave is None:
+            outwave = wave * a
+        inres = kwargs.get('inres', 0.0)
+        if np.ndim(spec) == 1:
+            smoother = self.get_redshift_smoother(wave, outwave, sigma, **kwargs)
+            return smoother(spec, sigma, a=a, inres=inres)
+
+        # Spectra that share a padding are done at once.
+        sigma = np.zeros(len(spec)) + np.squeeze(sigma)
+        padres = self.smoother_padding(sigma, **kwargs)
+        smspec = np.zeros([len(spec), len(outwave)])
+        for pad in np.unique(padres):
+            sel = padres == pad
+            smoother = self.get_redshift_smoother(wave, outwave, sigma[sel], **kwargs)
+            smspec[sel] = smoother(spec[sel], sigma[sel], a=a, inres=inres)
+        return smspec
+
+    def get_redshift_smoother(self, wave, outwave, resolution, smoothtype='vel',
+                              **kwargs):
+        """Get a :py:class:`RedshiftSmoother` for the given wavelength grids,
+        from the cache if possible.  As for :py:meth:`get_smoother` the
+        padding is set by ``max_sigma_smooth`` or the broadest kernel, rounded
+        to a power of two only if the ``round_padding`` keyword is True.
+        """
+        smoothtype = str(np.squeeze(smoothtype))
+        padres = self.smoother_padding(resolution, smoothtype=smoothtype, **kwargs)
+        padres = float(np.min(padres) if smoothtype == 'R' else np.max(padres))
+        fftpad = str(np.squeeze(kwargs.get('fftpad', 'reflect')))
+        nsigma_pad = float(np.squeeze(kwargs.get('nsigma_pad', 5.0)))
+        nsigma_fft = float(np.squeeze(kwargs.get('nsigma_fft', 5.0)))
+        key = ('redshift', hashable(wave), hashable(outwave), smoothtype, padres,
+               fftpad, nsigma_pad, nsigma_fft)
+        try:
+            return self._smoothers[key]
+        except(KeyError):
+            pass
+        self._smoothers[key] = RedshiftSmoother(wave, outwave, smoothtype=smoothtype,
+                                                resolution=padres,
+                                                nsigma_pad=nsigma_pad,
+                                                fftpad=fftpad,
+                                                nsigma_fft=nsigma_fft)
+        return self._smoothers[key]
 
     @property
     def logage(self):
@@ -359,9 +834,331 @@ class FastStepBasis(SSPBasis):
         return (fsps_time / 1e9)[::-1], sfrout[::-1], maxage / 1e9
 
 
+class CachedStepBasis(FastStepBasis):
+    """Subclass of :py:class:`FastStepBasis` that caches the spectrum and
+    surviving mass fraction of each age bin, for one solar mass formed at
+    constant SFR within the bin.  Because the FSPS integration of a tabular SFH
+    is linear in the SFR, the galaxy spectrum is then just the product of the
+    bin masses with these basis spectra.  FSPS is only called (``nbin`` times)
+    when ``agebins`` or the FSPS parameters that affect the SSPs change.  The
+    key parameters are the same as for :py:class:`FastStepBasis`.
+    """
+
+    def get_galaxy_spectrum(self, **params):
+        """Update parameters, then sum the cached bin spectra weighted by the
+        mass formed in each bin.
+
+        :returns wave:
+            Wavelength in angstroms.
+
+        :returns spectrum:
+            Spectrum in units of Lsun/Hz/solar masses formed.
+
+        :returns mass_fraction:
+            Fraction of the formed stellar mass that still exists.
+        """
+        self.update(**params)
+        mass = np.atleast_1d(self.params['mass'])
+        mtot = mass.sum()
+        wave, bin_spectra, bin_mfrac = self.get_bin_spectra()
+        return wave, np.dot(mass, bin_spectra) / mtot, np.dot(mass, bin_mfrac) / mtot
+
+    def get_bin_spectra(self):
+        """Get the spectrum and surviving mass fraction of each bin in the
+        current ``agebins``, per solar mass formed, from the cache or by
+        constructing a tabular SFH for each bin in turn.
+
+        :returns wave:
+            Wavelength in angstroms.
+
+        :returns bin_spectra:
+            ndarray of shape ``(nbin, nwave)`` in units of Lsun/Hz/solar mass
+            formed.  This should not be modified in place.
+
+        :returns bin_mfrac:
+            ndarray of shape ``(nbin,)``
+        """
+        agebins = np.atleast_2d(self.params['agebins'])
+        key = (('agebins', hashable(agebins)),) + self.ssp_key()
+        try:
+            return self._ssp_cache[key]
+        except(KeyError):
+            pass
+        nbin = len(agebins)
+        bin_spectra, bin_mfrac = [], np.zeros(nbin)
+        self.ssp.params["sfh"] = 3
+        for i in range(nbin):
+            mformed = np.zeros(nbin)
+            mformed[i] = 1.0
+            time, sfr, tmax = self.convert_sfh(agebins, mformed)
+            self.ssp.set_tabular_sfh(time, sfr)
+            wave, spec = self.ssp.get_spectrum(tage=tmax, peraa=False)
+            bin_spectra.append(spec)
+            bin_mfrac[i] = self.ssp.stellar_mass
+        self._ssp_cache[key] = wave, np.array(bin_spectra), bin_mfrac
+        return self._ssp_cache[key]
+
+
+class SSPGridBasis(SSPBasis):
+    """Subclass of :py:class:`SSPBasis` that computes the SSP spectra for a
+    grid of stellar metallicities once, and then linearly interpolates this
+    grid in ``logzsol``, so that changes in metallicity do not require FSPS to
+    regenerate the SSPs.  The resulting SSP spectra are combined using
+    ``all_ssp_weights``, so the SFH can be changed by mixing in a class that
+    overrides the weights, e.g.
+
+    .. code-block:: python
+
+        class StepGridBasis(StepSFHBasis, SSPGridBasis):
+            pass
+
+    The grid is built on the first call to :py:meth:`get_galaxy_spectrum`,
+    for the values of the other FSPS parameters that affect the SSPs (e.g.
+    dust, IMF) at that time, so these should be fixed.  If they later differ
+    from the values used for the grid, the grid is not rebuilt; instead a
+    warning is issued and the SSPs for those parameters and the requested
+    ``logzsol`` are computed directly by FSPS, as in :py:class:`SSPBasis`.
+    The metallicity grid requires ``zcontinuous=1``, and the memory footprint
+    of the grid is ``nZ * nage * nwave`` doubles.
+    """
+
+    def __init__(self, logzsol_grid=None, grid_file=None,
+                 reserved_params=['tage', 'sigma_smooth'], **kwargs):
+        """
+        :param logzsol_grid: (optional)
+            The values of ``logzsol`` at which to compute the SSPs.  Values of
+            ``logzsol`` outside this grid are clipped to the grid edges.
+            Defaults to steps of 0.1 from -2 to 0.5.
+
+        :param grid_file: (optional)
+            If given, the name of a file in which to store the SSP grid for
+            subsequent runs.  If this file exists and matches the current
+            parameters it will be read instead of building the grid.  If the
+            name ends in ``.h5`` an HDF5 file is written (requires h5py),
+            otherwise a numpy ``.npz`` file.
+
+        Other keywords are as for :py:class:`SSPBasis`.
+        """
+        if logzsol_grid is None:
+            logzsol_grid = np.linspace(-2.0, 0.5, 26)
+        self.logzsol_grid = np.sort(np.atleast_1d(logzsol_grid))
+        self.grid_file = grid_file
+        self._grid_key = None
+        self._warned_off_grid = False
+        reserved = list(reserved_params) + ['logzsol']
+        super(SSPGridBasis, self).__init__(reserved_params=reserved, **kwargs)
+
+    def grid_key(self):
+        """A hashable key describing the current values of the FSPS
+        parameters, other than ``logzsol``, that affect the SSP spectra.  The
+        grid is valid only for the key with which it was built.
+        """
+        return super(SSPGridBasis, self).ssp_key()
+
+    def ssp_key(self):
+        """As for :py:meth:`SSPBasis.ssp_key`, but including ``logzsol``, for
+        SSP spectra computed directly by FSPS when the parameters differ from
+        those of the grid.
+        """
+        logzsol = self.params.get('logzsol', 0.0)
+        return self.grid_key() + (('logzsol', hashable(logzsol)),)
+
+    def build_grid(self):
+        """Build (or read from ``grid_file``) the SSP spectra and stellar
+        masses on the grid of ``logzsol``, for the current values of the other
+        FSPS parameters.  These are stored as the ``ssp_grid`` and
+        ``ssp_mass_grid`` attributes with shapes ``(nZ, nage+1, nwave)`` and
+        ``(nZ, nage+1)``
+        """
+        key = self.grid_key()
+        tag = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        if (self.grid_file is not None) and os.path.exists(self.grid_file):
+            grid = self.read_grid(self.grid_file)
+            valid = ((grid.get('tag', '') == tag) and
+                     (grid['ssp_grid'].shape[1] == len(self.logage) + 1) and
+                     np.array_equal(grid['logzsol_grid'], self.logzsol_grid))
+            if valid:
+                self._grid_wave = grid['wavelengths']
+                self.ssp_grid = grid['ssp_grid']
+                self.ssp_mass_grid = grid['ssp_mass_grid']
+                self._grid_key = key
+                return
+
+        spectra, masses = [], []
+        logzsol = deepcopy(self.ssp.params['logzsol'])
+        for z in self.logzsol_grid:
+            self.push_params({'logzsol': z})
+            wave, ssp_spectra = self.ssp.get_spectrum(tage=0, peraa=False)
+            spectra.append(np.vstack([ssp_spectra[0, :], ssp_spectra]))
+            masses.append(np.insert(self.ssp.stellar_mass, 0, 1.0))
+        self.push_params({'logzsol': logzsol})
+        self._grid_wave = wave
+        self.ssp_grid = np.array(spectra)
+        self.ssp_mass_grid = np.array(masses)
+        if self.flux_interp == 'logarithmic':
+            self.ssp_grid = np.log(self.ssp_grid)
+        self._grid_key = key
+
+        if self.grid_file is not None:
+            self.write_grid(self.grid_file, tag=tag)
+
+    def write_grid(self, filename, tag=''):
+        """Write the SSP grid to ``filename``.
+        """
+        grid = {'wavelengths': self._grid_wave, 'logzsol_grid': self.logzsol_grid,
+                'ssp_grid': self.ssp_grid, 'ssp_mass_grid': self.ssp_mass_grid}
+        if filename.endswith('.h5'):
+            import h5py
+            with h5py.File(filename, "w") as f:
+                for k, v in grid.items():
+                    f.create_dataset(k, data=v)
+                f.attrs['tag'] = tag
+        else:
+            with open(filename, "wb") as f:
+                np.savez(f, tag=tag, **grid)
+
+    def read_grid(self, filename):
+        """Read an SSP grid written by :py:meth:`write_grid`.
+
+        :returns grid:
+            A dictionary of the grid arrays, as well as the ``"tag"`` that
+            identifies the FSPS parameters used to build the grid.
+        """
+        if filename.endswith('.h5'):
+            import h5py
+            with h5py.File(filename, "r") as f:
+                grid = {k: f[k][...] for k in f.keys()}
+                grid['tag'] = f.attrs.get('tag', '')
+        else:
+            with np.load(filename) as f:
+                grid = {k: f[k] for k in f.files}
+        if hasattr(grid['tag'], 'decode'):
+            grid['tag'] = grid['tag'].decode('utf-8')
+        grid['tag'] = str(grid['tag'])
+        return grid
+
+    def logzsol_weights(self, logzsol):
+        """Get the indices and weights of the bracketing metallicity grid
+        points for linear interpolation in ``logzsol``.
+
+        :param logzsol:
+            Scalar or ndarray of shape ``(N,)``.
+
+        :returns inds:
+            ndarray of shape ``(2, N)`` giving the lower and upper grid
+            indices.
+
+        :returns weights:
+            ndarray of shape ``(2, N)`` giving the corresponding weights.
+        """
+        zgrid = self.logzsol_grid
+        z = np.clip(np.atleast_1d(logzsol), zgrid[0], zgrid[-1])
+        if len(zgrid) == 1:
+            zero = np.zeros(len(z), dtype=int)
+            return np.array([zero, zero]), np.array([np.ones(len(z)), np.zeros(len(z))])
+        hi = np.clip(np.searchsorted(zgrid, z, side='right'), 1, len(zgrid) - 1)
+        lo = hi - 1
+        whi = (z - zgrid[lo]) / (zgrid[hi] - zgrid[lo])
+        return np.array([lo, hi]), np.array([1 - whi, whi])
+
+    def get_galaxy_spectrum(self, **params):
+        """Update parameters, interpolate the SSP grid in metallicity,
+        multiply SSP weights by SSP spectra and stellar masses, and sum.
+
+        :returns wave:
+            Wavelength in angstroms.
+
+        :returns spectrum:
+            Spectrum in units of Lsun/Hz/solar masses formed.
+
+        :returns mass_fraction:
+            Fraction of the formed stellar mass that still exists.
+        """
+        self.update(**params)
+        if self._grid_key is None:
+            self.build_grid()
+        elif self.grid_key() != self._grid_key:
+            return self.get_offgrid_spectrum()
+
+        inds, zwght = self.logzsol_weights(self.params.get('logzsol', 0.0))
+        inds, zwght = inds[:, 0], zwght[:, 0]
+        self.ssp_stellar_masses = np.dot(zwght, self.ssp_mass_grid[inds])
+
+        # Get weighted sum of spectra, interpolating in metallicity after the
+        # sum over ages since that is cheaper.
+        weights = self.all_ssp_weights
+        spectrum = (zwght[0] * np.dot(weights, self.ssp_grid[inds[0]]) +
+                    zwght[1] * np.dot(weights, self.ssp_grid[inds[1]]))
+        spectrum /= weights.sum()
+        if self.flux_interp == 'logarithmic':
+            spectrum = np.exp(spectrum)
+
+        # Get the weighted stellar_mass/mformed ratio
+        mass_frac = (self.ssp_stellar_masses * weights).sum() / weights.sum()
+        return self._grid_wave.copy(), spectrum, mass_frac
+
+    def get_offgrid_spectrum(self):
+        """Compute the galaxy spectrum from SSPs generated directly by FSPS at
+        the current ``logzsol``, for parameters that differ from those used
+        to build the grid.  Returns the same quantities as
+        :py:meth:`get_galaxy_spectrum`.
+        """
+        if not self._warned_off_grid:
+            warnings.warn("FSPS parameters differ from those used to build the "
+                          "SSP metallicity grid; computing SSPs directly, "
+                          "which is slow.")
+            self._warned_off_grid = True
+        self.push_params({'logzsol': self.params.get('logzsol', 0.0)})
+        return super(SSPGridBasis, self).get_galaxy_spectrum()
+
+
 class MultiSSPBasis(SSPBasis):
     """An array of basis spectra with different ages, metallicities, and possibly dust
     attenuations.
     """
     def get_galaxy_spectrum(self):
         raise(NotImplementedError)
+
+
+def new_push_counts():
+    """Counters for :py:meth:`SSPBasis.push_params`.
+    """
+    return {'pushed': 0, 'skipped': 0, 'ssp_regenerations_avoided': 0}
+
+
+def smoother_padding(resolution, smoothtype='vel', round_padding=False,
+                     max_resolution=None):
+    """The smoothing parameter(s) used to pad the input wavelength range of a
+    :py:class:`Smoother`.  By default this is the resolution itself.  If
+    ``max_resolution`` is given (the value with the broadest kernel, i.e. the
+    smallest value for ``"R"``) it is used instead, unless ``resolution`` is
+    broader, so that all resolutions share a cached smoother.  If
+    ``round_padding`` is True, positive values are rounded to a power of two
+    (up for ``"vel"`` and ``"lambda"``, down for ``"R"``, so the padding is
+    never smaller), so that nearby resolutions share a cached smoother at the
+    cost of small changes to the smoothed spectrum near the ends of the
+    wavelength range.
+    """
+    resolution = np.asarray(resolution, dtype=np.float64)
+    if max_resolution is not None:
+        broadest = np.minimum if smoothtype == 'R' else np.maximum
+        resolution = broadest(resolution, np.float64(max_resolution))
+    if not round_padding:
+        return resolution
+    positive = resolution > 0
+    res = np.where(positive, resolution, 1.0)
+    if smoothtype == 'R':
+        rounded = 2**np.floor(np.log2(res))
+    else:
+        rounded = 2**np.ceil(np.log2(res))
+    return np.where(positive, rounded, resolution)
+
+
+def values_equal(a, b):
+    """Test whether two parameter values (scalars, strings, or arrays) are
+    equal, returning ``False`` if they cannot be compared.
+    """
+    try:
+        return bool(np.array_equal(a, b))
+    except(ValueError, TypeError):
+        return False
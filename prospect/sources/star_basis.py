@@ -4,6 +4,7 @@ from numpy.polynomial.chebyshev import chebval
 from scipy.spatial import Delaunay
 
 from ..utils.smoothing import smoothspec
+from ..utils.photometry import project_filters
 from .constants import lightspeed, lsun, jansky_cgs, to_cgs_at_10pc
 
 try:
@@ -12,7 +13,7 @@ except(ImportError):
     from scipy.spatial import cKDTree as KDTree
 
 try:
-    from sedpy.observate import getSED, vac2air, air2vac
+    from sedpy.observate import vac2air, air2vac
 except(ImportError):
     pass
 
@@ -211,8 +212,8 @@ class StarBasis(object):
 
         # Photometry (observed frame absolute maggies)
         if filters is not None:
-            mags = getSED(wa, sa * lightspeed / wa**2 * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            phot = np.atleast_1d(project_filters(wa, sa * lightspeed / wa**2 * to_cgs,
+                                                 filters))
         else:
             phot = 0.0
 
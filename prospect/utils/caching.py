@@ -0,0 +1,82 @@
+"""Small helpers for caching expensive intermediate products (e.g. SSP
+spectra, filter projection matrices) that are keyed on parameter values.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+__all__ = ["LRUCache", "hashable"]
+
+
+class LRUCache(object):
+    """A dictionary-like cache holding at most ``maxsize`` entries.  When the
+    cache is full the least recently used entry is discarded.  The number of
+    cache hits and misses are kept in the ``hits`` and ``misses`` attributes.
+
+    .. code-block:: python
+
+        cache = LRUCache(maxsize=4)
+        try:
+            value = cache[key]
+        except(KeyError):
+            value = cache[key] = expensive(key)
+
+    :param maxsize: (default: 8)
+        The maximum number of entries to keep.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '{}(maxsize={}, size={})'.format(self.__class__.__name__,
+                                               self.maxsize, len(self))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        try:
+            value = self._data.pop(key)
+        except(KeyError):
+            self.misses += 1
+            raise
+        # Re-insert to mark as most recently used
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > max(self.maxsize, 1):
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except(KeyError):
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+
+def hashable(value):
+    """Convert a parameter value into something that can be used as (part of)
+    a dictionary key.  Callables and strings are returned unchanged, anything
+    else is converted to an array and represented by its dtype, shape, and
+    bytes.
+    """
+    if callable(value) or isinstance(value, str):
+        return value
+    arr = np.asarray(value)
+    if arr.dtype == object:
+        return repr(value)
+    return (arr.dtype.str, arr.shape, arr.tobytes())
@@ -0,0 +1,297 @@
+# Fast filter projections using precomputed projection matrices.
+
+import numpy as np
+
+from .caching import LRUCache, hashable
+
+__all__ = ["FilterProjector", "get_projector", "project_filters",
+           "LnGridProjector", "get_lngrid_projector", "project_filters_lngrid"]
+
+
+class FilterProjector(object):
+    r"""Project spectra onto a list of filters using a precomputed matrix of
+    weights for each wavelength grid.  For a given grid the broadband fluxes in
+    maggies are given by a single matrix product, which reproduces
+    ``10**(-0.4 * sedpy.observate.getSED(wave, flam, filters))``.
+
+    The weight matrix for a filter includes the interpolated transmission, the
+    trapezoidal integration weights of :math:`\int \lambda T(\lambda)
+    f_\lambda d\lambda`, and the AB zeropoint.  Only the span of wavelengths
+    where some filter is nonzero is kept.  Matrices are cached for the most
+    recently used wavelength grids, so for a fixed restframe grid there is one
+    matrix per redshift.
+
+    :param filters:
+        A list of ``sedpy.observate.Filter`` objects.
+
+    :param cache_size: (default: 16)
+        The number of wavelength grids for which to keep the weight matrix.
+    """
+
+    def __init__(self, filters, cache_size=16):
+        self.filters = list(filters)
+        self._matrices = LRUCache(maxsize=cache_size)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def weights(self, wave):
+        """Get the projection matrix for the given wavelength grid, from the
+        cache if possible.
+
+        :param wave:
+            Wavelength vector in angstroms, ndarray of shape ``(nwave,)``.
+            Must be increasing.
+
+        :returns span:
+            A slice giving the range of ``wave`` where some filter is nonzero.
+
+        :returns matrix:
+            ndarray of shape ``(nfilters, nspan)``.
+        """
+        key = hashable(wave)
+        try:
+            return self._matrices[key]
+        except(KeyError):
+            pass
+        self._matrices[key] = self.build_matrix(wave)
+        return self._matrices[key]
+
+    def build_matrix(self, wave):
+        """Build the projection matrix for a wavelength grid.  This follows the
+        ``obj_counts_hires`` algorithm of sedpy.
+
+        :param wave:
+            Wavelength vector in angstroms, ndarray of shape ``(nwave,)``.
+
+        :returns span:
+            A slice giving the range of ``wave`` where some filter is nonzero.
+
+        :returns matrix:
+            ndarray of shape ``(nfilters, nspan)``.  As in sedpy, filters that
+            do not overlap ``wave`` give NaN photometry, so their rows are
+            filled with NaN.
+        """
+        wave = np.asarray(wave, dtype=np.float64)
+        assert wave[1] > wave[0], "``wave`` not in ascending order."
+        full = np.zeros([len(self.filters), len(wave)])
+        missing = np.zeros(len(self.filters), dtype=bool)
+        for i, f in enumerate(self.filters):
+            trans = np.interp(wave, f.wavelength, f.transmission,
+                              left=0., right=0.)
+            positive = np.where(trans > 0.)[0]
+            if len(positive) == 0:
+                missing[i] = True
+                continue
+            ind = slice(max(positive.min() - 1, 0),
+                        min(positive.max() + 2, len(wave)))
+            x = wave[ind]
+            # trapezoidal integration weights
+            dx = np.diff(x) / 2.
+            tw = np.zeros(len(x))
+            tw[:-1] += dx
+            tw[1:] += dx
+            full[i, ind] = x * trans[ind] * tw / f.ab_zero_counts
+
+        nonzero = np.where(np.any(full != 0, axis=0))[0]
+        if len(nonzero) == 0:
+            # keep one element, so that every filter gets NaN
+            span = slice(0, 1)
+        else:
+            span = slice(nonzero.min(), nonzero.max() + 1)
+        matrix = full[:, span].copy()
+        matrix[missing, :] = np.nan
+        return span, matrix
+
+    def maggies(self, wave, flam):
+        """Project spectra onto the filters.
+
+        :param wave:
+            Wavelength vector in angstroms, ndarray of shape ``(nwave,)``
+
+        :param flam:
+            Flux density in erg/s/cm^2/AA, ndarray of shape ``(..., nwave)``
+
+        :returns maggies:
+            The broadband fluxes in maggies, ndarray of shape
+            ``(..., nfilters)``
+        """
+        span, matrix = self.weights(wave)
+        return np.dot(np.asarray(flam)[..., span], matrix.T)
+
+
+class LnGridProjector(object):
+    """Project restframe spectra onto a list of filters at any redshift, using
+    a projection matrix on a fixed observed frame grid that is regular in
+    ln(wavelength), such as the ``"lnwavegrid"`` produced by
+    :py:func:`prospect.utils.obsutils.fix_obs` with ``grid_filters=True``.
+
+    Each grid element is treated as a bin, with edges halfway (in
+    ln(wavelength)) between grid points.  The restframe spectrum is integrated
+    once with a cumulative trapezoidal sum, and the observed frame flux
+    density in each bin is the difference of this integral at the restframe
+    bin edges ``edges / a``, divided by the observed bin width.  This conserves
+    flux, so features narrower than the grid spacing (e.g. emission lines) are
+    not lost.  All the filters are then integrated with a single matrix
+    product.
+
+    :param filters:
+        A list of ``sedpy.observate.Filter`` objects.
+
+    :param lnwavegrid:
+        The observed frame wavelength grid in angstroms, ndarray of shape
+        ``(ngrid,)``, with constant spacing in ln(wavelength).  It must cover
+        all the filters.
+    """
+
+    def __init__(self, filters, lnwavegrid):
+        lnwavegrid = np.asarray(lnwavegrid, dtype=np.float64)
+        self.filters = list(filters)
+        self.wmin = lnwavegrid[0]
+        self.dlnlam = np.log(lnwavegrid[-1] / lnwavegrid[0]) / (len(lnwavegrid) - 1)
+        projector = FilterProjector(filters, cache_size=0)
+        self.span, self.matrix = projector.build_matrix(lnwavegrid)
+        k = np.arange(self.span.start, self.span.stop + 1) - 0.5
+        self.edges = self.wmin * np.exp(k * self.dlnlam)
+        self.dedges = np.diff(self.edges)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def resample(self, wave, flam, a=1.0):
+        """Flux conserving resampling of restframe spectra, redshifted by
+        factor(s) ``a``, onto the bins of the ln-lambda grid where some filter
+        is nonzero.
+
+        :param wave:
+            Restframe wavelength vector of the spectra, ndarray of shape
+            ``(nwave,)``
+
+        :param flam:
+            Restframe spectra, ndarray of shape ``(nwave,)`` or ``(nspec,
+            nwave)``
+
+        :param a: (default: 1.0)
+            The redshift factor(s), scalar or ndarray of shape ``(N,)``.
+
+        :returns g:
+            The mean observed frame flux density in each bin, ndarray of shape
+            ``(nspan,)``, ``(N, nspan)`` or ``(nspec, nspan)``
+        """
+        wave = np.asarray(wave, dtype=np.float64)
+        flam = np.asarray(flam)
+        cumflux = np.zeros(flam.shape)
+        cumflux[..., 1:] = np.cumsum(0.5 * (flam[..., 1:] + flam[..., :-1]) *
+                                     np.diff(wave), axis=-1)
+        x = self.edges / np.reshape(a, np.shape(a) + (1,))
+        if cumflux.ndim == 1:
+            c = np.interp(x, wave, cumflux)
+        else:
+            x = np.broadcast_to(x, (len(cumflux), x.shape[-1]))
+            c = np.array([np.interp(xx, wave, cc) for xx, cc in zip(x, cumflux)])
+        return np.diff(c, axis=-1) / self.dedges
+
+    def maggies(self, wave, flam, a=1.0):
+        r"""Project restframe spectra, redshifted by factor(s) ``a``, onto the
+        filters.
+
+        :param wave:
+            Restframe wavelength vector in angstroms, ndarray of shape
+            ``(nwave,)``
+
+        :param flam:
+            Restframe flux density in erg/s/cm^2/AA, ndarray of shape
+            ``(nwave,)`` or ``(nspec, nwave)``.  The observed frame flux
+            density at :math:`\lambda` is ``flam(lambda / a) / a``.
+
+        :param a: (default: 1.0)
+            The redshift factor(s) ``1 + z``, scalar or ndarray of shape
+            ``(N,)``.  If an array is given for 2-d ``flam``, each spectrum is
+            redshifted by the corresponding element.
+
+        :returns maggies:
+            ndarray of shape ``(nfilters,)``, ``(nspec, nfilters)`` or ``(N,
+            nfilters)``
+        """
+        return np.dot(self.resample(wave, flam, a=a), self.matrix.T)
+
+
+# Projectors for the most recently used filter lists.  The projectors keep
+# references to the filter objects, so their ids are unique while cached.
+_projectors = LRUCache(maxsize=8)
+
+
+def get_projector(filters):
+    """Get the :py:class:`FilterProjector` for a list of filters, creating it
+    if necessary.
+
+    :param filters:
+        A list of ``sedpy.observate.Filter`` objects.
+    """
+    key = tuple(id(f) for f in filters)
+    try:
+        return _projectors[key]
+    except(KeyError):
+        pass
+    _projectors[key] = FilterProjector(filters)
+    return _projectors[key]
+
+
+def get_lngrid_projector(filters, lnwavegrid):
+    """Get the :py:class:`LnGridProjector` for a list of filters and a
+    ln-lambda grid, creating it if necessary.
+    """
+    key = tuple(id(f) for f in filters) + (hashable(lnwavegrid),)
+    try:
+        return _projectors[key]
+    except(KeyError):
+        pass
+    _projectors[key] = LnGridProjector(filters, lnwavegrid)
+    return _projectors[key]
+
+
+def project_filters(wave, flam, filters):
+    """Project spectra onto a list of filters, using cached projection
+    matrices.  Equivalent to ``10**(-0.4 * getSED(wave, flam, filters))``.
+
+    :param wave:
+        Wavelength vector in angstroms, ndarray of shape ``(nwave,)``
+
+    :param flam:
+        Flux density in erg/s/cm^2/AA, ndarray of shape ``(..., nwave)``
+
+    :param filters:
+        A list of ``sedpy.observate.Filter`` objects.
+
+    :returns maggies:
+        ndarray of shape ``(..., nfilters)``
+    """
+    return get_projector(filters).maggies(wave, flam)
+
+
+def project_filters_lngrid(wave, flam, filters, lnwavegrid, a=1.0):
+    """Project restframe spectra redshifted by factor(s) ``a`` onto a list of
+    filters, using the regular ln-lambda grid ``lnwavegrid``.  See
+    :py:class:`LnGridProjector`.
+
+    :param wave:
+        Restframe wavelength vector in angstroms, ndarray of shape ``(nwave,)``
+
+    :param flam:
+        Restframe flux density in erg/s/cm^2/AA, ndarray of shape ``(...,
+        nwave)``
+
+    :param filters:
+        A list of ``sedpy.observate.Filter`` objects.
+
+    :param lnwavegrid:
+        Observed frame wavelength grid in angstroms with constant spacing in
+        ln(wavelength).
+
+    :param a: (default: 1.0)
+        Redshift factor(s) ``1 + z``, scalar or ndarray of shape ``(N,)``
+
+    :returns maggies:
+        ndarray of shape ``(..., nfilters)``
+    """
+    return get_lngrid_projector(filters, lnwavegrid).maggies(wave, flam, a=a)
@@ -1,14 +1,19 @@
 # Spectral smoothing functionality
-# To do:
-# 3) add extra zero-padding for FFT algorithms so they don't go funky at the
-#    edges?
 
 import numpy as np
 from numpy.fft import fft, ifft, fftfreq, rfftfreq
 
-__all__ = ["smoothspec", "smooth_wave", "smooth_vel", "smooth_lsf",
-           "smooth_wave_fft", "smooth_vel_fft", "smooth_fft", "smooth_lsf_fft",
-           "mask_wave", "resample_wave"]
+from .caching import LRUCache, hashable
+
+try:
+    from scipy import sparse
+except(ImportError):
+    pass
+
+__all__ = ["smoothspec", "smooth_wave", "smooth_vel", "smooth_trapz",
+           "smooth_lsf", "lsf_kernel", "smooth_wave_fft", "smooth_vel_fft",
+           "smooth_fft", "smooth_lsf_fft", "mask_wave", "resample_wave",
+           "fft_length", "pad_spectrum", "Smoother", "RedshiftSmoother"]
 
 ckms = 2.998e5
 sigma_to_fwhm = 2.355
@@ -23,10 +28,16 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
         angstroms.
 
     :param spec:
-        The flux vector of the input spectrum, ndarray
+        The flux vector of the input spectrum, ndarray.  For FFT smoothing of
+        type "vel", "R", or "lambda" this can also be an ndarray of shape
+        ``(N, nwave)`` of N spectra, which are smoothed all at once with a
+        single 2-d FFT.  The input wavelength range and the regular grid used
+        for the FFT are then determined by the broadest kernel.
 
     :param resolution:
-        The smoothing parameter.  Units depend on ``smoothtype``.
+        The smoothing parameter.  Units depend on ``smoothtype``.  For 2-d
+        ``spec`` this can be an ndarray of shape ``(N,)`` giving the smoothing
+        parameter for each spectrum.
 
     :param outwave:
         The output wavelength vector.  If ``None`` then the input wavelength
@@ -67,6 +78,27 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
         the spectrum.  If None then it is determined from the output wavelength
         vector and padded by some multiple of the desired resolution.
 
+    :param fftpad: (optional, default: None)
+        For FFT smoothing of type "vel", "R", or "lambda", the way to pad the
+        (resampled) input spectrum before the FFT, to avoid wrap-around
+        artifacts at the edges.  One of ``"reflect"``, ``"constant"``, or
+        ``"apodized"`` (see :py:func:`pad_spectrum`), in which case the FFT
+        length is the smallest 5-smooth number accommodating the spectrum and
+        ``nsigma_fft`` kernel widths of padding on each side.  With padding,
+        ``nsigma_pad`` (the extra input wavelength range kept, in kernel
+        widths) can be reduced from its default of 20 to ~5.  If ``None``
+        (the default), the spectrum is resampled to a power of two length
+        without padding.
+
+        The padded layout is opt-in.  It resamples onto a regular grid with
+        as many elements as the masked input, rather than the next power of
+        two, so it is exact for inputs that are already regular in the
+        smoothing coordinate, but for other inputs any structure on the scale
+        of the input pixels (e.g. noise) is resampled differently, and the
+        result differs from the default at that level.  Away from the edges
+        the two layouts agree for well sampled spectra; see
+        ``misc/check_fft_padding.py``.
+
     :param inres: (optional)
         If given, this parameter specifies the resolution of the input.  This
         resolution is subtracted in quadrature from the target output
@@ -91,8 +123,13 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
         ``smoothtype`` is ``"lambda"`` and ``fftsmooth`` is False.
 
     :returns flux:
-        The smoothed spectrum on the `outwave` grid, ndarray.
+        The smoothed spectrum on the `outwave` grid, ndarray.  Of shape ``(N,
+        nout)`` for 2-d ``spec``.
     """
+    # Number of values of the smoothing parameter allowed
+    nres = 1
+    if np.ndim(spec) == 2:
+        nres = [1, len(spec)]
     if smoothtype == 'vel':
         linear = False
         units = 'km/s'
@@ -100,8 +137,9 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
         fwhm = sigma * sigma_to_fwhm
         Rsigma = ckms / sigma
         R = ckms / fwhm
-        width = Rsigma
-        assert np.size(sigma) == 1, "`resolution` must be scalar for `smoothtype`='vel'"
+        width = np.min(Rsigma)
+        assert np.size(sigma) in np.atleast_1d(nres), ("`resolution` must be scalar or have one "
+                                                       "element per spectrum for `smoothtype`='vel'")
 
     elif smoothtype == 'R':
         linear = False
@@ -110,8 +148,9 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
         sigma = ckms / Rsigma
         fwhm = sigma * sigma_to_fwhm
         R = ckms / fwhm
-        width = Rsigma
-        assert np.size(sigma) == 1, "`resolution` must be scalar for `smoothtype`='R'"
+        width = np.min(Rsigma)
+        assert np.size(sigma) in np.atleast_1d(nres), ("`resolution` must be scalar or have one "
+                                                       "element per spectrum for `smoothtype`='R'")
         # convert inres from Rsigma to sigma (km/s)
         try:
             kwargs['inres'] = ckms / kwargs['inres']
@@ -125,8 +164,9 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
         fwhm = sigma * sigma_to_fwhm
         Rsigma = None
         R = None
-        width = sigma
-        assert np.size(sigma) == 1, "`resolution` must be scalar for `smoothtype`='lambda'"
+        width = np.max(sigma)
+        assert np.size(sigma) in np.atleast_1d(nres), ("`resolution` must be scalar or have one "
+                                                       "element per spectrum for `smoothtype`='lambda'")
 
     elif smoothtype == 'lsf':
         linear = True
@@ -140,7 +180,7 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
     mask = mask_wave(wave, width=width, outwave=outwave, linear=linear,
                      wlo=min_wave_smooth, whi=max_wave_smooth, **kwargs)
     w = wave[mask]
-    s = spec[mask]
+    s = spec[..., mask]
     if outwave is None:
         outwave = wave
 
@@ -152,7 +192,7 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
                 # mask the resolution vector
                 sigma = resolution[mask]
         else:
-            smooth_method = smoooth_lsf
+            smooth_method = smooth_lsf
             if sigma is not None:
                 # convert to resolution on the output wavelength grid
                 sigma = np.interp(outwave, wave, resolution)
@@ -171,9 +211,397 @@ def smoothspec(wave, spec, resolution=None, outwave=None,
     return smooth_method(w, s, outwave, sigma, **kwargs)
 
 
+class Smoother(object):
+    """FFT smoothing with precomputed quantities for fixed input and output
+    wavelength grids.  The masking of the input spectrum, the indices and
+    weights for resampling onto the regular (log-)wavelength grid used for the
+    FFT and for interpolating back onto ``outwave``, and the Fourier frequency
+    vector are computed once, and the Fourier space taper is cached for each
+    value of the kernel width.  Each call is then one rfft, one taper multiply,
+    and one irfft.  The results are the same as :py:func:`smoothspec` with
+    ``fftsmooth=True``, except that the masked range of the input spectrum is
+    padded according to ``resolution`` rather than the resolution of each
+    call.
+
+    .. code-block:: python
+
+        smoother = Smoother(wave, outwave, smoothtype="vel", resolution=500.)
+        flux = smoother(spec, 150.)
+
+    :param wave:
+        The wavelength vector of the input spectra, ndarray.  Assumed
+        angstroms.
+
+    :param outwave: (optional)
+        The output wavelength vector.  Defaults to ``wave``.
+
+    :param smoothtype: (default: "vel")
+        One of ``"vel"``, ``"R"``, or ``"lambda"``, as for
+        :py:func:`smoothspec`.
+
+    :param resolution:
+        The value of the smoothing parameter (in the units given by
+        ``smoothtype``) corresponding to the broadest kernel that will be
+        used, i.e. the largest velocity dispersion or wavelength dispersion,
+        or the smallest R.  This sets the padding of the masked input
+        wavelength range.
+
+    :param min_wave_smooth: (optional default: 0)
+        As for :py:func:`smoothspec`
+
+    :param max_wave_smooth: (optional default: Inf)
+        As for :py:func:`smoothspec`
+
+    :param nsigma_pad: (optional, default: 20)
+        Number of kernel widths by which to pad the input wavelength range.
+        This can be reduced to ~5 if ``fftpad`` is given.
+
+    :param fftpad: (optional, default: None)
+        If given, the mode of :py:func:`pad_spectrum` used to pad the
+        resampled spectrum by ``nsigma_fft`` kernel widths on each side.  The
+        regular grid then has as many elements as the masked input spectrum,
+        and the FFT length is a 5-smooth number.  Otherwise (the default) the
+        regular grid has a power of two length and no padding.  The padded
+        layout is opt-in, see :py:func:`smoothspec` for how its results
+        differ.
+
+    :param nsigma_fft: (optional, default: 5)
+        Number of kernel widths of padding, if ``fftpad`` is given.
+
+    :param taper_cache_size: (optional, default: 8)
+        Number of Fourier space tapers to keep in memory.
+    """
+
+    def __init__(self, wave, outwave=None, smoothtype="vel", resolution=None,
+                 min_wave_smooth=0, max_wave_smooth=np.inf, nsigma_pad=20.0,
+                 fftpad=None, nsigma_fft=5.0, taper_cache_size=8, **extras):
+        if smoothtype not in ["vel", "R", "lambda"]:
+            raise ValueError("smoothtype {} is not valid for "
+                             "Smoother".format(smoothtype))
+        self.smoothtype = smoothtype
+        self.linear = smoothtype == "lambda"
+        self.resolution = resolution
+        if smoothtype == "vel":
+            width = ckms / resolution
+        else:
+            width = resolution
+
+        # Mask the input spectrum depending on outwave or the wave_smooth kwargs
+        self.mask = mask_wave(wave, width=width, outwave=outwave,
+                              linear=self.linear, wlo=min_wave_smooth,
+                              whi=max_wave_smooth, nsigma_pad=nsigma_pad)
+        self.wave = wave[self.mask]
+        if outwave is None:
+            outwave = wave
+        self.outwave = outwave
+
+        # Regular grid with a power of two number of elements, or the same
+        # number as the input if padding.  See resample_wave
+        wmin, wmax = self.wave.min(), self.wave.max()
+        if fftpad is None:
+            nnew = int(2**(np.ceil(np.log2(len(self.wave)))))
+        else:
+            nnew = len(self.wave)
+        if self.linear:
+            self.grid = np.linspace(wmin, wmax, nnew)
+            self.dx = np.median(np.diff(self.grid))
+        else:
+            lnlam = np.linspace(np.log(wmin), np.log(wmax), nnew)
+            self.grid = np.exp(lnlam)
+            self.dx = ckms * np.median(np.diff(lnlam))
+
+        # Padding layout and FFT length
+        self.fftpad = fftpad
+        self.npad = (0, 0)
+        if fftpad is not None:
+            sigma = self.kernel_sigma(resolution)
+            nleft = int(np.ceil(nsigma_fft * sigma / self.dx))
+            self.npad = (nleft, fft_length(nnew + 2 * nleft) - nnew - nleft)
+        self.nfft = nnew + sum(self.npad)
+        self.ss2 = rfftfreq(self.nfft, d=self.dx)**2
+
+        # Interpolation indices and weights
+        self._resample = interp_weights(self.wave, self.grid)
+        self._output = interp_weights(self.grid, self.outwave)
+        self._tapers = LRUCache(maxsize=taper_cache_size)
+
+    def kernel_sigma(self, resolution, inres=0.0):
+        """The width of the gaussian kernel, in units of the grid spacing
+        ``dx`` (i.e. km/s or angstroms).
+        """
+        if self.smoothtype == "R":
+            sigma = ckms / np.asarray(resolution, dtype=np.float64)
+            if inres > 0:
+                inres = ckms / inres
+        else:
+            sigma = np.asarray(resolution, dtype=np.float64)
+        return np.sqrt(np.clip(sigma**2 - inres**2, 0, np.inf))
+
+    def taper(self, sigma):
+        """The Fourier space taper for a gaussian kernel of width ``sigma``,
+        from the cache if possible.
+        """
+        key = float(sigma)
+        try:
+            return self._tapers[key]
+        except(KeyError):
+            pass
+        self._tapers[key] = np.exp(-2 * (np.pi ** 2) * (sigma ** 2) * self.ss2)
+        return self._tapers[key]
+
+    def __call__(self, spec, resolution, inres=0.0, outwave=None, **extras):
+        """Smooth a spectrum.
+
+        :param spec:
+            The flux vector of the input spectrum, same length as ``wave``, or
+            ndarray of shape ``(N, nwave)`` of N spectra.
+
+        :param resolution:
+            The smoothing parameter, in units given by ``smoothtype``.  Scalar,
+            or ndarray of shape ``(N,)`` for 2-d ``spec``.
+
+        :param inres: (optional, default: 0.0)
+            The resolution of the input spectrum, subtracted in quadrature.
+
+        :param outwave: (optional)
+            Output wavelengths to use instead of the ``outwave`` given at
+            construction, for which the interpolation weights are then
+            computed on the fly.  They should lie within the unpadded part of
+            the masked input range.
+
+        :returns flux:
+            The smoothed spectrum on the ``outwave`` grid, ndarray of shape
+            ``(nout,)`` or ``(N, nout)``.
+        """
+        s = spec[..., self.mask]
+        sigma = self.kernel_sigma(resolution, inres=inres)
+        if np.all(sigma <= 0):
+            return interp_rows(self.outwave if outwave is None else outwave,
+                               self.wave, s)
+        ind, frac = self._resample
+        s = s[..., ind] * (1 - frac) + s[..., ind + 1] * frac
+        if self.fftpad is not None:
+            s = pad_spectrum(s, self.npad[0], self.npad[1], mode=self.fftpad)
+        spec_ff = np.fft.rfft(s, axis=-1)
+        if np.size(sigma) == 1:
+            taper = self.taper(np.squeeze(sigma))
+        else:
+            taper = np.exp(-2 * (np.pi ** 2) * (sigma[:, None] ** 2) * self.ss2)
+        spec_conv = np.fft.irfft(spec_ff * taper, n=self.nfft, axis=-1)
+        spec_conv = spec_conv[..., self.npad[0]:self.npad[0] + len(self.grid)]
+        if outwave is None:
+            ind, frac = self._output
+        else:
+            ind, frac = interp_weights(self.grid, outwave)
+        return spec_conv[..., ind] * (1 - frac) + spec_conv[..., ind + 1] * frac
+
+
+class RedshiftSmoother(object):
+    """A fused operator that redshifts restframe spectra, smooths them in
+    velocity, and resamples them onto a fixed observed frame wavelength
+    vector.  Restframe spectra are interpolated onto a regular grid in
+    ln(wavelength) with elements at integer multiples of ``dlnlam``, so that
+    redshifting is just a shift of the window of the grid that is used, and
+    since the velocity smoothing kernel is the same in the restframe and the
+    observed frame the FFT convolution can be done before redshifting.  The
+    smoothed spectrum is then interpolated directly from the restframe grid
+    to ``outwave / a``.  The interpolation from the restframe wavelengths
+    onto the whole ln(wavelength) grid is computed once, and each redshift
+    uses a slice of it.  The window, output interpolation weights, padding,
+    and Fourier frequencies are cached for each redshift, and the Fourier
+    space tapers for each kernel width.
+
+    For a redshift factor ``a`` the result approximates
+
+    .. code-block:: python
+
+        a * smoothspec(wave * a, spec, resolution, outwave=outwave,
+                       smoothtype=smoothtype, fftsmooth=True)
+
+    .. code-block:: python
+
+        smoother = RedshiftSmoother(wave, outwave, smoothtype="vel",
+                                    resolution=500.)
+        flux = smoother(spec, 150., a=1.1)
+
+    :param wave:
+        The restframe wavelength vector of the input spectra, ndarray.
+        Assumed angstroms.
+
+    :param outwave:
+        The observed frame output wavelength vector.
+
+    :param smoothtype: (default: "vel")
+        One of ``"vel"`` or ``"R"``, as for :py:func:`smoothspec`.
+
+    :param resolution:
+        The value of the smoothing parameter corresponding to the broadest
+        kernel that will be used.  This sets the padding of the window.
+
+    :param nsigma_pad: (optional, default: 5)
+        Number of kernel widths by which the window extends beyond
+        ``outwave / a``.
+
+    :param fftpad: (optional, default: "reflect")
+        Mode of :py:func:`pad_spectrum` for the padding of the window before
+        the FFT, by ``nsigma_fft`` kernel widths.
+
+    :param dlnlam: (optional)
+        The spacing of the ln(wavelength) grid.  Defaults to the median
+        spacing of ``wave`` within the range of ``outwave``.
+
+    :param cache_size: (optional, default: 8)
+        Number of redshifts, and of Fourier space tapers, to keep in memory.
+    """
+
+    def __init__(self, wave, outwave, smoothtype="vel", resolution=None,
+                 nsigma_pad=5.0, fftpad="reflect", nsigma_fft=5.0,
+                 dlnlam=None, cache_size=8, **extras):
+        if smoothtype not in ["vel", "R"]:
+            raise ValueError("smoothtype {} is not valid for "
+                             "RedshiftSmoother".format(smoothtype))
+        self.smoothtype = smoothtype
+        self.wave = np.asarray(wave, dtype=np.float64)
+        self.outwave = np.asarray(outwave, dtype=np.float64)
+        self.lnwave = np.log(self.wave)
+        self.lnout = np.log(self.outwave)
+        if dlnlam is None:
+            inrange = ((self.wave >= self.outwave.min()) &
+                       (self.wave <= self.outwave.max()))
+            if inrange.sum() < 2:
+                inrange = slice(None)
+            dlnlam = np.median(np.diff(self.lnwave[inrange]))
+        self.dlnlam = dlnlam
+        self.dx = ckms * dlnlam
+        self.fftpad = fftpad
+        # Padding, in grid elements
+        sigma = self.kernel_sigma(resolution)
+        self.nwin = int(np.ceil(nsigma_pad * sigma / self.dx))
+        self.nfftpad = int(np.ceil(nsigma_fft * sigma / self.dx))
+        # Interpolation onto the grid k * dlnlam for all k covering wave, with
+        # one element beyond each end where the weights are already clamped
+        self.kfirst = int(np.floor(self.lnwave[0] / dlnlam)) - 1
+        klast = int(np.ceil(self.lnwave[-1] / dlnlam)) + 1
+        lngrid = np.arange(self.kfirst, klast + 1) * dlnlam
+        self._resample = interp_weights(self.lnwave, lngrid)
+        self._layouts = LRUCache(maxsize=cache_size)
+        self._tapers = LRUCache(maxsize=cache_size)
+
+    def kernel_sigma(self, resolution, inres=0.0):
+        """The width of the gaussian kernel in km/s.
+        """
+        if self.smoothtype == "R":
+            sigma = ckms / np.asarray(resolution, dtype=np.float64)
+            if inres > 0:
+                inres = ckms / inres
+        else:
+            sigma = np.asarray(resolution, dtype=np.float64)
+        return np.sqrt(np.clip(sigma**2 - inres**2, 0, np.inf))
+
+    def layout(self, a):
+        """The grid window, interpolation weights, padding, and squared Fourier
+        frequencies for redshift factor ``a``, from the cache if possible.
+        """
+        key = float(a)
+        try:
+            return self._layouts[key]
+        except(KeyError):
+            pass
+        lna = np.log(a)
+        # Window of the restframe grid, k * dlnlam for kmin <= k < kmax
+        kmin = int(np.floor((self.lnout.min() - lna) / self.dlnlam)) - self.nwin
+        kmax = int(np.ceil((self.lnout.max() - lna) / self.dlnlam)) + self.nwin + 1
+        ind, frac = self._resample
+        lo, hi = kmin - self.kfirst, kmax - self.kfirst
+        if (lo >= 0) and (hi <= len(ind)):
+            resample = ind[lo:hi], frac[lo:hi]
+        else:
+            # beyond the ends of wave the weights are those of the end points
+            k = np.clip(np.arange(lo, hi), 0, len(ind) - 1)
+            resample = ind[k], frac[k]
+        # Observed frame outwave in units of window elements
+        u = (self.lnout - lna) / self.dlnlam - kmin
+        ind = np.clip(np.floor(u).astype(int), 0, kmax - kmin - 2)
+        output = ind, u - ind
+        npix = kmax - kmin
+        npad = (self.nfftpad, fft_length(npix + 2 * self.nfftpad) - npix - self.nfftpad)
+        ss2 = rfftfreq(npix + sum(npad), d=self.dx)**2
+        self._layouts[key] = resample, output, npad, ss2
+        return self._layouts[key]
+
+    def taper(self, sigma, ss2):
+        """The Fourier space taper for a gaussian kernel of width ``sigma``,
+        from the cache if possible.
+        """
+        key = (float(sigma), len(ss2))
+        try:
+            return self._tapers[key]
+        except(KeyError):
+            pass
+        self._tapers[key] = np.exp(-2 * (np.pi ** 2) * (sigma ** 2) * ss2)
+        return self._tapers[key]
+
+    def __call__(self, spec, resolution, a=1.0, inres=0.0, **extras):
+        """Redshift, smooth, and resample restframe spectra.
+
+        :param spec:
+            The restframe flux vector, same length as ``wave``, or ndarray of
+            shape ``(N, nwave)`` of N spectra.
+
+        :param resolution:
+            The smoothing parameter, in units given by ``smoothtype``.  Scalar,
+            or ndarray of shape ``(N,)`` for 2-d ``spec``.
+
+        :param a: (optional, default: 1.0)
+            The redshift factor ``1 + z``.
+
+        :param inres: (optional, default: 0.0)
+            The resolution of the input spectrum, subtracted in quadrature.
+
+        :returns flux:
+            The observed frame smoothed spectrum ``a * spec(outwave / a)`` on
+            the ``outwave`` grid, ndarray of shape ``(nout,)`` or ``(N,
+            nout)``.
+        """
+        sigma = self.kernel_sigma(resolution, inres=inres)
+        if np.all(sigma <= 0):
+            return interp_rows(self.outwave / a, self.wave, spec) * a
+        (ind, frac), output, npad, ss2 = self.layout(a)
+        s = spec[..., ind] * (1 - frac) + spec[..., ind + 1] * frac
+        npix = s.shape[-1]
+        s = pad_spectrum(s, npad[0], npad[1], mode=self.fftpad)
+        spec_ff = np.fft.rfft(s, axis=-1)
+        if np.size(sigma) == 1:
+            taper = self.taper(np.squeeze(sigma), ss2)
+        else:
+            taper = np.exp(-2 * (np.pi ** 2) * (sigma[:, None] ** 2) * ss2)
+        spec_conv = np.fft.irfft(spec_ff * taper, n=s.shape[-1], axis=-1)
+        spec_conv = spec_conv[..., npad[0]:npad[0] + npix]
+        ind, frac = output
+        return (spec_conv[..., ind] * (1 - frac) + spec_conv[..., ind + 1] * frac) * a
+
+
+def interp_weights(xp, x):
+    """Indices and weights for linear interpolation from the increasing grid
+    ``xp`` to ``x``, such that ``fp[ind] * (1 - frac) + fp[ind + 1] * frac``
+    is the same as ``np.interp(x, xp, fp)``.
+
+    :returns ind:
+        ndarray of integer indices into ``xp``, same shape as ``x``
+
+    :returns frac:
+        ndarray of fractional weights, same shape as ``x``
+    """
+    ind = np.searchsorted(xp, x, side='right') - 1
+    ind = np.clip(ind, 0, len(xp) - 2)
+    frac = (x - xp[ind]) / (xp[ind + 1] - xp[ind])
+    return ind, np.clip(frac, 0, 1)
+
+
 def smooth_vel(wave, spec, outwave, sigma, nsigma=10, inres=0, **extras):
-    """Smooth a spectrum in velocity space.  This is insanely slow, but general
-    and correct.
+    """Smooth a spectrum in velocity space.  This is slow compared to the FFT
+    methods, but general and correct.  The direct convolution is done for
+    blocks of output wavelengths at once (see :py:func:`smooth_trapz`).
 
     :param wave:
         Wavelength vector of the input spectrum.
@@ -190,8 +618,8 @@ def smooth_vel(wave, spec, outwave, sigma, nsigma=10, inres=0, **extras):
     :param nsigma:
         Number of sigma away from the output wavelength to consider in the
         integral.  If less than zero, all wavelengths are used.  Setting this
-        to some positive number decreses the scaling constant in the O(N_out *
-        N_in) algorithm used here.
+        to some positive number makes the algorithm scale as O(N_out * N_in *
+        nsigma * sigma / span(wave)) instead of O(N_out * N_in).
 
     :param inres:
         The velocity resolution of the input spectrum (km/s), *not* FWHM.
@@ -203,23 +631,12 @@ def smooth_vel(wave, spec, outwave, sigma, nsigma=10, inres=0, **extras):
     # sigma_eff is in units of sigma_lambda / lambda
     sigma_eff = np.sqrt(sigma_eff_sq) / ckms
 
-    lnwave = np.log(wave)
-    flux = np.zeros(len(outwave))
-    for i, w in enumerate(outwave):
-        x = (np.log(w) - lnwave) / sigma_eff
-        if nsigma > 0:
-            good = np.abs(x) < nsigma
-            x = x[good]
-            _spec = spec[good]
-        else:
-            _spec = spec
-        f = np.exp(-0.5 * x**2)
-        flux[i] = np.trapz(f * _spec, x) / np.trapz(f, x)
-    return flux
+    return smooth_trapz(np.log(wave), spec, np.log(outwave), sigma_eff,
+                        nsigma=nsigma)
 
 
 def smooth_vel_fft(wavelength, spectrum, outwave, sigma_out, inres=0.0,
-                   **extras):
+                   fftpad=None, nsigma_fft=5.0, **extras):
     """Smooth a spectrum in velocity space, using FFTs. This is fast, but makes
     some assumptions about the form of the input spectrum and can have some
     issues at the ends of the spectrum depending on how it is padded.
@@ -229,25 +646,37 @@ def smooth_vel_fft(wavelength, spectrum, outwave, sigma_out, inres=0.0,
         if this is not a regular grid in wavelength.
 
     :param spectrum:
-        Flux vector of the input spectrum.
+        Flux vector of the input spectrum, or ndarray of shape ``(N, nwave)``
+        of N spectra.
 
     :param outwave:
         Desired output wavelength vector.
 
     :param sigma_out:
-        Desired velocity resolution (km/s), *not* FWHM.  Scalar or length 1 array.
+        Desired velocity resolution (km/s), *not* FWHM.  Scalar or length 1
+        array, or ndarray of shape ``(N,)`` for 2-d ``spectrum``
 
     :param inres:
         The velocity resolution of the input spectrum (km/s), dispersion *not*
         FWHM.
+
+    :param fftpad: (optional, default: None)
+        If given, the padding mode for :py:func:`smooth_fft`, and the spectrum
+        is resampled to the same number of elements instead of a power of
+        two.
+
+    :param nsigma_fft: (optional, default: 5.0)
+        Number of kernel widths of padding, if ``fftpad`` is given.
     """
     # The kernel width for the convolution.
-    sigma = np.sqrt(sigma_out**2 - inres**2)
-    if sigma <= 0:
-        return np.interp(outwave, wavelength, spectrum)
+    sigma = np.sqrt(np.clip(sigma_out**2 - inres**2, 0, np.inf))
+    if np.all(sigma <= 0):
+        return interp_rows(outwave, wavelength, spectrum)
 
-    # make length of spectrum a power of 2 by resampling
-    wave, spec = resample_wave(wavelength, spectrum)
+    # resample to a regular grid in ln(lambda), with a power of 2 length
+    # unless the spectrum will be padded.
+    nnew = None if fftpad is None else len(wavelength)
+    wave, spec = resample_wave(wavelength, spectrum, nnew=nnew)
 
     # get grid resolution (*not* the resolution of the input spectrum) and make
     # sure it's nearly constant.  It should be, by design (see resample_wave)
@@ -256,19 +685,20 @@ def smooth_vel_fft(wavelength, spectrum, outwave, sigma_out, inres=0.0,
     dv = ckms * np.median(invRgrid)
 
     # Do the convolution
-    spec_conv = smooth_fft(dv, spec, sigma)
+    spec_conv = smooth_fft(dv, spec, sigma, pad=fftpad, nsigma=nsigma_fft)
     # interpolate onto output grid
     if outwave is not None:
-        spec_conv = np.interp(outwave, wave, spec_conv)
+        spec_conv = interp_rows(outwave, wave, spec_conv)
 
     return spec_conv
 
 
 def smooth_wave(wave, spec, outwave, sigma, nsigma=10, inres=0, in_vel=False,
                 **extras):
-    """Smooth a spectrum in wavelength space.  This is insanely slow, but
-    general and correct (except for the treatment of the input resolution if it
-    is velocity)
+    """Smooth a spectrum in wavelength space.  This is slow compared to the
+    FFT methods, but general and correct (except for the treatment of the
+    input resolution if it is velocity).  The direct convolution is done for
+    blocks of output wavelengths at once (see :py:func:`smooth_trapz`).
 
     :param wave:
         Wavelength vector of the input spectrum.
@@ -287,8 +717,8 @@ def smooth_wave(wave, spec, outwave, sigma, nsigma=10, inres=0, in_vel=False,
     :param nsigma: (optional, default=10)
         Number of sigma away from the output wavelength to consider in the
         integral.  If less than zero, all wavelengths are used.  Setting this
-        to some positive number decreses the scaling constant in the O(N_out *
-        N_in) algorithm used here.
+        to some positive number makes the algorithm scale as O(N_out * N_in *
+        nsigma * sigma / span(wave)) instead of O(N_out * N_in).
 
     :param inres: (optional, default: 0.0)
         Resolution of the input, in either wavelength units or
@@ -315,22 +745,96 @@ def smooth_wave(wave, spec, outwave, sigma, nsigma=10, inres=0, in_vel=False,
                          "possible for this input spectrum.")
 
     sigma_eff = np.sqrt(sigma_eff_sq)
-    flux = np.zeros(len(outwave))
-    for i, w in enumerate(outwave):
-        x = (wave - w) / sigma_eff
-        if nsigma > 0:
-            good = np.abs(x) < nsigma
-            x = x[good]
-            _spec = spec[good]
+    return smooth_trapz(wave, spec, outwave, sigma_eff, nsigma=nsigma)
+
+
+def smooth_trapz(x_in, spec, x_out, sigma, nsigma=10, blocksize=2**16):
+    """Direct convolution with a gaussian kernel, using the trapezoidal rule
+    over the input pixels within ``nsigma`` of each output point.  This is
+    vectorized over blocks of output points, and gives the same results as
+    looping over output points and computing, for each,
+
+    .. code-block:: python
+
+        x = (x_in - x_out[i]) / sigma
+        good = np.abs(x) < nsigma
+        f = np.exp(-0.5 * x[good]**2)
+        flux[i] = trapz(f * spec[good], x[good]) / trapz(f, x[good])
+
+    :param x_in:
+        The coordinate (e.g. wavelength or ln(wavelength)) of the input pixels,
+        ndarray of shape ``(nin,)``.  If it is increasing, only a window of
+        input pixels around each output point is considered.
+
+    :param spec:
+        The input flux vector, ndarray of shape ``(nin,)``
+
+    :param x_out:
+        The coordinate of the output points, ndarray of shape ``(nout,)``
+
+    :param sigma:
+        The kernel dispersion in units of ``x_in``.  Scalar or ndarray of
+        shape ``(nin,)`` giving the dispersion at each input pixel.
+
+    :param nsigma: (optional, default: 10)
+        Number of sigma away from the output point to consider.  If less than
+        zero, all input pixels are used.
+
+    :param blocksize: (optional, default: 2**16)
+        The approximate maximum number of elements in the 2-d arrays used for
+        each block of output points.
+
+    :returns flux:
+        The smoothed flux, ndarray of shape ``(nout,)``
+    """
+    x_in, x_out = np.asarray(x_in), np.atleast_1d(x_out)
+    spec = np.asarray(spec)
+    sigma = np.zeros(len(x_in)) + sigma
+    nin, nout = len(x_in), len(x_out)
+    # Range of input pixels that can be within nsigma of each output point,
+    # padded by one pixel to be safe against roundoff.  The exact selection
+    # is made below.
+    if (nsigma > 0) and np.all(np.diff(x_in) > 0):
+        reach = nsigma * sigma.max()
+        lo = np.searchsorted(x_in, x_out - reach, side='left') - 1
+        hi = np.searchsorted(x_in, x_out + reach, side='right') + 1
+        lo, hi = np.clip(lo, 0, nin), np.clip(hi, 0, nin)
+    else:
+        lo, hi = np.zeros(nout, dtype=int), np.zeros(nout, dtype=int) + nin
+    width = max(np.max(hi - lo), 1)
+    step = max(blocksize // width, 1)
+
+    flux = np.zeros(nout)
+    for start in range(0, nout, step):
+        blk = slice(start, start + step)
+        idx = lo[blk, None] + np.arange(width)
+        valid = idx < hi[blk, None]
+        idx = np.minimum(idx, nin - 1)
+        x = (x_in[idx] - x_out[blk, None]) / sigma[idx]
+        good = valid & (np.abs(x) < nsigma) if nsigma > 0 else valid
+        # Trapezoidal rule over consecutive selected pixels
+        starts = good[:, 1:] & ~good[:, :-1]
+        if np.all(starts.sum(axis=1) + good[:, 0] <= 1):
+            # The selected pixels are contiguous in every row
+            sp = spec[idx]
+            pair = good[:, 1:] & good[:, :-1]
         else:
-            _spec = spec
+            # Move the selected pixels to the front of each row, in order.
+            order = np.argsort(~good, axis=1, kind='stable')
+            x = np.take_along_axis(x, order, axis=1)
+            sp = spec[np.take_along_axis(idx, order, axis=1)]
+            pair = np.arange(width - 1) < (good.sum(axis=1)[:, None] - 1)
         f = np.exp(-0.5 * x**2)
-        flux[i] = np.trapz(f * _spec, x) / np.trapz(f, x)
+        dx = np.diff(x, axis=1) * pair
+        num = (dx * (f[:, 1:] * sp[:, 1:] + f[:, :-1] * sp[:, :-1]) / 2.0).sum(axis=1)
+        den = (dx * (f[:, 1:] + f[:, :-1]) / 2.0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            flux[blk] = num / den
     return flux
 
 
 def smooth_wave_fft(wavelength, spectrum, outwave, sigma_out=1.0,
-                    inres=0.0, **extras):
+                    inres=0.0, fftpad=None, nsigma_fft=5.0, **extras):
     """Smooth a spectrum in wavelength space, using FFTs.  This is fast, but
     makes some assumptions about the input spectrum, and can have some
     issues at the ends of the spectrum depending on how it is padded.
@@ -339,28 +843,39 @@ def smooth_wave_fft(wavelength, spectrum, outwave, sigma_out=1.0,
         Wavelength vector of the input spectrum.
 
     :param spectrum:
-        Flux vector of the input spectrum.
+        Flux vector of the input spectrum, or ndarray of shape ``(N, nwave)``
+        of N spectra.
 
     :param outwave:
         Desired output wavelength vector.
 
     :param sigma:
-        Desired resolution (*not* FWHM) in wavelength units.
+        Desired resolution (*not* FWHM) in wavelength units.  Scalar, or
+        ndarray of shape ``(N,)`` for 2-d ``spectrum``
 
     :param inres:
         Resolution of the input, in wavelength units (dispersion not FWHM).
 
+    :param fftpad: (optional, default: None)
+        If given, the padding mode for :py:func:`smooth_fft`, and the spectrum
+        is resampled to the same number of elements instead of a power of
+        two.
+
+    :param nsigma_fft: (optional, default: 5.0)
+        Number of kernel widths of padding, if ``fftpad`` is given.
+
     :returns flux:
         The output smoothed flux vector, same length as ``outwave``.
     """
+    # The kernel width for the convolution.
+    sigma = np.sqrt(np.clip(sigma_out**2 - inres**2, 0, np.inf))
+    if np.all(sigma <= 0):
+        return interp_rows(outwave, wavelength, spectrum)
+
     # restrict wavelength range (for speed)
     # should also make nearest power of 2
-    wave, spec = resample_wave(wavelength, spectrum, linear=True)
-
-    # The kernel width for the convolution.
-    sigma = np.sqrt(sigma_out**2 - inres**2)
-    if sigma < 0:
-        return np.interp(wave, outwave, flux)
+    nnew = None if fftpad is None else len(wavelength)
+    wave, spec = resample_wave(wavelength, spectrum, linear=True, nnew=nnew)
 
     # get grid resolution (*not* the resolution of the input spectrum) and make
     # sure it's nearly constant.  Should be by design (see resample_wave)
@@ -369,25 +884,30 @@ def smooth_wave_fft(wavelength, spectrum, outwave, sigma_out=1.0,
     dw = np.median(Rgrid)
 
     # Do the convolution
-    spec_conv = smooth_fft(dw, spec, sigma)
+    spec_conv = smooth_fft(dw, spec, sigma, pad=fftpad, nsigma=nsigma_fft)
     # interpolate onto output grid
     if outwave is not None:
-        spec_conv = np.interp(outwave, wave, spec_conv)
+        spec_conv = interp_rows(outwave, wave, spec_conv)
     return spec_conv
 
 
 def smooth_lsf(wave, spec, outwave, sigma=None, lsf=None, return_kernel=False,
-               **kwargs):
+               nsigma=10, **kwargs):
     """Broaden a spectrum using a wavelength dependent line spread function.
     This function is only approximate because it doesn't actually do the
     integration over pixels, so for sparsely sampled points you'll have
     problems.  This function needs to be checked and possibly rewritten.
 
+    The kernel is a sparse banded matrix (see :py:func:`lsf_kernel`), which is
+    cached for the most recently used wavelength grids and dispersion vectors,
+    so the cost scales linearly with the length of the spectrum.
+
     :param wave:
         Input wavelengths.  ndarray of shape (nin,)
 
     :param spec:
-        Input spectrum.  ndarray of same shape as ``wave``.
+        Input spectrum.  ndarray of same shape as ``wave``, or of shape
+        ``(N, nin)`` for N spectra.
 
     :param outwave:
         Output wavelengths, ndarray of shape (nout,)
@@ -406,31 +926,87 @@ def smooth_lsf(wave, spec, outwave, sigma=None, lsf=None, return_kernel=False,
         Passed to the function supplied in the ``lsf`` keyword.
 
     :param return_kernel: (optional, default: False)
-        If True, return the kernel used to broaden the spectrum as ndarray of
-        shape (nout, nin).
+        If True, return the kernel used to broaden the spectrum, a sparse
+        matrix of shape (nout, nin).
+
+    :param nsigma: (optional, default: 10)
+        Number of dispersions at which the kernel is truncated.
 
     :returns newspec:
         The broadened spectrum, same length as ``outwave``.
     """
     if (lsf is None) and (sigma is None):
-        return np.interp(outwave, wave, spec)
-    dw = np.gradient(wave)
+        return interp_rows(outwave, wave, spec)
     if sigma is None:
         sigma = lsf(outwave, **kwargs)
-    kernel = outwave[:, None] - wave[None, :]
-    kernel = (1 / (sigma * np.sqrt(np.pi * 2))[:, None] *
-              np.exp(-kernel**2 / (2 * sigma[:, None]**2)) *
-              dw[None, :])
-    # should this be axis=0 or axis=1?
-    kernel = kernel / kernel.sum(axis=1)[:, None]
-    newspec = np.dot(kernel, spec)
-    # kernel /= np.trapz(kernel, wave, axis=1)[:, None]
-    # newspec = np.trapz(kernel * spec[None, :], wave, axis=1)
+    kernel = lsf_kernel(wave, outwave, sigma, nsigma=nsigma)
+    newspec = kernel.dot(np.asarray(spec).T).T
     if return_kernel:
         return newspec, kernel
     return newspec
 
 
+# Kernels for the most recently used grids and dispersion vectors
+_lsf_kernels = LRUCache(maxsize=4)
+
+
+def lsf_kernel(wave, outwave, sigma, nsigma=10):
+    """Get the normalized gaussian line-spread function kernel mapping a
+    spectrum on ``wave`` to ``outwave``, truncated at ``nsigma`` dispersions.
+    Each row of the kernel only has entries for the input pixels within
+    ``nsigma`` of the output wavelength (or the nearest input pixel if there
+    are none), so it is stored as a sparse CSR matrix if scipy is available.
+    Kernels are cached on the values of all the arguments.
+
+    :param wave:
+        Input wavelengths.  ndarray of shape (nin,)
+
+    :param outwave:
+        Output wavelengths, ndarray of shape (nout,)
+
+    :param sigma:
+        The dispersion (not FWHM) at each output wavelength, ndarray of shape
+        (nout,)
+
+    :returns kernel:
+        ``scipy.sparse.csr_matrix`` (or ndarray if scipy is not installed) of
+        shape (nout, nin)
+    """
+    wave = np.asarray(wave, dtype=np.float64)
+    outwave = np.asarray(outwave, dtype=np.float64)
+    sigma = np.zeros(len(outwave)) + sigma
+    key = (hashable(wave), hashable(outwave), hashable(sigma), nsigma)
+    try:
+        return _lsf_kernels[key]
+    except(KeyError):
+        pass
+
+    nin, nout = len(wave), len(outwave)
+    lo = np.searchsorted(wave, outwave - nsigma * sigma, side='left')
+    hi = np.searchsorted(wave, outwave + nsigma * sigma, side='right')
+    lo = np.clip(np.minimum(lo, hi - 1), 0, nin - 1)
+    hi = np.maximum(hi, lo + 1)
+    # indices of the nonzero elements of each row
+    counts = hi - lo
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    rows = np.repeat(np.arange(nout), counts)
+    cols = lo[rows] + np.arange(indptr[-1]) - indptr[rows]
+    dw = np.gradient(wave)
+    # Subtract the smallest offset in each row, which cancels in the
+    # normalization, to avoid underflow for very narrow kernels.
+    d2 = (outwave[rows] - wave[cols])**2
+    d2 -= np.minimum.reduceat(d2, indptr[:-1])[rows]
+    vals = np.exp(-d2 / (2 * sigma[rows]**2)) * dw[cols]
+    vals /= np.bincount(rows, weights=vals, minlength=nout)[rows]
+    try:
+        kernel = sparse.csr_matrix((vals, cols, indptr), shape=(nout, nin))
+    except(NameError):
+        kernel = np.zeros([nout, nin])
+        kernel[rows, cols] = vals
+    _lsf_kernels[key] = kernel
+    return kernel
+
+
 def smooth_lsf_fft(wave, spec, outwave, sigma=None, lsf=None, pix_per_sigma=2,
                    eps=0.25, preserve_all_input_frequencies=False, **kwargs):
     """Smooth a spectrum by a wavelength dependent line-spread function, using
@@ -546,30 +1122,110 @@ def smooth_lsf_fft(wave, spec, outwave, sigma=None, lsf=None, pix_per_sigma=2,
     return np.interp(outwave, lam, spec_conv)
 
 
-def smooth_fft(dx, spec, sigma):
+def smooth_fft(dx, spec, sigma, pad=None, nsigma=5.0):
     """Basic math for FFT convolution with a gaussian kernel.
 
     :param dx:
         The wavelength or velocity spacing, same units as sigma
 
     :param sigma:
-        The width of the gaussian kernel, same units as dx
+        The width of the gaussian kernel, same units as dx.  Scalar, or
+        ndarray of shape ``(N,)`` giving the width for each spectrum.
 
     :param spec:
-        The spectrum flux vector
+        The spectrum flux vector, or ndarray of shape ``(N, nwave)`` of N
+        spectra which are transformed all at once.
+
+    :param pad: (optional, default: None)
+        If given, the spectrum is padded on each side by ``nsigma`` times the
+        broadest kernel width before the FFT, using this mode of
+        :py:func:`pad_spectrum`, and up to a 5-smooth length given by
+        :py:func:`fft_length`.  Otherwise the spectrum is treated as periodic.
+
+    :param nsigma: (optional, default: 5.0)
+        Number of kernel widths to pad by, if ``pad`` is given.
     """
+    n = spec.shape[-1]
+    nleft, nright = 0, 0
+    if pad is not None:
+        nleft = int(np.ceil(nsigma * np.max(sigma) / dx))
+        nright = fft_length(n + 2 * nleft) - n - nleft
+        spec = pad_spectrum(spec, nleft, nright, mode=pad)
     # The Fourier coordinate
-    ss = rfftfreq(len(spec), d=dx)
+    ss = rfftfreq(spec.shape[-1], d=dx)
     # Make the fourier space taper; just the analytical fft of a gaussian
+    sigma = np.reshape(sigma, np.shape(sigma) + (1,))
     taper = np.exp(-2 * (np.pi ** 2) * (sigma ** 2) * (ss ** 2))
-    ss[0] = 0.01  # hack
     # Fourier transform the spectrum
-    spec_ff = np.fft.rfft(spec)
+    spec_ff = np.fft.rfft(spec, axis=-1)
     # Multiply in fourier space
     ff_tapered = spec_ff * taper
     # Fourier transform back
-    spec_conv = np.fft.irfft(ff_tapered)
-    return spec_conv
+    spec_conv = np.fft.irfft(ff_tapered, n=spec.shape[-1], axis=-1)
+    spec_conv = spec_conv[..., nleft:nleft + n]
+    return np.squeeze(spec_conv) if spec.ndim == 1 else spec_conv
+
+
+def fft_length(n):
+    """The smallest 5-smooth number (i.e. of the form 2**a * 3**b * 5**c) that
+    is not less than ``n``.  FFTs of these lengths are fast.
+    """
+    n = int(n)
+    if n <= 1:
+        return 1
+    best = 2**int(np.ceil(np.log2(n)))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # smallest power of two times p35 that is >= n
+            m = p35 * 2**max(int(np.ceil(np.log2(float(n) / p35))), 0)
+            best = min(best, m)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def pad_spectrum(spec, nleft, nright, mode="reflect"):
+    """Pad spectra along the last axis, for FFT convolution.
+
+    :param spec:
+        The spectrum flux vector, or ndarray of shape ``(N, nwave)``
+
+    :param nleft:
+        Number of elements to add before the spectrum.
+
+    :param nright:
+        Number of elements to add after the spectrum.
+
+    :param mode: (default: "reflect")
+        One of
+
+        * "reflect" - mirror the spectrum about its end points.
+        * "constant" - repeat the values at the ends of the spectrum.
+        * "apodized" - cosine tapers from each end value to the mean of the
+          two end values, so the periodic extension of the padded spectrum
+          is continuous and smooth.
+
+    :returns padded:
+        ndarray of shape ``(..., nleft + nwave + nright)``
+    """
+    spec = np.asarray(spec)
+    width = [(0, 0)] * (spec.ndim - 1) + [(nleft, nright)]
+    if mode == "reflect":
+        return np.pad(spec, width, mode="reflect")
+    elif mode == "constant":
+        return np.pad(spec, width, mode="edge")
+    elif mode == "apodized":
+        lo, hi = spec[..., :1], spec[..., -1:]
+        mid = (lo + hi) / 2.
+        tl = np.arange(1, nleft + 1) / (nleft + 1.)
+        tr = np.arange(1, nright + 1) / (nright + 1.)
+        left = mid + (lo - mid) * (1 - np.cos(np.pi * tl)) / 2.
+        right = hi + (mid - hi) * (1 - np.cos(np.pi * tr)) / 2.
+        return np.concatenate([left, spec, right], axis=-1)
+    else:
+        raise ValueError("padding mode {} is not valid".format(mode))
 
 
 def mask_wave(wavelength, width=1, wlo=0, whi=np.inf, outwave=None,
@@ -591,15 +1247,17 @@ def mask_wave(wavelength, width=1, wlo=0, whi=np.inf, outwave=None,
     return mask
 
 
-def resample_wave(wavelength, spectrum, linear=False):
-    """Resample spectrum, so that the number of elements is the next highest
-    power of two.  This uses np.interp.  Note that if the input wavelength grid
-    did not critically sample the spectrum then there is no gaurantee the
-    output wavelength grid will.
+def resample_wave(wavelength, spectrum, linear=False, nnew=None):
+    """Resample spectrum onto a regular grid in wavelength (``linear=True``)
+    or ln(wavelength), so that the number of elements is the next highest
+    power of two, or ``nnew`` if given.  This uses np.interp.  Note that if the
+    input wavelength grid did not critically sample the spectrum then there is
+    no gaurantee the output wavelength grid will.
     """
     wmin, wmax = wavelength.min(), wavelength.max()
     nw = len(wavelength)
-    nnew = 2.0**(np.ceil(np.log2(nw)))
+    if nnew is None:
+        nnew = int(2**(np.ceil(np.log2(nw))))
     if linear:
         Rgrid = np.diff(wavelength)  # in same units as ``wavelength``
         w = np.linspace(wmin, wmax, nnew)
@@ -609,10 +1267,22 @@ def resample_wave(wavelength, spectrum, linear=False):
         w = np.exp(lnlam)
     # Make sure the resolution really is nearly constant
     #assert Rgrid.max() / Rgrid.min() < 1.05
-    s = np.interp(w, wavelength, spectrum)
+    s = interp_rows(w, wavelength, spectrum)
     return w, s
 
 
+def interp_rows(x, xp, fp):
+    """Linear interpolation like ``np.interp(x, xp, fp)``, but where ``fp``
+    can also be an ndarray of shape ``(N, len(xp))``, in which case each row
+    is interpolated.
+    """
+    fp = np.asarray(fp)
+    if fp.ndim == 1:
+        return np.interp(x, xp, fp)
+    ind, frac = interp_weights(xp, x)
+    return fp[..., ind] * (1 - frac) + fp[..., ind + 1] * frac
+
+
 def subtract_input_resolution(res_in, res_target, smoothtype_in, smoothtype_target, wave=None):
     """Subtract the input resolution (in quadrature) from a target output
     resolution to get the width of the kernel that will convolve the input to
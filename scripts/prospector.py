@@ -1,6 +1,7 @@
 #!/usr/local/bin/python
 
 import time, sys, os
+import warnings
 import numpy as np
 np.errstate(invalid='ignore')
 
@@ -29,6 +30,12 @@ global_model = model_setup.load_model(**run_params)
 global_obs = model_setup.load_obs(**run_params)
 # SPS Model instance as global
 sps = model_setup.load_sps(**run_params)
+# The marginalized calibration assumes uncorrelated noise given by obs['unc']
+marginalize_speccal = np.all(global_model.params.get('marginalize_speccal', False))
+if marginalize_speccal and (spec_noise is not None):
+    warnings.warn("The spectroscopic calibration marginalization is not "
+                  "consistent with a spectroscopic noise model, and will "
+                  "not be added to the likelihood.")
 
 # -----------------
 # LnP function as global
@@ -98,6 +105,10 @@ def lnprobfn(theta, model=None, obs=None, residuals=False,
     # Calculate likelihoods
     t2 = time.time()
     lnp_spec = lnlike_spec(spec, obs=obs, spec_noise=spec_noise, **vectors)
+    # Marginalized calibration (zero unless the model marginalizes it),
+    # which is only valid without a spectroscopic noise model
+    if spec_noise is None:
+        lnp_spec += getattr(model, 'speccal_lnmarg', 0.0)
     lnp_phot = lnlike_phot(phot, obs=obs, phot_noise=phot_noise, **vectors)
     d2 = time.time() - t2
     if verbose:
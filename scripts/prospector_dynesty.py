@@ -1,4 +1,5 @@
 import time, sys, os
+import warnings
 import numpy as np
 np.errstate(invalid='ignore')
 
@@ -28,6 +29,12 @@ global_model = model_setup.load_model(**run_params)
 global_obs = model_setup.load_obs(**run_params)
 # SPS Model instance as global
 sps = model_setup.load_sps(**run_params)
+# The marginalized calibration assumes uncorrelated noise given by obs['unc']
+marginalize_speccal = np.all(global_model.params.get('marginalize_speccal', False))
+if marginalize_speccal and (spec_noise is not None):
+    warnings.warn("The spectroscopic calibration marginalization is not "
+                  "consistent with a spectroscopic noise model, and will "
+                  "not be added to the likelihood.")
 
 # -----------------
 # LnP function as global
@@ -84,6 +91,10 @@ def lnprobfn(theta, model=None, obs=None, verbose=run_params['verbose']):
 
         # Calculate likelihoods
         lnp_spec = lnlike_spec(mu, obs=obs, spec_noise=spec_noise, **vectors)
+        # Marginalized calibration (zero unless the model marginalizes it),
+        # which is only valid without a spectroscopic noise model
+        if spec_noise is None:
+            lnp_spec += getattr(model, 'speccal_lnmarg', 0.0)
         lnp_phot = lnlike_phot(phot, obs=obs, phot_noise=phot_noise, **vectors)
 
         return lnp_phot + lnp_spec + lnp_prior
@@ -91,13 +102,6 @@ def lnprobfn(theta, model=None, obs=None, verbose=run_params['verbose']):
         return -np.infty
 
 
-def prior_transform(u, model=None):
-    if model is None:
-        model = global_model
-        
-    return model.prior_transform(u)
-
-
 pool = None
 nprocs = 1
 
@@ -143,7 +147,8 @@ if __name__ == "__main__":
     if rp['verbose']:
         print('dynesty sampling...')
     tstart = time.time()  # time it
-    dynestyout = fitting.run_dynesty_sampler(lnprobfn, prior_transform, model.ndim,
+    # The compiled prior transform is cheap to send to the pool processes
+    dynestyout = fitting.run_dynesty_sampler(lnprobfn, model.prior_transformer, model.ndim,
                                              pool=pool, queue_size=nprocs, 
                                              stop_function=stopping_function,
                                              wt_function=weight_function,